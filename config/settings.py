@@ -71,6 +71,19 @@ DATABASES = {
     )
 }
 
+# Cache: 'imports' lưu ra đĩa để mọi worker gunicorn dùng chung (bản xem trước file Excel)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'imports': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'import_cache',
+        'TIMEOUT': 1800,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+
 # Password validation (Giữ nguyên mặc định)
 
 LANGUAGE_CODE = 'vi' # Chuyển sang tiếng Việt
@@ -107,3 +120,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = '/'  # Đăng nhập xong về trang chủ
 LOGOUT_REDIRECT_URL = '/accounts/login/' # Đăng xuất xong về trang login
+
+# Log của app warehouse ra console (Railway gom log từ stdout/stderr)
+# Vd: thời gian xử lý + ghi từng ảnh tải lên (warehouse.images)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'warehouse': {'handlers': ['console'], 'level': os.environ.get('WAREHOUSE_LOG_LEVEL', 'INFO')},
+    },
+}
@@ -1,7 +1,5 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.conf import settings
-from django.views.static import serve # Dùng để phục vụ Media trên Railway
 from warehouse import views as warehouse_views # Import view để làm trang đăng ký
 
 urlpatterns = [
@@ -18,6 +16,6 @@ urlpatterns = [
     # 4. URLs của ứng dụng Kho (Warehouse)
     path('', include('warehouse.urls')),
 
-    # 5. Cấu hình phục vụ file Media trên Railway (BẮT BUỘC)
-    re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
+    # 5. Phục vụ file Media trên Railway (BẮT BUỘC) - yêu cầu đăng nhập, có ETag/304/Range (warehouse/media.py)
+    re_path(r'^media/(?P<path>.*)$', warehouse_views.serve_media, name='media'),
 ]
\ No newline at end of file
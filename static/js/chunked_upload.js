@@ -0,0 +1,104 @@
+// Tải ảnh theo từng đoạn trước khi lưu form (trang tạo/sửa phiếu, trả hàng).
+// Ô chọn ảnh có data-upload-url: khi bấm lưu, từng ảnh được gửi theo đoạn CHUNK qua api/uploads/,
+// mất mạng thì tự thử lại; hỏng hẳn thì bấm lưu lần nữa sẽ tải tiếp phần còn thiếu (không tải lại từ đầu).
+// Xong hết mới gửi form thật, chỉ kèm upload_ids thay cho file -> request lưu phiếu nhỏ.
+(function() {
+    var uploadIds = new WeakMap();  // File -> id upload trên server
+    var MAX_RETRIES = 5;
+
+    function sleep(ms) { return new Promise(function(resolve) { setTimeout(resolve, ms); }); }
+
+    async function send(url, options) {
+        // Mất mạng / lỗi 5xx -> chờ tăng dần rồi thử lại
+        options.credentials = 'same-origin';
+        options.headers = Object.assign({'X-CSRFToken': $('input[name=csrfmiddlewaretoken]').first().val()}, options.headers);
+        for (var attempt = 0; ; attempt++) {
+            try {
+                var res = await fetch(url, options);
+                if (res.status < 500) return res;
+            } catch (e) { /* mất kết nối */ }
+            if (attempt >= MAX_RETRIES) throw new Error('Mất kết nối khi tải ảnh.');
+            await sleep(Math.min(1000 * Math.pow(2, attempt), 15000));
+        }
+    }
+
+    async function uploadFile(baseUrl, file, onProgress) {
+        var state = null, id = uploadIds.get(file), res;
+        if (id) {  // đã tạo từ lần bấm lưu trước -> hỏi server đã nhận đến đâu
+            res = await send(baseUrl + id + '/', {method: 'GET'});
+            if (res.ok) state = await res.json();
+        }
+        if (!state) {
+            var data = new FormData();
+            data.append('file_name', file.name);
+            data.append('size', file.size);
+            res = await send(baseUrl, {method: 'POST', body: data});
+            state = await res.json();
+            if (!res.ok) throw new Error(file.name + ': ' + (state.error || 'không tải được ảnh.'));
+            uploadIds.set(file, state.id);
+        }
+        while (!state.complete) {
+            while (state.offset < state.size) {
+                res = await send(baseUrl + state.id + '/', {
+                    method: 'POST',
+                    body: file.slice(state.offset, state.offset + state.chunk_size),
+                    headers: {'Upload-Offset': String(state.offset), 'Content-Type': 'application/octet-stream'},
+                });
+                var body = await res.json();
+                // 409: lệch offset (đoạn trước đã tới server nhưng mất phản hồi) -> gửi tiếp từ offset server báo
+                if (!res.ok && res.status !== 409) throw new Error(file.name + ': ' + (body.error || 'không tải được ảnh.'));
+                state = body;
+                onProgress(state.offset);
+            }
+            res = await send(baseUrl + state.id + '/finish/', {method: 'POST'});
+            body = await res.json();
+            if (!res.ok && res.status !== 409) throw new Error(file.name + ': ' + (body.error || 'không tải được ảnh.'));
+            state = body;
+        }
+        return state.id;
+    }
+
+    $(document).on('submit', 'form', async function(e) {
+        var form = this;
+        if (e.isDefaultPrevented() || form.dataset.chunkedReady) return;
+        var inputs = $(form).find('input[type=file][data-upload-url]').filter(function() { return this.files.length > 0; });
+        if (!inputs.length) return;
+        e.preventDefault();
+        if (form.dataset.chunkedBusy) return;
+        form.dataset.chunkedBusy = '1';
+
+        var submitter = e.originalEvent && e.originalEvent.submitter;
+        var files = [];
+        inputs.each(function() {
+            var url = $(this).data('upload-url');
+            Array.from(this.files).forEach(function(file) { files.push([url, file]); });
+        });
+        var total = files.reduce(function(sum, item) { return sum + item[1].size; }, 0) || 1;
+        var done = 0;
+        var status = $(form).find('.chunked-upload-status');
+        if (!status.length) status = $('<div class="alert alert-info small py-2 chunked-upload-status"></div>').prependTo(form);
+        status.removeClass('alert-danger').addClass('alert-info').show();
+        $(form).find('input[name=upload_ids]').remove();
+
+        try {
+            for (var i = 0; i < files.length; i++) {
+                var id = await uploadFile(files[i][0], files[i][1], function(offset) {
+                    status.text('Đang tải ảnh ' + (i + 1) + '/' + files.length + ' (' + Math.floor((done + offset) * 100 / total) + '%)...');
+                });
+                done += files[i][1].size;
+                $('<input type="hidden" name="upload_ids">').val(id).appendTo(form);
+            }
+            status.text('Đã tải xong ' + files.length + ' ảnh, đang lưu...');
+            // Ảnh đã nằm trên server -> bỏ file khỏi form, gửi form thật
+            inputs.each(function() { this.removeAttribute('required'); this.value = ''; });
+            form.dataset.chunkedReady = '1';
+            if (form.requestSubmit) form.requestSubmit(submitter || undefined); else form.submit();
+        } catch (err) {
+            $(form).find('input[name=upload_ids]').remove();
+            status.removeClass('alert-info').addClass('alert-danger')
+                .text(err.message + ' Kiểm tra kết nối rồi bấm lưu lại, ảnh sẽ được tải tiếp phần còn thiếu.');
+        } finally {
+            delete form.dataset.chunkedBusy;
+        }
+    });
+})();
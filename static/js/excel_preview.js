@@ -0,0 +1,37 @@
+// Xem trước file Excel trên server (dùng chung cho các trang tạo/sửa phiếu).
+// Server đọc file 1 lần và cache kết quả theo nội dung file; khi lưu phiếu form chỉ gửi
+// import_token thay cho file -> không phải upload + đọc lại file lần nữa.
+function previewExcel(file) {
+    var input = $('#id_excel_file'), token = $('#id_import_token'), box = $('#excel-preview');
+    var url = input.data('preview-url');
+    token.val('');
+    if (!url) return;
+
+    var data = new FormData();
+    data.append('excel_file', file);
+    data.append('csrfmiddlewaretoken', $('input[name=csrfmiddlewaretoken]').first().val());
+    box.html('<span class="text-muted"><span class="spinner-border spinner-border-sm"></span> Đang đọc thử file trên máy chủ...</span>');
+
+    $.ajax({url: url, type: 'POST', data: data, processData: false, contentType: false})
+        .done(function(res) {
+            token.val(res.token);
+            input.val('');  // đã có bản xem trước -> không cần gửi lại file khi lưu
+            var summary = $('<div></div>').text(
+                'Đọc ' + res.rows_parsed + ' dòng: ' + res.rows_valid + ' dòng hợp lệ, ' + res.rows_rejected + ' dòng lỗi (sẽ bỏ qua).'
+            );
+            box.empty().append(summary);
+            if (res.row_errors.length) {
+                var list = $('<ul class="text-danger mb-0"></ul>').appendTo(box);
+                res.row_errors.forEach(function(err) { $('<li></li>').text('Dòng ' + err[0] + ': ' + err[1]).appendTo(list); });
+            }
+        })
+        .fail(function(xhr) {
+            var error = (xhr.responseJSON && xhr.responseJSON.error) || 'Không đọc thử được file, file sẽ được nhập khi lưu phiếu.';
+            box.empty().append($('<span class="text-danger"></span>').text(error));
+        });
+}
+
+$(document).on('click', '#btn-remove-excel', function() {
+    $('#id_import_token').val('');
+    $('#excel-preview').empty();
+});
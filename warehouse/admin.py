@@ -98,7 +98,7 @@ class PurchaseImageInline(admin.TabularInline):
             # SỬA LỖI: Tách biến ra khỏi chuỗi
             return format_html(
                 '<img src="{}" style="height: 50px; border-radius: 5px;" />',
-                obj.image.url
+                obj.thumb_url
             )
         return "-"
     preview_image.short_description = "Xem trước"
@@ -0,0 +1,107 @@
+from collections import Counter, defaultdict
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+
+from .media_gc import delete_on_commit
+from .models import MediaBlob, LoanImage, PurchaseImage, ExportImage
+from .storage import BLOB_DIR, is_blob_name, photo_storage
+
+# Đếm số dòng ảnh đang trỏ tới mỗi file trong kho lưu theo nội dung (storage.py):
+# - Thêm dòng ảnh -> retain (+1), xóa dòng / đổi ảnh -> release (-1)  (signal trong models.py, save_photos)
+# - Về 0 -> xóa file sau khi transaction commit (rollback thì file vẫn còn nguyên); file sót lại do lệnh sweep_media dọn
+# - Lệnh dedupe_media gọi recount() để tính lại toàn bộ từ DB
+PHOTO_MODELS = (LoanImage, PurchaseImage, ExportImage)
+PHOTO_FIELDS = ('image', 'thumbnail')
+BATCH_SIZE = 500  # số tên file mỗi câu IN (...), dưới giới hạn biến của SQLite
+
+
+def photo_names(instance):
+    return [getattr(instance, field).name for field in PHOTO_FIELDS if getattr(instance, field)]
+
+
+def _by_count(names):
+    """Gom tên file theo số lần xuất hiện -> mỗi nhóm 1 câu UPDATE"""
+    groups = defaultdict(list)
+    for name, count in Counter(name for name in names if is_blob_name(name)).items():
+        groups[count].append(name)
+    return groups
+
+
+def _size(name):
+    try:
+        return photo_storage.size(name)
+    except OSError:
+        return 0
+
+
+def _ensure_rows(names):
+    existing = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, size=_size(name)) for name in names if name not in existing],
+        ignore_conflicts=True,
+    )
+
+
+def retain(names):
+    groups = _by_count(names)
+    if not groups:
+        return
+    _ensure_rows([name for group in groups.values() for name in group])
+    for count, group in groups.items():
+        MediaBlob.objects.filter(name__in=group).update(refcount=F('refcount') + count)
+
+
+def release(names):
+    # File kiểu cũ (trước khi lưu theo nội dung): không đếm lượt dùng, kiểm tra lại DB lúc xóa
+    delete_on_commit([name for name in names if not is_blob_name(name)])
+    groups = _by_count(names)
+    if not groups:
+        return
+    for count, group in groups.items():
+        MediaBlob.objects.filter(name__in=group).update(refcount=F('refcount') - count)
+    released = [name for group in groups.values() for name in group]
+    unused = list(MediaBlob.objects.filter(name__in=released, refcount__lte=0).values_list('name', flat=True))
+    if unused:
+        transaction.on_commit(partial(_delete_unused, unused))
+
+
+def _delete_unused(names):
+    for name in names:
+        # Kiểm tra lại: trong lúc chờ commit có thể đã có người tải lên đúng ảnh này
+        deleted, _ = MediaBlob.objects.filter(name=name, refcount__lte=0).delete()
+        if deleted:
+            photo_storage.delete(name)
+
+
+def discard(names):
+    """File vừa ghi nhưng không tạo được dòng ảnh -> xóa, trừ khi đã có dòng khác dùng cùng file"""
+    in_use = set(MediaBlob.objects.filter(name__in=names, refcount__gt=0).values_list('name', flat=True))
+    for name in set(names) - in_use:
+        photo_storage.delete(name)
+
+
+def _batches(names):
+    for i in range(0, len(names), BATCH_SIZE):
+        yield names[i:i + BATCH_SIZE]
+
+
+def recount():
+    """Tính lại refcount của mọi file từ các dòng ảnh trong DB -> (số file đang dùng, số file không còn ai dùng)"""
+    counts = Counter()
+    for model in PHOTO_MODELS:
+        for field in PHOTO_FIELDS:
+            names = model.objects.filter(**{f'{field}__startswith': f'{BLOB_DIR}/'}).values_list(field, flat=True)
+            counts.update(names.iterator())
+    groups = defaultdict(list)
+    for name, count in counts.items():
+        groups[count].append(name)
+    with transaction.atomic():
+        for batch in _batches(list(counts)):
+            _ensure_rows(batch)
+        MediaBlob.objects.update(refcount=0)
+        for count, group in groups.items():
+            for batch in _batches(group):
+                MediaBlob.objects.filter(name__in=batch).update(refcount=count)
+    return len(counts), MediaBlob.objects.filter(refcount__lte=0).count()
@@ -0,0 +1,222 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import Employee
+from .search import fold_text
+
+# Danh bạ nhân viên trong bộ nhớ cho ô gợi ý (dùng khi DB không phải Postgres); tra đúng mã luôn qua DB
+DIRECTORY_VERSION_KEY = 'employee_directory_version'
+DIRECTORY_MAX_AGE = 300  # giây: tự dựng lại để bắt thay đổi từ process khác
+SEARCH_LIMIT = 10
+
+FIELDS = ('ma_nhan_vien', 'ho_ten', 'email', 'chuc_vu', 'phong_ban')
+
+
+def employee_search_text(emp):
+    """Nội dung cột search_text của Employee: mã + họ tên, đã bỏ dấu"""
+    return fold_text(f'{emp.ma_nhan_vien} {emp.ho_ten}')
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = []
+
+
+class PrefixTrie:
+    """
+    Cây tiền tố: mỗi nút giữ danh sách chỉ số nhân viên có từ bắt đầu bằng tiền tố đó,
+    theo đúng thứ tự đã thêm vào (tức thứ tự xếp hạng), nên chỉ cần đọc N phần tử đầu.
+    """
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, token, idx):
+        node = self.root
+        for ch in token:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _TrieNode()
+            node = child
+            if not node.ids or node.ids[-1] != idx:
+                node.ids.append(idx)
+
+    def find(self, prefix):
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def freeze(self):
+        """Đổi list -> array để giảm bộ nhớ sau khi dựng xong"""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.ids = array('I', node.ids)
+            stack.extend(node.children.values())
+
+
+class EmployeeDirectory:
+    """Danh bạ nhân viên đã chuẩn hóa (bỏ dấu) + 2 cây tiền tố: theo mã và theo từng chữ trong tên"""
+
+    def __init__(self, rows, version=0):
+        self.version = version
+        self.built_at = time.monotonic()
+        # Xếp theo tên (bỏ dấu) rồi mã -> thứ tự hiển thị trong nhóm khớp tên
+        rows = sorted(rows, key=lambda r: (fold_text(r[1]), r[0]))
+        self.records = [tuple(r) for r in rows]
+        self.by_code = {}
+        self.codes = PrefixTrie()
+        self.names = PrefixTrie()
+
+        for idx in sorted(range(len(rows)), key=lambda i: rows[i][0]):
+            code = fold_text(rows[idx][0]).replace(' ', '')
+            self.by_code.setdefault(code, idx)
+            self.codes.add(code, idx)
+        # Thêm theo idx tăng dần -> mảng ids ở mỗi nút luôn được sắp xếp (để giao nhanh)
+        for idx, record in enumerate(self.records):
+            for token in fold_text(record[1]).split():
+                self.names.add(token, idx)
+        self.codes.freeze()
+        self.names.freeze()
+
+    @classmethod
+    def build(cls, version=0):
+        return cls(Employee.objects.values_list(*FIELDS).iterator(chunk_size=5000), version)
+
+    def as_dict(self, idx):
+        return dict(zip(FIELDS, self.records[idx]))
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Thứ tự kết quả: trùng mã chính xác -> mã bắt đầu bằng từ khóa
+        -> tên chứa tất cả các từ khóa (mỗi từ khớp tiền tố một chữ trong tên).
+        """
+        q = fold_text(query)
+        if not q:
+            return []
+        results, seen = [], set()
+
+        def take(idx):
+            if idx not in seen:
+                seen.add(idx)
+                results.append(idx)
+            return len(results) >= limit
+
+        compact = q.replace(' ', '')
+        exact = self.by_code.get(compact)
+        if exact is not None:
+            take(exact)
+        node = self.codes.find(compact)
+        if node is not None and len(results) < limit:
+            for idx in node.ids:
+                if take(idx):
+                    break
+
+        nodes = [self.names.find(t) for t in q.split()]
+        if len(results) < limit and all(n is not None for n in nodes):
+            for idx in _intersect([n.ids for n in nodes], limit + len(results)):
+                if take(idx):
+                    break
+
+        return [self.as_dict(idx) for idx in results]
+
+
+def _intersect(arrays, limit):
+    """
+    Giao các mảng chỉ số tăng dần theo kiểu leapfrog: mỗi bước nhảy bằng bisect
+    tới phần tử kế tiếp có thể khớp, nên không phải duyệt hết mảng lớn.
+    """
+    if any(len(a) == 0 for a in arrays):
+        return []
+    found = []
+    positions = [0] * len(arrays)
+    target = max(a[0] for a in arrays)
+    while True:
+        for i, ids in enumerate(arrays):
+            pos = bisect_left(ids, target, positions[i])
+            if pos == len(ids):
+                return found
+            positions[i] = pos
+            if ids[pos] != target:
+                target = ids[pos]
+                break
+        else:
+            found.append(target)
+            if len(found) >= limit:
+                return found
+            target += 1
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_directory():
+    """Lấy danh bạ trong bộ nhớ, dựng lại khi Employee thay đổi hoặc quá hạn"""
+    global _directory
+    version = cache.get(DIRECTORY_VERSION_KEY, 0)
+    directory = _directory
+    if directory is None or directory.version != version or time.monotonic() - directory.built_at > DIRECTORY_MAX_AGE:
+        with _directory_lock:
+            directory = _directory
+            if directory is None or directory.version != version or time.monotonic() - directory.built_at > DIRECTORY_MAX_AGE:
+                directory = _directory = EmployeeDirectory.build(version)
+    return directory
+
+
+def invalidate_employee_directory():
+    """Gọi khi Employee thay đổi (xem signal trong models.py)"""
+    global _directory
+    _directory = None
+    try:
+        cache.incr(DIRECTORY_VERSION_KEY)
+    except ValueError:
+        cache.set(DIRECTORY_VERSION_KEY, 1, None)
+
+
+def _use_database():
+    # Postgres có index trigram (pg_trgm) trên search_text -> tìm thẳng trong DB
+    return connection.vendor == 'postgresql'
+
+
+def search_employees(query, limit=SEARCH_LIMIT):
+    """Gợi ý nhân viên cho ô nhập mã NV, đã xếp hạng (trùng mã chính xác lên đầu)"""
+    query = (query or '').strip()
+    if not query:
+        return []
+    if not _use_database():
+        return get_directory().search(query, limit)
+
+    employees = Employee.objects.all()
+    for token in fold_text(query).split():
+        employees = employees.filter(search_text__contains=token)
+    employees = employees.annotate(match_rank=Case(
+        When(ma_nhan_vien__iexact=query, then=Value(0)),
+        When(ma_nhan_vien__istartswith=query, then=Value(1)),
+        default=Value(2), output_field=IntegerField(),
+    )).order_by('match_rank', 'search_text')
+    return list(employees.values(*FIELDS)[:limit])
+
+
+def find_employee(code):
+    """
+    Tra cứu chính xác theo mã NV -> dict hoặc None.
+    Luôn hỏi DB (1 query theo khóa unique): danh bạ trong bộ nhớ có thể cũ tới DIRECTORY_MAX_AGE giây,
+    chỉ dùng cho gợi ý, không dùng để kiểm tra mã khi lưu phiếu.
+    """
+    code = (code or '').strip()
+    if not code:
+        return None
+    return Employee.objects.filter(ma_nhan_vien=code).values(*FIELDS).first()
@@ -0,0 +1,190 @@
+import csv
+import datetime
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from .models import LoanSlip, LoanItem, PurchaseSlip, PurchaseItem, ExportSlip, ExportItem
+
+# Tải danh sách phiếu (hoặc toàn bộ vật tư của các phiếu) theo đúng bộ lọc đang xem:
+# - Chỉ lấy các cột cần (values_list) và đọc từng lô bằng .iterator() -> không dựng model, bộ nhớ không tăng theo số dòng
+# - CSV: StreamingHttpResponse, ghi tới đâu gửi tới đó
+# - XLSX: openpyxl write_only ghi ra file tạm rồi trả FileResponse
+CHUNK_SIZE = 2000
+
+PERSON_COLUMNS = [('ma_nhan_vien', 'Mã NV'), ('phong_ban', 'Phòng ban'), ('chuc_vu', 'Chức vụ'), ('email', 'Email')]
+
+# Loại phiếu trên URL -> model phiếu, cột của danh sách phiếu, model vật tư + FK, cột của vật tư
+EXPORTS = {
+    'loan': {
+        'title': 'phieu_muon',
+        'slip_model': LoanSlip,
+        'slip_columns': [('id', 'Số phiếu'), ('nguoi_muon', 'Người mượn')] + PERSON_COLUMNS + [
+            ('ly_do', 'Lý do'), ('ngay_muon', 'Ngày mượn'), ('ngay_tra_du_kien', 'Ngày trả dự kiến'),
+            ('ngay_tao', 'Ngày tạo'), ('status', 'Trạng thái'),
+        ],
+        'item_model': LoanItem,
+        'fk': 'loan',
+        'item_columns': [
+            ('ten_tai_san', 'Tên tài sản'), ('don_vi_tinh', 'ĐVT'), ('so_luong', 'Số lượng'),
+            ('tinh_trang', 'Tình trạng'), ('tinh_trang_khac', 'Chi tiết tình trạng'), ('ghi_chu', 'Ghi chú'),
+        ],
+        'person': ('nguoi_muon', 'Người mượn'),
+    },
+    'purchase': {
+        'title': 'phieu_mua',
+        'slip_model': PurchaseSlip,
+        'slip_columns': [('id', 'Số phiếu'), ('nguoi_de_xuat', 'Người đề xuất')] + PERSON_COLUMNS + [
+            ('nha_cung_cap', 'Nhà cung cấp'), ('ly_do', 'Lý do'), ('ngay_tao', 'Ngày tạo'), ('status', 'Trạng thái'),
+        ],
+        'item_model': PurchaseItem,
+        'fk': 'slip',
+        'item_columns': [
+            ('ten_hang_hoa', 'Tên hàng hóa'), ('don_vi_tinh', 'ĐVT'), ('so_luong', 'Số lượng'), ('ghi_chu', 'Ghi chú'),
+        ],
+        'person': ('nguoi_de_xuat', 'Người đề xuất'),
+    },
+    'export': {
+        'title': 'phieu_xuat',
+        'slip_model': ExportSlip,
+        'slip_columns': [('id', 'Số phiếu'), ('nguoi_de_xuat', 'Người đề xuất')] + PERSON_COLUMNS + [
+            ('ly_do', 'Lý do'), ('ngay_tao', 'Ngày tạo'), ('status', 'Trạng thái'),
+        ],
+        'item_model': ExportItem,
+        'fk': 'slip',
+        'item_columns': [
+            ('ten_hang_hoa', 'Tên hàng hóa'), ('don_vi_tinh', 'ĐVT'), ('so_luong', 'Số lượng'), ('ghi_chu', 'Ghi chú'),
+        ],
+        'person': ('nguoi_de_xuat', 'Người đề xuất'),
+    },
+}
+
+
+def _ordered(queryset, sort, fk=None):
+    """Sắp xếp giống trang danh sách: (cột sort, id). fk: sắp xếp vật tư theo phiếu, trong phiếu theo id"""
+    desc = sort.startswith('-')
+    field = sort.lstrip('-')
+    sign = '-' if desc else ''
+    if fk is None:
+        return queryset.order_by(sort) if field == 'id' else queryset.order_by(sort, f'{sign}id')
+    if field == 'search_rank':  # độ khớp chỉ có trên queryset phiếu -> phiếu mới trước
+        return queryset.order_by(f'-{fk}_id', 'id')
+    if field == 'id':
+        return queryset.order_by(f'{sign}{fk}_id', 'id')
+    return queryset.order_by(f'{sign}{fk}__{field}', f'{sign}{fk}_id', 'id')
+
+
+def export_columns(kind, scope):
+    """-> danh sách (đường dẫn cột cho values_list, tiêu đề cột)"""
+    spec = EXPORTS[kind]
+    if scope == 'slips':
+        return spec['slip_columns']
+    fk = spec['fk']
+    person, person_label = spec['person']
+    return [
+        (f'{fk}_id', 'Số phiếu'), (f'{fk}__{person}', person_label), (f'{fk}__phong_ban', 'Phòng ban'),
+        (f'{fk}__ngay_tao', 'Ngày tạo phiếu'), (f'{fk}__status', 'Trạng thái phiếu'),
+    ] + spec['item_columns']
+
+
+def export_rows(kind, scope, slips, sort):
+    """
+    Các dòng dữ liệu (tuple giá trị thô) của file tải xuống, đọc từng lô CHUNK_SIZE dòng.
+    slips: queryset phiếu đã lọc (filters.filter_slip_list); scope: 'slips' hoặc 'items'
+    """
+    spec = EXPORTS[kind]
+    fields = [path for path, _ in export_columns(kind, scope)]
+    if scope == 'slips':
+        queryset = _ordered(slips, sort)
+    else:
+        fk = spec['fk']
+        queryset = spec['item_model'].objects.filter(**{f'{fk}__in': slips.order_by().values('pk')})
+        queryset = _ordered(queryset, sort, fk=fk)
+    return queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _converters(kind, scope):
+    """Mỗi cột -> hàm đổi mã (trạng thái, tình trạng) sang nhãn hiển thị, hoặc None"""
+    spec = EXPORTS[kind]
+    choices = {
+        'status': dict(spec['slip_model'].STATUS_CHOICES),
+        'tinh_trang': dict(LoanItem.TINH_TRANG_CHOICES),
+    }
+    converters = []
+    for path, _ in export_columns(kind, scope):
+        name = path.split('__')[-1]
+        if name in choices:
+            converters.append(lambda v, c=choices[name]: c.get(v, v))
+        else:
+            converters.append(None)
+    return converters
+
+
+def _clean(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).replace(tzinfo=None) if timezone.is_aware(value) else value
+    if isinstance(value, str):
+        value = ILLEGAL_CHARACTERS_RE.sub('', value)
+        # Chặn công thức khi mở bằng Excel (CSV/formula injection)
+        if value[:1] in ('=', '+', '-', '@'):
+            value = "'" + value
+    return value
+
+
+def _display_rows(kind, scope, rows):
+    converters = _converters(kind, scope)
+    for row in rows:
+        yield [_clean(conv(v) if conv else v) for conv, v in zip(converters, row)]
+
+
+def export_filename(kind, scope, fmt):
+    prefix = 'vat_tu' if scope == 'items' else 'danh_sach'
+    return f"{prefix}_{EXPORTS[kind]['title']}_{timezone.localdate():%Y%m%d}.{fmt}"
+
+
+class _Echo:
+    """csv.writer ghi vào đây -> trả lại luôn chuỗi vừa ghi để stream"""
+
+    def write(self, value):
+        return value
+
+
+def _format_csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d/%m/%Y %H:%M')
+    if isinstance(value, datetime.date):
+        return value.strftime('%d/%m/%Y')
+    return '' if value is None else value
+
+
+def csv_response(kind, scope, slips, sort):
+    headers = [label for _, label in export_columns(kind, scope)]
+    writer = csv.writer(_Echo())
+
+    def stream():
+        yield '\ufeff'  # BOM để Excel nhận đúng UTF-8 (tiếng Việt)
+        yield writer.writerow(headers)
+        for row in _display_rows(kind, scope, export_rows(kind, scope, slips, sort)):
+            yield writer.writerow([_format_csv_value(v) for v in row])
+
+    response = StreamingHttpResponse(stream(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(kind, scope, "csv")}"'
+    return response
+
+
+def xlsx_response(kind, scope, slips, sort):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Danh sách' if scope == 'slips' else 'Vật tư')
+    sheet.append([label for _, label in export_columns(kind, scope)])
+    for row in _display_rows(kind, scope, export_rows(kind, scope, slips, sort)):
+        sheet.append(row)
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
+    output.seek(0)
+    return FileResponse(
+        output, as_attachment=True, filename=export_filename(kind, scope, 'xlsx'),
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
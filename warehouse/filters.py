@@ -0,0 +1,69 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .search import search_slips
+
+
+def _parse_day(value):
+    """Chuỗi 'YYYY-MM-DD' từ ô input date -> date (sai định dạng thì bỏ qua)"""
+    if not value:
+        return None
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
+
+
+def local_day_start(day):
+    """0h00 của ngày `day` theo múi giờ địa phương (TIME_ZONE)"""
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def filter_created_between(queryset, date_from, date_to, field='ngay_tao'):
+    """
+    Lọc theo ngày tạo bằng khoảng nửa mở [từ 0h ngày đầu, 0h ngày sau ngày cuối).
+    Không dùng __date vì bọc cột trong hàm sẽ làm DB bỏ qua index.
+    """
+    day_from = _parse_day(date_from)
+    day_to = _parse_day(date_to)
+    if day_from:
+        queryset = queryset.filter(**{f'{field}__gte': local_day_start(day_from)})
+    if day_to:
+        next_day = day_to + datetime.timedelta(days=1)
+        queryset = queryset.filter(**{f'{field}__lt': local_day_start(next_day)})
+    return queryset
+
+
+def filter_slip_list(queryset, params, valid_sort):
+    """
+    Bộ lọc + sắp xếp chung của các trang danh sách phiếu (dùng cả cho trang danh sách và file tải xuống).
+    params: request.GET (q, status, dept, date_from, date_to, sort)
+    -> (queryset đã lọc, sort hợp lệ, các giá trị lọc để hiển thị lại trên form)
+    """
+    current = {
+        'current_search': params.get('q', ''),
+        'current_status': params.get('status', ''),
+        'current_dept': params.get('dept', ''),
+        'current_date_from': params.get('date_from'),
+        'current_date_to': params.get('date_to'),
+    }
+    search_query = current['current_search']
+    if search_query:
+        # Full-text không dấu ("Nguyen" khớp "Nguyễn"), gõ đúng số phiếu thì tra theo khóa chính
+        queryset = search_slips(queryset, search_query)
+    if current['current_status']:
+        queryset = queryset.filter(status=current['current_status'])
+    if current['current_dept']:
+        queryset = queryset.filter(phong_ban__icontains=current['current_dept'])
+    # Khoảng nửa mở theo giờ địa phương để DB dùng được index trên ngay_tao
+    queryset = filter_created_between(queryset, current['current_date_from'], current['current_date_to'])
+
+    # Đang tìm kiếm mà không chọn cột sắp xếp -> xếp theo độ khớp
+    sort_by = params.get('sort') or ('-search_rank' if search_query else '-id')
+    valid_sort = list(valid_sort) + (['search_rank'] if search_query else [])
+    if sort_by.lstrip('-') not in valid_sort:
+        sort_by = '-id'
+    current['current_sort'] = sort_by
+    return queryset, sort_by, current
@@ -4,16 +4,24 @@ from django.contrib.auth.models import User
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column
 from django.forms import inlineformset_factory
+from django.urls import reverse_lazy
 from .models import LoanSlip, LoanItem, Employee, LoanImage
 from .models import UserProfile # Nhớ import model này
 from .models import PurchaseSlip, PurchaseItem # Import thêm
 from .models import ExportSlip, ExportItem # Import thêm
+from .employees import find_employee
 # ==========================================
 # 1. WIDGET TÙY CHỈNH (UPLOAD NHIỀU ẢNH)
 # ==========================================
 class MultipleFileInput(forms.ClearableFileInput):
     allow_multiple_selected = True
 
+# Ô chọn ảnh đính kèm phiếu: data-upload-url -> static/js/chunked_upload.js tải ảnh theo từng đoạn trước khi lưu form
+PHOTO_INPUT_ATTRS = {
+    'multiple': True, 'accept': 'image/*', 'capture': 'environment',
+    'data-upload-url': reverse_lazy('api_upload_start'),
+}
+
 class MultipleFileField(forms.FileField):
     def __init__(self, *args, **kwargs):
         kwargs.setdefault("widget", MultipleFileInput())
@@ -65,8 +73,10 @@ class RegistrationForm(UserCreationForm):
 
 # Form Cha
 class ExportSlipForm(forms.ModelForm):
-    excel_file = forms.FileField(label="Import Excel", required=False, widget=forms.FileInput(attrs={'accept': '.xlsx, .xls'}))
-    photos = MultipleFileField(label="Ảnh đính kèm", required=False, widget=MultipleFileInput(attrs={'multiple': True, 'accept': 'image/*', 'capture': 'environment'}))
+    excel_file = forms.FileField(label="Import Excel", required=False, widget=forms.FileInput(attrs={
+        'accept': '.xlsx, .xls', 'data-preview-url': reverse_lazy('api_import_preview', args=['export'])}))
+    import_token = forms.CharField(required=False, widget=forms.HiddenInput)  # token bản xem trước Excel
+    photos = MultipleFileField(label="Ảnh đính kèm", required=False, widget=MultipleFileInput(attrs=PHOTO_INPUT_ATTRS))
 
     class Meta:
         model = ExportSlip
@@ -98,13 +108,15 @@ class LoanSlipForm(forms.ModelForm):
     # Field ảo: Import Excel
     excel_file = forms.FileField(
         label="Import Excel (Tên, ĐVT, SL)", required=False,
-        widget=forms.FileInput(attrs={'accept': '.xlsx, .xls'})
+        widget=forms.FileInput(attrs={
+            'accept': '.xlsx, .xls', 'data-preview-url': reverse_lazy('api_import_preview', args=['loan'])})
     )
+    import_token = forms.CharField(required=False, widget=forms.HiddenInput)  # token bản xem trước Excel
     
     # Field ảo: Upload nhiều ảnh
     photos = MultipleFileField(
         label="Ảnh hiện trạng (Chọn nhiều/Chụp ảnh)", required=False,
-        widget=MultipleFileInput(attrs={'multiple': True, 'accept': 'image/*', 'capture': 'environment'})
+        widget=MultipleFileInput(attrs=PHOTO_INPUT_ATTRS)
     )
 
     class Meta:
@@ -123,8 +135,8 @@ class LoanSlipForm(forms.ModelForm):
     def clean_ma_nhan_vien(self):
         ma = self.cleaned_data.get('ma_nhan_vien')
         if ma:
-            # Kiểm tra xem mã có trong database không
-            if not Employee.objects.filter(ma_nhan_vien=ma).exists():
+            # Kiểm tra xem mã có trong danh bạ nhân viên không
+            if find_employee(ma) is None:
                 raise forms.ValidationError("❌ Mã nhân viên này không tồn tại trong hệ thống!")
         return ma
 
@@ -161,8 +173,10 @@ class ReturnLoanForm(forms.Form):
     # Form này không kế thừa ModelForm vì ta chỉ cần xử lý ảnh và ghi chú trả
     return_images = MultipleFileField(
         label="Ảnh trả hàng (Chụp ảnh tình trạng khi trả)",
-        required=True, # Bắt buộc phải có ảnh mới cho trả
-        widget=MultipleFileInput(attrs={'multiple': True, 'accept': 'image/*', 'capture': 'environment'})
+        # Bắt buộc phải có ảnh mới cho trả: kiểm tra trong clean() vì ảnh có thể đã tải trước
+        # theo từng đoạn (api/uploads/), khi đó form chỉ gửi upload_ids
+        required=False,
+        widget=MultipleFileInput(attrs=dict(PHOTO_INPUT_ATTRS, required=True))
     )
     ghi_chu_tra = forms.CharField(
         label="Ghi chú tình trạng trả (Hư hỏng/Mất mát...)",
@@ -170,6 +184,12 @@ class ReturnLoanForm(forms.Form):
         widget=forms.Textarea(attrs={'rows': 3})
     ) 
 
+    def clean(self):
+        cleaned_data = super().clean()
+        if not cleaned_data.get('return_images') and not any(self.data.getlist('upload_ids')):
+            self.add_error('return_images', self.fields['return_images'].error_messages['required'])
+        return cleaned_data
+
 # === 2. TẠO FORMSET (QUẢN LÝ DANH SÁCH) ===
 LoanItemFormSet = inlineformset_factory(
     LoanSlip, LoanItem,
@@ -203,7 +223,10 @@ class ProfileUpdateForm(forms.ModelForm):
     # Hoặc dùng mặc định cho đơn giản. Ở đây dùng mặc định của Crispy.
 # === FORM PHIẾU MUA HÀNG ===
 class PurchaseSlipForm(forms.ModelForm):
-    excel_file = forms.FileField(label="Import Excel", required=False, widget=forms.FileInput(attrs={'accept': '.xlsx, .xls'}))
+    excel_file = forms.FileField(label="Import Excel", required=False, widget=forms.FileInput(attrs={
+        'accept': '.xlsx, .xls', 'data-preview-url': reverse_lazy('api_import_preview', args=['purchase'])}))
+    import_token = forms.CharField(required=False, widget=forms.HiddenInput)  # token bản xem trước Excel
+    photos = MultipleFileField(label="Ảnh / báo giá đính kèm", required=False, widget=MultipleFileInput(attrs=PHOTO_INPUT_ATTRS))
     
     class Meta:
         model = PurchaseSlip
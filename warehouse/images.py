@@ -0,0 +1,132 @@
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .blobs import discard, photo_names, retain
+
+logger = logging.getLogger(__name__)
+
+# Xử lý ảnh đính kèm phiếu ngay khi tải lên (ảnh điện thoại gốc 8-12 MB):
+# - Xoay ảnh theo EXIF orientation rồi bỏ toàn bộ metadata (EXIF, GPS, XMP)
+# - Thu nhỏ cạnh dài nhất về IMAGE_MAX_EDGE, nén lại (WebP mặc định, hoặc JPEG)
+# - Tạo ảnh thu nhỏ cỡ cố định THUMB_SIZE (field thumbnail; file lưu theo nội dung, xem storage.py)
+# Trang chi tiết / admin hiển thị ảnh thu nhỏ, bấm vào mới mở ảnh đã nén.
+# Tải nhiều ảnh 1 lần (save_photos): xử lý + ghi file song song trong thread pool
+# (Pillow nhả GIL khi giải mã / nén), rồi thêm tất cả dòng bằng 1 câu bulk_create.
+IMAGE_MAX_EDGE = getattr(settings, 'IMAGE_MAX_EDGE', 2048)
+IMAGE_QUALITY = getattr(settings, 'IMAGE_QUALITY', 82)
+IMAGE_FORMAT = getattr(settings, 'IMAGE_FORMAT', 'WEBP').upper()  # 'WEBP' hoặc 'JPEG'
+THUMB_SIZE = getattr(settings, 'IMAGE_THUMB_SIZE', (400, 400))
+THUMB_QUALITY = getattr(settings, 'IMAGE_THUMB_QUALITY', 75)
+UPLOAD_WORKERS = getattr(settings, 'IMAGE_UPLOAD_WORKERS', min(4, os.cpu_count() or 1))
+
+EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def _open(source):
+    source.seek(0)
+    img = Image.open(source)
+    # JPEG: giải mã thẳng ở tỉ lệ 1/2, 1/4, 1/8 nếu đủ lớn -> nhanh và ít RAM hơn nhiều so với giải mã full 12MP
+    img.draft('RGB', (IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+    img = ImageOps.exif_transpose(img)
+    if IMAGE_FORMAT == 'JPEG' or img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if IMAGE_FORMAT == 'WEBP' and 'A' in img.getbands() else 'RGB')
+    return img
+
+
+def _encode(img, quality):
+    # Không truyền exif= / xmp= -> ảnh lưu ra không còn metadata
+    output = io.BytesIO()
+    if IMAGE_FORMAT == 'WEBP':
+        img.save(output, 'WEBP', quality=quality, method=4)
+    else:
+        img.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def process_image(source):
+    """File ảnh gốc -> (bytes ảnh đã nén, bytes ảnh thu nhỏ). Ném UnidentifiedImageError / OSError nếu không đọc được"""
+    img = _open(source)
+    img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.Resampling.LANCZOS)
+    main = _encode(img, IMAGE_QUALITY)
+    img.thumbnail(THUMB_SIZE, Image.Resampling.LANCZOS)
+    return main, _encode(img, THUMB_QUALITY)
+
+
+def ingest_image(instance):
+    """
+    Gọi trước khi lưu LoanImage / PurchaseImage / ExportImage có ảnh mới tải lên:
+    thay ảnh gốc bằng bản đã xử lý và gắn ảnh thu nhỏ. File không đọc được thì giữ nguyên ảnh gốc.
+    """
+    upload = instance.image
+    try:
+        main, thumb = process_image(upload)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as exc:
+        logger.warning("Không xử lý được ảnh %s: %s", upload.name, exc)
+        return False
+    stem = os.path.splitext(os.path.basename(upload.name))[0]
+    ext = EXTENSIONS[IMAGE_FORMAT]
+    instance.image = ContentFile(main, name=f'{stem}.{ext}')
+    instance.thumbnail = ContentFile(thumb, name=f'{stem}_thumb.{ext}')
+    return True
+
+
+def _prepare_photo(model, fields, upload):
+    """Chạy trong thread: xử lý ảnh và ghi file xuống storage, chưa ghi DB"""
+    start = time.perf_counter()
+    size_in = upload.size
+    instance = model(image=upload, **fields)
+    ingest_image(instance)
+    processed = time.perf_counter()
+    for field in (instance.image, instance.thumbnail):
+        if field and not field._committed:
+            field.save(field.name, field.file, save=False)
+    done = time.perf_counter()
+    logger.info(
+        "Ảnh %s: %d KB -> %d KB, xử lý %.0f ms, ghi file %.0f ms",
+        upload.name, size_in // 1024, instance.image.size // 1024,
+        (processed - start) * 1000, (done - processed) * 1000,
+    )
+    return instance
+
+
+def save_photos(model, uploads, **fields):
+    """
+    Lưu nhiều ảnh tải lên (LoanImage / PurchaseImage / ExportImage) cùng lúc.
+    fields: giá trị chung cho mọi dòng, vd loan=loan, image_type='return'. Trả về danh sách ảnh đã tạo.
+    """
+    uploads = list(uploads)
+    if not uploads:
+        return []
+    start = time.perf_counter()
+    workers = max(1, min(UPLOAD_WORKERS, len(uploads)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_prepare_photo, model, fields, upload) for upload in uploads]
+
+    photos, error = [], None
+    for future in futures:
+        try:
+            photos.append(future.result())
+        except Exception as exc:
+            error = error or exc
+    try:
+        if error is not None:
+            raise error
+        # bulk_create không gửi pre_save -> ảnh không bị xử lý lần 2; file đã ghi nên field.pre_save bỏ qua
+        photos = model.objects.bulk_create(photos)
+        retain([name for photo in photos for name in photo_names(photo)])  # bulk_create không gửi post_save
+    except Exception:
+        # Lỗi giữa chừng -> không để lại file mồ côi (file trùng nội dung với ảnh khác thì giữ)
+        discard([name for photo in photos for name in photo_names(photo)])
+        raise
+    logger.info(
+        "Lưu %d ảnh %s trong %.0f ms (%d luồng)",
+        len(photos), model.__name__, (time.perf_counter() - start) * 1000, workers,
+    )
+    return photos
@@ -0,0 +1,137 @@
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .import_preview import cached_preview
+from .importer import ImportResult, import_items, insert_chunks
+from .pdf_cache import invalidate_slip_pdf
+from .models import ImportJob, LoanSlip, LoanItem, PurchaseSlip, PurchaseItem, ExportSlip, ExportItem
+
+# Import Excel chạy nền:
+# - View tạo phiếu ngay, chỉ lưu file upload + 1 dòng ImportJob -> thời gian request không tăng theo file
+# - Sau khi commit, 1 thread nền đọc file và thêm vật tư theo từng lô (mỗi lô commit riêng),
+#   cập nhật số dòng đã đọc / đã thêm / lỗi để trang web hỏi tiến độ
+# - Mỗi dòng thêm vào mang import_job_id -> job lỗi (kể cả process chết giữa chừng) thì xóa hết
+#   các dòng đã thêm, phiếu không bị giữ lại nửa danh sách
+# - Đã xem trước file (import_preview.py) -> job lấy từng lô dòng đã chuẩn hóa từ cache,
+#   cache thiếu lô thì đọc lại file upload (nếu form gửi kèm)
+# - Job không được chạy (process web chết trước khi kịp bắt đầu) -> lệnh process_import_jobs làm tiếp
+RUN_ON_COMMIT = getattr(settings, 'IMPORT_RUN_ON_COMMIT', True)
+MAX_STORED_ERRORS = 50  # chỉ lưu 50 dòng lỗi đầu tiên để hiển thị
+
+# model_name của phiếu -> (model phiếu, model vật tư)
+SLIP_ITEM_MODELS = {
+    slip_model._meta.model_name: (slip_model, item_model)
+    for slip_model, item_model in ((LoanSlip, LoanItem), (PurchaseSlip, PurchaseItem), (ExportSlip, ExportItem))
+}
+
+
+def enqueue_import(slip, excel_file=None, user=None, preview=None):
+    """
+    Tạo job import cho phiếu (chạy sau khi transaction hiện tại commit).
+    excel_file: file upload (được lưu lại), và/hoặc preview: bản tóm tắt từ build_preview.
+    Có cả hai thì ưu tiên các lô trong cache, cache thiếu lô nào thì đọc lại file.
+    """
+    job = ImportJob.objects.create(
+        kind=slip._meta.model_name, slip_id=slip.pk,
+        file=excel_file,
+        file_name=(excel_file.name if excel_file is not None else preview['file_name'])[:255],
+        preview_token=preview['token'] if preview is not None else '',
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    if RUN_ON_COMMIT:
+        transaction.on_commit(partial(_run_in_background, job.pk))
+    return job
+
+
+def _run_in_background(job_id):
+    def run():
+        try:
+            run_job(job_id)
+        finally:
+            connection.close()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def claim_job(job_id):
+    """pending -> running bằng UPDATE có điều kiện: 2 worker không chạy trùng 1 job"""
+    return ImportJob.objects.filter(pk=job_id, status='pending').update(
+        status='running', started_at=timezone.now()
+    ) == 1
+
+
+def _finish(job_id, error='', result=None):
+    fields = {'status': 'failed' if error else 'done', 'error': error, 'finished_at': timezone.now()}
+    if result is not None:
+        fields.update(
+            rows_parsed=result.parsed, rows_inserted=result.created, rows_rejected=result.rejected,
+            row_errors=result.errors[:MAX_STORED_ERRORS],
+        )
+    ImportJob.objects.filter(pk=job_id).update(**fields)
+
+
+def fail_job(job, error, status='running'):
+    """
+    Báo lỗi job đang ở trạng thái `status` và xóa các dòng vật tư job đã thêm (cùng 1 transaction)
+    -> True nếu giành được job (worker khác chưa kết thúc nó)
+    """
+    item_model = SLIP_ITEM_MODELS[job.kind][1]
+    with transaction.atomic():
+        claimed = ImportJob.objects.filter(pk=job.pk, status=status).update(
+            status='failed', error=error, rows_inserted=0, finished_at=timezone.now()
+        )
+        if claimed:
+            item_model.objects.filter(import_job_id=job.pk).delete()
+    if claimed:
+        # delete() hàng loạt không qua signal của phiếu -> tự bỏ PDF đã cache
+        invalidate_slip_pdf(job.kind, job.slip_id)
+    return bool(claimed)
+
+
+def _progress(job_id, result):
+    ImportJob.objects.filter(pk=job_id).update(
+        rows_parsed=result.parsed, rows_inserted=result.created, rows_rejected=result.rejected
+    )
+
+
+def run_job(job_id):
+    """Chạy 1 job import (nếu còn ở trạng thái chờ) trong thread/process hiện tại"""
+    if not claim_job(job_id):
+        return None
+    job = ImportJob.objects.get(pk=job_id)
+    slip_model, item_model = SLIP_ITEM_MODELS[job.kind]
+    slip = slip_model.objects.filter(pk=job.slip_id).first()
+    if slip is None:
+        _finish(job.pk, error='Phiếu không còn tồn tại')
+    else:
+        try:
+            result = _import(job, slip, item_model)
+        except Exception as e:
+            fail_job(job, f'{type(e).__name__}: {e}')
+        else:
+            _finish(job.pk, result=result)
+    # Đã nhập xong -> không cần giữ file upload
+    if job.file:
+        job.file.delete(save=False)
+        ImportJob.objects.filter(pk=job.pk).update(file='')
+    return ImportJob.objects.get(pk=job.pk)
+
+
+def _import(job, slip, item_model):
+    progress = partial(_progress, job.pk)
+    cached = cached_preview(item_model, job.preview_token) if job.preview_token else None
+    if cached is None:
+        if not job.file:
+            raise ValueError('Bản xem trước đã hết hạn, vui lòng chọn lại file Excel')
+        with job.file.open('rb') as f:
+            return import_items(slip, item_model, f, atomic=False, progress=progress, import_job_id=job.pk)
+    summary, chunks = cached
+    # Dòng lỗi đã biết từ lúc xem trước, chỉ còn việc ghi các lô hợp lệ
+    result = ImportResult()
+    result.parsed = summary['rows_parsed']
+    result.errors = [tuple(error) for error in summary['row_errors']]
+    result.rejected = summary['rows_rejected']
+    return insert_chunks(slip, item_model, chunks, result, atomic=False, progress=progress, import_job_id=job.pk)
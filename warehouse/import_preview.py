@@ -0,0 +1,99 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .importer import CACHE_ALIAS, ImportResult, parse_chunks
+
+# Xem trước file Excel trước khi import:
+# - Đọc + chuẩn hóa file 1 lần, lưu các lô dòng hợp lệ vào cache theo mã băm nội dung file
+#   -> tải lại đúng file đó (sửa nhầm rồi chọn lại) không phải đọc lại
+# - Khi lưu phiếu, form chỉ gửi token (= mã băm) -> job import lấy thẳng các lô từ cache;
+#   form gửi kèm file thì job giữ file, cache thiếu lô nào sẽ đọc lại file thay vì nhập dở dang
+PREVIEW_TTL = getattr(settings, 'IMPORT_PREVIEW_TTL', 1800)  # giây
+PREVIEW_SAMPLE_ROWS = 20
+PREVIEW_MAX_ERRORS = 50
+
+
+def file_digest(excel_file):
+    sha = hashlib.sha256()
+    excel_file.seek(0)
+    for chunk in iter(lambda: excel_file.read(1024 * 1024), b''):
+        sha.update(chunk)
+    excel_file.seek(0)
+    return sha.hexdigest()
+
+
+def _key(item_model, token):
+    return f'preview:{item_model._meta.model_name}:{token}'
+
+
+def build_preview(item_model, excel_file):
+    """
+    File Excel -> bản tóm tắt (token, số dòng, dòng lỗi, vài dòng mẫu).
+    Các lô dòng đã chuẩn hóa được cache PREVIEW_TTL giây; ném ValueError nếu file không đúng mẫu.
+    """
+    cache = caches[CACHE_ALIAS]
+    token = file_digest(excel_file)
+    key = _key(item_model, token)
+    summary = cache.get(key)
+    if summary is not None:
+        return summary
+
+    result, chunks, valid, sample = ImportResult(), 0, 0, []
+    for rows in parse_chunks(excel_file, item_model, result):
+        # Các lô sống lâu hơn bản tóm tắt một chút: còn tóm tắt là còn đủ các lô
+        cache.set(f'{key}:{chunks}', rows, PREVIEW_TTL + 60)
+        chunks += 1
+        valid += len(rows)
+        if len(sample) < PREVIEW_SAMPLE_ROWS:
+            sample += rows.head(PREVIEW_SAMPLE_ROWS - len(sample)).to_dict('records')
+    summary = {
+        'token': token,
+        'file_name': getattr(excel_file, 'name', '') or '',
+        'chunks': chunks,
+        'rows_parsed': result.parsed,
+        'rows_valid': valid,
+        'rows_rejected': result.rejected,
+        'row_errors': result.errors[:PREVIEW_MAX_ERRORS],
+        'sample': sample,
+    }
+    cache.set(key, summary, PREVIEW_TTL)
+    return summary
+
+
+def preview_summary(item_model, token):
+    """
+    Token -> bản tóm tắt nếu cache còn đủ cả tóm tắt lẫn mọi lô, ngược lại None.
+    Cache 'imports' có thể xóa bớt entry khi đầy (MAX_ENTRIES) -> không dựa vào TTL mà kiểm tra từng lô.
+    """
+    cache = caches[CACHE_ALIAS]
+    key = _key(item_model, token)
+    summary = cache.get(key)
+    if summary is None:
+        return None
+    if not all(cache.has_key(f'{key}:{i}') for i in range(summary['chunks'])):
+        return None
+    return summary
+
+
+def cached_preview(item_model, token):
+    """
+    Token -> (bản tóm tắt, generator các lô) từ cache, hoặc None nếu đã hết hạn / thiếu lô nào.
+    Chỉ kiểm tra các lô còn đủ (has_key), rồi mỗi lần đọc 1 lô -> bộ nhớ không tăng theo kích thước file.
+    Lô bị xóa trong lúc đang ghi -> generator ném ValueError, job import xóa các dòng đã thêm.
+    """
+    summary = preview_summary(item_model, token)
+    if summary is None:
+        return None
+    cache = caches[CACHE_ALIAS]
+    key = _key(item_model, token)
+
+    def chunks():
+        for i in range(summary['chunks']):
+            rows = cache.get(f'{key}:{i}')
+            if rows is None:
+                raise ValueError('Bản xem trước đã hết hạn, vui lòng chọn lại file Excel')
+            yield rows
+
+    return summary, chunks()
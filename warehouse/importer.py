@@ -0,0 +1,257 @@
+import hashlib
+import os
+from contextlib import nullcontext
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import LoanItem, PurchaseItem, ExportItem
+from .pdf_cache import invalidate_slip_pdf
+
+# Import danh sách vật tư từ Excel, dùng chung cho cả 3 loại phiếu.
+# - Tìm cột theo từ khóa trên dòng tiêu đề MỘT lần
+# - Chuẩn hóa cả cột bằng pandas (không lặp iterrows)
+# - Ghi bằng bulk_create theo lô, trong 1 transaction
+# - Dòng lỗi được bỏ qua và báo lại (số dòng Excel + lý do), không làm hỏng cả file
+# - File .xlsx lớn: đọc dạng luồng (openpyxl read_only) từng lô dòng -> bộ nhớ không tăng theo file
+BULK_SIZE = 500
+STREAM_THRESHOLD = getattr(settings, 'EXCEL_STREAM_THRESHOLD', 2 * 1024 * 1024)  # bytes
+STREAM_CHUNK_ROWS = getattr(settings, 'EXCEL_STREAM_CHUNK_ROWS', 5000)
+STREAM_EXTENSIONS = ('.xlsx', '.xlsm')
+# Cache dùng chung giữa các worker (settings.CACHES['imports']): bản xem trước + cách ghép cột đã biết
+CACHE_ALIAS = 'imports'
+MAPPING_TTL = 90 * 24 * 3600
+
+# Cột -> các bộ từ khóa (khớp bộ nào trước lấy bộ đó; mọi từ trong bộ phải có trong tên cột)
+COLUMN_KEYWORDS = {
+    'ten': [['tên']],
+    'dvt': [['đơn', 'vị'], ['đvt'], ['dvt']],
+    'sl': [['số', 'lượng'], ['sl']],
+    'tt': [['tình', 'trạng']],
+    'gc': [['ghi', 'chú']],
+}
+DEFAULT_UNIT = 'Cái'
+STATUS_OK_WORDS = ['bình thường', 'tốt', 'mới', 'ok']
+STATUS_BROKEN_WORDS = ['hư', 'hỏng', 'lỗi', 'vỡ']
+
+# Model vật tư -> (tên FK tới phiếu, cột tên hàng, có cột tình trạng không)
+ITEM_SPECS = {
+    LoanItem: ('loan', 'ten_tai_san', True),
+    PurchaseItem: ('slip', 'ten_hang_hoa', False),
+    ExportItem: ('slip', 'ten_hang_hoa', False),
+}
+
+
+class ImportResult:
+    def __init__(self):
+        self.parsed = 0  # số dòng dữ liệu đã đọc (kể cả dòng trống / dòng lỗi)
+        self.created = 0
+        self.rejected = 0
+        self.errors = []  # (số dòng trong Excel, lý do)
+
+    def add_error(self, row_number, reason):
+        self.rejected += 1
+        self.errors.append((row_number, reason))
+
+
+def resolve_columns(columns):
+    """Dòng tiêu đề -> {'ten': tên cột thật, ...} (cột không có thì None)"""
+    columns = [str(c) for c in columns]
+    normalized = [c.strip().lower() for c in columns]
+    mapping = {}
+    for key, keyword_sets in COLUMN_KEYWORDS.items():
+        mapping[key] = None
+        for keywords in keyword_sets:
+            found = next((orig for orig, col in zip(columns, normalized) if all(k in col for k in keywords)), None)
+            if found is not None:
+                mapping[key] = found
+                break
+    return mapping
+
+
+def header_fingerprint(columns):
+    """Dấu vân tay của dòng tiêu đề (kèm bộ từ khóa: đổi từ khóa thì cách ghép cũ tự hết hiệu lực)"""
+    normalized = [str(c).strip().lower() for c in columns]
+    return hashlib.sha1(repr((normalized, COLUMN_KEYWORDS)).encode('utf-8')).hexdigest()
+
+
+def header_mapping(columns):
+    """
+    resolve_columns có nhớ: các file cùng mẫu (cùng dòng tiêu đề, vd. file của cùng 1 phòng ban)
+    dùng lại cách ghép cột đã tìm lần trước, không phải dò từ khóa lại.
+    """
+    cache = caches[CACHE_ALIAS]
+    key = f'header:{header_fingerprint(columns)}'
+    mapping = cache.get(key)
+    if mapping is None:
+        mapping = resolve_columns(columns)
+        cache.set(key, mapping, MAPPING_TTL)
+    return mapping
+
+
+def _text(df, col, default=''):
+    if col is None:
+        return pd.Series(default, index=df.index, dtype=object)
+    return df[col].fillna('').astype(str).str.strip()
+
+
+def _classify_status(raw):
+    """Phân loại cột Tình trạng: Bình thường / Hư hỏng / Khác (giữ nguyên chữ gốc)"""
+    txt = raw.str.lower()
+    ok = txt.str.contains('|'.join(STATUS_OK_WORDS), regex=True)
+    broken = txt.str.contains('|'.join(STATUS_BROKEN_WORDS), regex=True)
+    status = np.select([txt.eq(''), ok, broken], ['binh_thuong', 'binh_thuong', 'hu_hong'], default='khac')
+    other = raw.where(status == 'khac', '')
+    return status, other
+
+
+def normalize_frame(df, mapping, item_model, result, row_offset=2):
+    """
+    DataFrame thô -> DataFrame đã chuẩn hóa các cột của model vật tư.
+    row_offset: số dòng Excel của dòng đầu tiên trong df (mặc định 2: ngay sau tiêu đề)
+    """
+    _, name_field, has_status = ITEM_SPECS[item_model]
+    fields = {f.name: f for f in item_model._meta.get_fields() if hasattr(f, 'max_length')}
+    row_numbers = pd.Series(np.arange(len(df)) + row_offset, index=df.index)
+    result.parsed += len(df)
+
+    out = pd.DataFrame(index=df.index)
+    out[name_field] = _text(df, mapping['ten'])
+    out['don_vi_tinh'] = _text(df, mapping['dvt']).replace('', DEFAULT_UNIT)
+    out['ghi_chu'] = _text(df, mapping['gc'])
+
+    # Số lượng: trống -> 1, không phải số -> lỗi
+    if mapping['sl'] is None:
+        out['so_luong'] = 1
+        bad_qty = pd.Series(False, index=df.index)
+    else:
+        raw_qty = df[mapping['sl']]
+        qty = pd.to_numeric(raw_qty, errors='coerce')
+        bad_qty = qty.isna() & raw_qty.notna() & raw_qty.astype(str).str.strip().ne('')
+        out['so_luong'] = qty.fillna(1).clip(lower=-2**31, upper=2**31 - 1).astype('int64')
+
+    if has_status:
+        out['tinh_trang'], out['tinh_trang_khac'] = _classify_status(_text(df, mapping['tt']))
+
+    # Dòng không có tên -> bỏ qua im lặng (dòng trống / dòng tổng cộng)
+    keep = out[name_field].ne('')
+    errors = pd.Series('', index=df.index, dtype=object)
+    errors = errors.mask(bad_qty, 'Số lượng không phải là số')
+    for col in out.columns:
+        max_length = getattr(fields.get(col), 'max_length', None)
+        if max_length and pd.api.types.is_string_dtype(out[col]):
+            too_long = out[col].str.len() > max_length
+            errors = errors.mask(too_long & errors.eq(''), f'"{fields[col].verbose_name}" dài quá {max_length} ký tự')
+
+    failed = keep & errors.ne('')
+    for row_number, reason in zip(row_numbers[failed], errors[failed]):
+        result.add_error(int(row_number), reason)
+    return out[keep & ~failed]
+
+
+def _file_size(excel_file):
+    size = getattr(excel_file, 'size', None)
+    if size is None:
+        pos = excel_file.tell()
+        size = excel_file.seek(0, os.SEEK_END)
+        excel_file.seek(pos)
+    return size
+
+
+def should_stream(excel_file):
+    """Chỉ .xlsx mới đọc luồng được; file nhỏ đọc 1 lần bằng pandas cho nhanh"""
+    name = (getattr(excel_file, 'name', '') or '').lower()
+    return name.endswith(STREAM_EXTENSIONS) and _file_size(excel_file) > STREAM_THRESHOLD
+
+
+def stream_xlsx_frames(excel_file, chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Đọc sheet đầu tiên theo từng lô `chunk_rows` dòng -> (DataFrame, số dòng Excel của dòng đầu lô).
+    Chỉ giữ 1 lô trong bộ nhớ; dòng tiêu đề là dòng không trống đầu tiên (giống pandas).
+    """
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        row_number, header = 0, None
+        for row in rows:
+            row_number += 1
+            if any(v is not None for v in row):
+                header = row
+                break
+        if header is None:
+            return
+        columns = [str(v) if v is not None else f'Unnamed: {i}' for i, v in enumerate(header)]
+        width = len(columns)
+
+        chunk, start = [], row_number + 1
+        for row in rows:
+            row_number += 1
+            chunk.append(row[:width] if len(row) >= width else row + (None,) * (width - len(row)))
+            if len(chunk) >= chunk_rows:
+                yield pd.DataFrame(chunk, columns=columns, dtype=object), start
+                chunk, start = [], row_number + 1
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns, dtype=object), start
+    finally:
+        workbook.close()
+
+
+def read_frames(excel_file, stream=None):
+    """
+    File Excel -> các (DataFrame, số dòng Excel của dòng đầu).
+    stream=None: tự chọn theo kích thước file (STREAM_THRESHOLD)
+    """
+    if stream is None:
+        stream = should_stream(excel_file)
+    if stream:
+        yield from stream_xlsx_frames(excel_file)
+    else:
+        yield pd.read_excel(excel_file), 2
+
+
+def parse_chunks(excel_file, item_model, result, stream=None):
+    """File Excel -> các DataFrame vật tư đã chuẩn hóa, mỗi lô tối đa STREAM_CHUNK_ROWS dòng"""
+    mapping = None
+    for df, row_offset in read_frames(excel_file, stream):
+        if mapping is None:
+            mapping = header_mapping(df.columns)
+            if mapping['ten'] is None:
+                raise ValueError('Không tìm thấy cột "Tên" trong file')
+        for start in range(0, len(df), STREAM_CHUNK_ROWS):
+            chunk = df.iloc[start:start + STREAM_CHUNK_ROWS]
+            yield normalize_frame(chunk, mapping, item_model, result, row_offset + start)
+
+
+def insert_chunks(slip, item_model, chunks, result, atomic=True, progress=None, import_job_id=None):
+    """
+    Ghi các lô vật tư đã chuẩn hóa vào phiếu bằng bulk_create.
+    atomic=False: mỗi lô commit riêng (job chạy nền, để request khác thấy được tiến độ)
+    progress: hàm nhận ImportResult, gọi sau mỗi lô
+    import_job_id: đánh dấu các dòng của job import để xóa được khi job lỗi giữa chừng
+    """
+    fk_name = ITEM_SPECS[item_model][0]
+    with transaction.atomic() if atomic else nullcontext():
+        for rows in chunks:
+            objs = [
+                item_model(**{fk_name: slip}, **row, import_job_id=import_job_id)
+                for row in rows.to_dict('records')
+            ]
+            with transaction.atomic():
+                item_model.objects.bulk_create(objs, batch_size=BULK_SIZE)
+            result.created += len(objs)
+            if progress is not None:
+                progress(result)
+    # bulk_create không phát signal post_save -> tự bỏ PDF đã cache của phiếu
+    invalidate_slip_pdf(slip._meta.model_name, slip.pk)
+    return result
+
+
+def import_items(slip, item_model, excel_file, stream=None, atomic=True, progress=None, import_job_id=None):
+    """Đọc file Excel và thêm toàn bộ vật tư vào phiếu -> ImportResult"""
+    result = ImportResult()
+    chunks = parse_chunks(excel_file, item_model, result, stream)
+    return insert_chunks(slip, item_model, chunks, result, atomic, progress, import_job_id)
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import openpyxl
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from warehouse.importer import import_items
+from warehouse.models import LoanSlip, LoanItem
+
+STATUSES = ['Tốt', 'Mới', 'Hư màn hình', 'Trầy xước', None]
+
+
+def make_workbook(path, rows):
+    """Tạo file .xlsx giả lập danh sách tài sản (ghi dạng write_only cho nhanh)"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['STT', 'Tên tài sản', 'ĐVT', 'Số lượng', 'Tình trạng', 'Ghi chú'])
+    for i in range(1, rows + 1):
+        sheet.append([i, f'Tài sản số {i}', 'Cái', i % 7 + 1, STATUSES[i % len(STATUSES)], f'Lô {i // 1000}'])
+    workbook.save(path)
+
+
+def _run(path, stream, queue):
+    # Process con (fork): đo đỉnh RSS của riêng 1 lần import; dữ liệu ghi vào DB được rollback
+    settings.DEBUG = False  # DEBUG giữ lại SQL của mọi câu INSERT -> làm sai số đo bộ nhớ
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with transaction.atomic():
+        slip = LoanSlip.objects.create(
+            ma_nhan_vien='BENCH', nguoi_muon='Benchmark', email='bench@example.com',
+            chuc_vu='-', phong_ban='-', ly_do='Benchmark import',
+        )
+        with open(path, 'rb') as f:
+            result = import_items(slip, LoanItem, f, stream=stream)
+        transaction.set_rollback(True)
+    elapsed = time.perf_counter() - started
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+    queue.put((rss_peak * 1024, result.created, elapsed))
+
+
+def measure(path, stream):
+    connection.close()  # process con tự mở kết nối DB riêng
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(path, stream, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Đo bộ nhớ đỉnh và tốc độ import Excel: đọc cả file bằng pandas so với đọc luồng openpyxl'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 500000])
+        parser.add_argument('--skip-pandas', action='store_true', help='Chỉ đo chế độ đọc luồng')
+
+    def handle(self, *args, **options):
+        mb = 1024 * 1024
+        modes = [('stream', True)] if options['skip_pandas'] else [('pandas', False), ('stream', True)]
+        self.stdout.write(f"{'Số dòng':>9}{'File (MB)':>11}  {'Cách đọc':<9}{'Peak RSS tăng (MB)':>20}{'Dòng/giây':>12}")
+        with tempfile.TemporaryDirectory() as tmp:
+            for rows in options['rows']:
+                path = os.path.join(tmp, f'items_{rows}.xlsx')
+                make_workbook(path, rows)
+                size = os.path.getsize(path)
+                for label, stream in modes:
+                    rss, created, elapsed = measure(path, stream)
+                    self.stdout.write(
+                        f"{rows:>9}{size / mb:>11.1f}  {label:<9}{rss / mb:>20.1f}{created / elapsed:>12.0f}"
+                    )
@@ -0,0 +1,67 @@
+import json
+import multiprocessing
+import os
+import resource
+import tracemalloc
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from warehouse.outbox import FROM_EMAIL, ResendTransport
+
+
+def legacy_params(message, name, data):
+    """Cách cũ: content = list(bytes) -> mỗi byte là 1 object int trong list"""
+    return {
+        "from": FROM_EMAIL, "to": message.recipients, "subject": message.subject, "html": message.html,
+        "attachments": [{"filename": name, "content": list(data)}],
+    }
+
+
+def base64_params(message, name, data):
+    return ResendTransport().params(message, [(name, data)])
+
+
+def _run(builder, data, use_tracemalloc, queue):
+    # Chạy trong process con (fork) để đo đỉnh bộ nhớ của riêng 1 lần dựng payload
+    message = SimpleNamespace(recipients=['a@b.vn'], subject='Benchmark', html='<p>x</p>')
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if use_tracemalloc:
+        tracemalloc.start()
+    body = json.dumps(builder(message, 'Phieu.pdf', data))  # requests gửi json=... cũng dumps y như vậy
+    heap_peak = tracemalloc.get_traced_memory()[1] if use_tracemalloc else 0
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+    queue.put((rss_peak * 1024, heap_peak, len(body)))
+
+
+def measure(builder, data, use_tracemalloc):
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(builder, data, use_tracemalloc, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Đo bộ nhớ đỉnh khi dựng payload gửi mail kèm PDF: list(bytes) (cũ) so với base64 (mới)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-kb', type=int, default=500, help='Kích thước PDF giả lập (KB)')
+        parser.add_argument('--file', help='Dùng file PDF có sẵn thay cho dữ liệu giả lập')
+
+    def handle(self, *args, **options):
+        if options['file']:
+            with open(options['file'], 'rb') as f:
+                data = f.read()
+        else:
+            data = os.urandom(options['size_kb'] * 1024)
+
+        mb = 1024 * 1024
+        self.stdout.write(f"PDF {len(data) / 1024:.0f} KB, mỗi cách đo trong 1 process con riêng\n")
+        self.stdout.write(f"{'Cách mã hóa':<14}{'Peak RSS tăng (MB)':>20}{'Heap Python đỉnh (MB)':>24}{'JSON gửi đi (KB)':>20}")
+        for label, builder in (('list(bytes)', legacy_params), ('base64', base64_params)):
+            rss, _, body = measure(builder, data, use_tracemalloc=False)
+            _, heap, _ = measure(builder, data, use_tracemalloc=True)
+            self.stdout.write(f"{label:<14}{rss / mb:>20.1f}{heap / mb:>24.1f}{body / 1024:>20.0f}")
@@ -0,0 +1,69 @@
+import os
+import shutil
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from warehouse.blobs import PHOTO_FIELDS, PHOTO_MODELS, recount
+from warehouse.storage import BLOB_DIR, blob_name, file_sha256, photo_storage
+
+
+class Command(BaseCommand):
+    help = ('Chuyển ảnh phiếu cũ (loan_photos/..., purchase_photos/..., export_photos/...) sang kho lưu theo '
+            'nội dung SHA-256, gộp các file trùng nhau và tính lại số dòng dùng mỗi file')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ thống kê, không đổi file / DB')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        self.moved = {}  # tên cũ -> tên theo nội dung
+        self.blobs = set()
+        self.files = self.duplicates = self.freed = self.missing = 0
+
+        for model in PHOTO_MODELS:
+            for field in PHOTO_FIELDS:
+                legacy = (model.objects.exclude(**{field: ''}).exclude(**{f'{field}__startswith': f'{BLOB_DIR}/'})
+                          .values_list(field, flat=True).distinct())
+                for name in list(legacy):
+                    target = self.link_blob(name, dry_run)
+                    if target and not dry_run:
+                        model.objects.filter(**{field: name}).update(**{field: target})
+
+        if not dry_run:
+            # Mọi dòng đã trỏ sang file mới -> giờ mới xóa file cũ (chạy lại giữa chừng vẫn an toàn)
+            for name in self.moved:
+                if self.moved[name]:
+                    photo_storage.delete(name)
+            in_use, unused = recount()
+            self.stdout.write(f"Đếm lại: {in_use} file đang dùng, {unused} file không còn dòng nào dùng.")
+        self.stdout.write(
+            f"{'[Thử] ' if dry_run else ''}{self.files} file cũ -> {len(self.blobs)} file theo nội dung, "
+            f"{self.duplicates} file trùng (giảm {self.freed / 1024 / 1024:.1f} MB), {self.missing} file không còn trên đĩa."
+        )
+
+    def link_blob(self, name, dry_run):
+        """File cũ -> tên file theo nội dung (tạo hard link nếu chưa có); None nếu file không còn"""
+        if name in self.moved:
+            return self.moved[name]
+        path = photo_storage.path(name)
+        if not os.path.isfile(path):
+            self.missing += 1
+            self.moved[name] = None
+            return None
+        with open(path, 'rb') as f:
+            target = blob_name(file_sha256(File(f)), os.path.splitext(name)[1])
+        target_path = photo_storage.path(target)
+        self.files += 1
+        if target in self.blobs or os.path.exists(target_path):
+            self.duplicates += 1
+            self.freed += os.path.getsize(path)
+        elif not dry_run:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            try:
+                os.link(path, target_path)  # không copy dữ liệu
+            except OSError:
+                shutil.copy2(path, target_path)
+        self.blobs.add(target)
+        self.moved[name] = target
+        return target
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from warehouse.blobs import photo_names, release, retain
+from warehouse.images import ingest_image
+from warehouse.storage import is_blob_name
+from warehouse.models import LoanImage, PurchaseImage, ExportImage
+
+
+class Command(BaseCommand):
+    help = 'Nén lại ảnh đính kèm cũ (tải lên trước khi có bước xử lý ảnh) và tạo ảnh thu nhỏ, xóa file gốc'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ đếm số ảnh cần xử lý')
+        parser.add_argument('--limit', type=int, default=0, help='Xử lý tối đa N ảnh mỗi loại (0 = tất cả)')
+
+    def handle(self, *args, **options):
+        for model in (LoanImage, PurchaseImage, ExportImage):
+            pending = model.objects.filter(thumbnail='').exclude(image='').order_by('id')
+            if options['limit']:
+                pending = pending[:options['limit']]
+            if options['dry_run']:
+                self.stdout.write(f"{model.__name__}: {pending.count()} ảnh chưa xử lý")
+                continue
+
+            done = saved = failed = 0
+            for obj in pending.iterator():
+                original = obj.image
+                old_name, storage = original.name, original.storage
+                try:
+                    old_size = storage.size(old_name)
+                    ok = ingest_image(obj)
+                except OSError:  # file gốc không còn trên đĩa
+                    ok = False
+                finally:
+                    original.close()
+                if not ok:
+                    failed += 1
+                    continue
+                # Ghi 2 file mới rồi cập nhật thẳng DB (không qua save() -> không xử lý ảnh lần nữa)
+                for field in (obj.image, obj.thumbnail):
+                    field.save(field.name, field.file, save=False)
+                model.objects.filter(pk=obj.pk).update(image=obj.image.name, thumbnail=obj.thumbnail.name)
+                retain(photo_names(obj))
+                saved += old_size - obj.image.size - obj.thumbnail.size
+                if is_blob_name(old_name):
+                    release([old_name])
+                else:
+                    storage.delete(old_name)
+                done += 1
+            self.stdout.write(
+                f"{model.__name__}: xử lý {done} ảnh, lỗi {failed}, giảm {saved / 1024 / 1024:.1f} MB"
+            )
@@ -0,0 +1,45 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from warehouse.import_jobs import fail_job, run_job
+from warehouse.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = 'Chạy các job import Excel chưa được chạy (process web chết trước khi bắt đầu) và dọn job cũ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', type=int, default=60, help='Job chờ quá số giây này thì chạy ở đây')
+        parser.add_argument('--timeout', type=int, default=3600,
+                            help='Job "đang nhập" quá số giây này coi như đã chết giữa chừng -> báo lỗi')
+        parser.add_argument('--keep-days', type=int, default=7, help='Xóa job đã kết thúc cũ hơn số ngày này')
+        parser.add_argument('--loop', type=int, default=0, help='Chạy lặp, nghỉ N giây giữa các lượt (0 = chạy 1 lần)')
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once(options['stale'], options['timeout'], options['keep_days'])
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def run_once(self, stale, timeout, keep_days):
+        now = timezone.now()
+        # Job chết giữa chừng: báo lỗi + xóa các dòng đã thêm, người dùng nhập lại sẽ không bị trùng
+        dead = 0
+        for job in ImportJob.objects.filter(status='running', started_at__lt=now - timedelta(seconds=timeout)):
+            dead += fail_job(job, 'Tiến trình import bị dừng giữa chừng, các dòng đã thêm đã được xóa')
+
+        count = 0
+        pending = ImportJob.objects.filter(status='pending', created_at__lt=now - timedelta(seconds=stale))
+        for job_id in pending.order_by('id').values_list('id', flat=True):
+            if run_job(job_id) is not None:
+                count += 1
+
+        old = ImportJob.objects.filter(status__in=['done', 'failed'], finished_at__lt=now - timedelta(days=keep_days))
+        for job in old.exclude(file=''):
+            job.file.delete(save=False)
+        deleted, _ = old.delete()
+        self.stdout.write(f"Đã chạy {count} job import, {dead} job bị dừng giữa chừng, xóa {deleted} job cũ.")
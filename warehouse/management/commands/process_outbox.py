@@ -0,0 +1,37 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from warehouse.models import OutboxMessage
+from warehouse.outbox import get_transport, process_outbox
+
+
+class Command(BaseCommand):
+    help = 'Gửi các email trong hàng đợi (outbox), tự thử lại khi lỗi'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=50, help='Số tin lấy ra mỗi lượt')
+        parser.add_argument('--workers', type=int, default=4, help='Số thread gửi song song')
+        parser.add_argument('--loop', type=int, default=0, help='Chạy lặp, nghỉ N giây khi hết tin (0 = chạy 1 lần)')
+        parser.add_argument('--keep-days', type=int, default=30, help='Xóa tin đã gửi cũ hơn số ngày này')
+
+    def handle(self, *args, **options):
+        transport = get_transport()
+        while True:
+            total_sent = total_failed = 0
+            while True:
+                sent, failed = process_outbox(options['batch'], options['workers'], transport)
+                total_sent += sent
+                total_failed += failed
+                if sent + failed < options['batch']:
+                    break
+            deleted, _ = OutboxMessage.objects.filter(
+                status='sent', sent_at__lt=timezone.now() - timedelta(days=options['keep_days'])
+            ).delete()
+            if total_sent or total_failed or deleted or not options['loop']:
+                self.stdout.write(f"Đã gửi {total_sent} mail, lỗi {total_failed}, xóa {deleted} tin cũ.")
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,47 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from warehouse.models import PdfJob
+from warehouse.pdf_jobs import run_job
+
+
+class Command(BaseCommand):
+    help = 'Tạo nốt các PDF bị treo trong hàng đợi (process web chết giữa chừng) và dọn job cũ'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', type=int, default=60, help='Job quá số giây này chưa xong thì làm lại')
+        parser.add_argument('--keep-days', type=int, default=7, help='Xóa job đã kết thúc cũ hơn số ngày này')
+        parser.add_argument('--loop', type=int, default=0, help='Chạy lặp, nghỉ N giây giữa các lượt (0 = chạy 1 lần)')
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once(options['stale'], options['keep_days'])
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def run_once(self, stale, keep_days):
+        now = timezone.now()
+        stale_at = now - timedelta(seconds=stale)
+        jobs = PdfJob.objects.filter(
+            Q(status='pending', created_at__lt=stale_at) |
+            Q(status='running', started_at__lt=stale_at)
+        ).order_by('id')
+        count = 0
+        for job in jobs:
+            # Giành job: chỉ 1 worker cập nhật được (UPDATE có điều kiện)
+            claimed = PdfJob.objects.filter(pk=job.pk, status=job.status, started_at=job.started_at).update(
+                status='running', started_at=now
+            )
+            if claimed:
+                run_job(job)
+                count += 1
+
+        deleted, _ = PdfJob.objects.filter(
+            status__in=['done', 'failed'], finished_at__lt=now - timedelta(days=keep_days)
+        ).delete()
+        self.stdout.write(f"Đã tạo lại {count} PDF, xóa {deleted} job cũ.")
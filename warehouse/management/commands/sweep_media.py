@@ -0,0 +1,96 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from warehouse.media_gc import is_referenced, referenced_files, walk_media
+from warehouse.models import MediaBlob, PhotoUpload
+from warehouse.storage import is_blob_name
+from warehouse.uploads import UPLOAD_TTL, purge_stale_uploads
+
+
+class Command(BaseCommand):
+    help = ('Xóa file trong MEDIA_ROOT không còn dòng nào trong DB trỏ tới (ảnh phiếu, chữ ký, file import cũ) '
+            'và các upload theo đoạn bị bỏ dở')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Chỉ báo cáo, không xóa')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Bỏ qua file mới hơn số giây này (đang tải lên, dòng DB chưa commit)')
+        parser.add_argument('--rate', type=float, default=20, help='Xóa tối đa N file mỗi giây (0 = không giới hạn)')
+        parser.add_argument('--limit', type=int, default=0, help='Xóa tối đa N file mỗi lượt (0 = tất cả)')
+        parser.add_argument('--loop', type=int, default=0, help='Chạy lặp, nghỉ N giây giữa các lượt (0 = chạy 1 lần)')
+
+    def handle(self, *args, **options):
+        while True:
+            self.sweep(options)
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
+
+    def sweep(self, options):
+        cutoff = time.time() - options['min_age']
+        # Liệt kê đĩa trước, DB sau: file mới tải lên giữa 2 bước đã bị --min-age loại ra;
+        # blob cũ được dùng lại giữa chừng thì delete_orphan kiểm tra lại mtime / refcount trước khi xóa
+        on_disk = {name: (size, mtime) for name, size, mtime in walk_media()}
+        referenced = referenced_files()
+        orphans = sorted(name for name in on_disk.keys() - referenced if on_disk[name][1] < cutoff)
+        missing = referenced - on_disk.keys()
+        if options['limit']:
+            orphans = orphans[:options['limit']]
+
+        total = sum(on_disk[name][0] for name in orphans)
+        if options['dry_run']:
+            stale = PhotoUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=UPLOAD_TTL)).count()
+            self.stdout.write(f"[Thử] {stale} upload theo đoạn bị bỏ dở.")
+            by_dir = Counter(name.split('/', 1)[0] for name in orphans)
+            self.stdout.write(
+                f"[Thử] {len(on_disk)} file trên đĩa, {len(referenced)} file trong DB: "
+                f"{len(orphans)} file mồ côi ({total / 1024 / 1024:.1f} MB), {len(missing)} dòng trỏ tới file đã mất."
+            )
+            for directory, count in by_dir.most_common():
+                self.stdout.write(f"  {directory}/: {count} file")
+            for name in sorted(missing)[:20]:
+                self.stdout.write(f"  mất: {name}")
+            return
+
+        delay = 1 / options['rate'] if options['rate'] > 0 else 0
+        deleted = skipped = 0
+        for name in orphans:
+            if self.delete_orphan(name, cutoff):
+                deleted += 1
+            else:
+                skipped += 1
+            if delay:
+                time.sleep(delay)  # không chiếm hết I/O đĩa của web
+        purged = purge_stale_uploads()
+        self.stdout.write(
+            f"Đã xóa {purged} upload bỏ dở, {deleted} file mồ côi ({total / 1024 / 1024:.1f} MB), "
+            f"bỏ qua {skipped} file vừa được dùng lại, {len(missing)} dòng trỏ tới file đã mất."
+        )
+
+    def delete_orphan(self, name, cutoff):
+        """
+        Kiểm tra lại ngay trước khi xóa: từ lúc liệt kê tới giờ file có thể vừa được dùng lại
+        (ảnh trùng nội dung -> storage chỉ "chạm" mtime của blob cũ rồi tăng refcount)
+        """
+        try:
+            if os.stat(default_storage.path(name)).st_mtime >= cutoff:
+                return False
+        except FileNotFoundError:
+            return False
+        if is_blob_name(name):
+            if MediaBlob.objects.filter(name=name, refcount__gt=0).exists():
+                return False
+            # Giống blobs._delete_unused: chỉ xóa khi xóa được dòng refcount <= 0 (hoặc chưa từng có dòng)
+            deleted, _ = MediaBlob.objects.filter(name=name, refcount__lte=0).delete()
+            if not deleted and is_referenced(name):
+                return False
+        elif is_referenced(name):
+            return False
+        default_storage.delete(name)
+        return True
@@ -0,0 +1,128 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .storage import BLOB_DIR
+
+# Phục vụ file /media/ (ảnh phiếu, chữ ký) thay cho django.views.static.serve:
+# - ETag mạnh (kích thước + mtime) + Last-Modified -> trình duyệt hỏi lại nhận 304, không tải lại
+# - Ảnh phiếu đặt tên theo SHA-256 nội dung (storage.py) hoặc nằm trong thư mục theo tháng (ảnh cũ),
+#   tên file không bao giờ bị ghi đè -> Cache-Control: immutable 1 năm.
+#   "private" vì ảnh chỉ dành cho người đã đăng nhập
+# - Hỗ trợ Range (1 khoảng byte) để xem / tải tiếp file lớn
+# - Có proxy phía trước thì giao việc gửi file cho proxy (MEDIA_SENDFILE):
+#     'nginx'  -> X-Accel-Redirect: <MEDIA_ACCEL_PREFIX><path>, cần location internal:
+#                 location /protected-media/ { internal; alias /app/media/; }
+#     'apache' -> X-Sendfile: <đường dẫn tuyệt đối> (mod_xsendfile)
+#   Không có proxy: FileResponse -> gunicorn dùng sendfile() qua wsgi.file_wrapper
+SENDFILE = getattr(settings, 'MEDIA_SENDFILE', None)
+ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+IMMUTABLE_PATHS = re.compile(getattr(
+    settings, 'MEDIA_IMMUTABLE_PATHS', rf'^([a-z_]+_photos/\d{{4}}/\d{{2}}/|{re.escape(BLOB_DIR)}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/)',
+))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+BLOCK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def media_etag(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header, size):
+    """
+    'bytes=a-b' -> (start, end) (end tính cả byte cuối); None nếu không dùng được
+    (nhiều khoảng, sai cú pháp -> trả cả file); ValueError nếu khoảng nằm ngoài file (416)
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':  # 'bytes=-500': 500 byte cuối
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _cache_headers(response, path, stat, etag):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if IMMUTABLE_PATHS.match(path):
+        response['Cache-Control'] = f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        response['Cache-Control'] = 'private, no-cache'  # dùng lại được nhưng phải hỏi lại (ETag) mỗi lần
+    return response
+
+
+def media_response(request, path):
+    """Đường dẫn tương đối trong MEDIA_ROOT -> response (200 / 206 / 304 / 416). Không có file -> Http404"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('Không tìm thấy file')
+    if not os.path.isfile(full_path):
+        raise Http404('Không tìm thấy file')
+
+    etag = media_etag(stat)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return _cache_headers(not_modified, path, stat, etag)
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if SENDFILE in ('nginx', 'apache'):
+        # Proxy tự lo Range / gửi file; Django chỉ kiểm tra đăng nhập + gắn header cache
+        response = HttpResponse(content_type=content_type)
+        if SENDFILE == 'nginx':
+            response['X-Accel-Redirect'] = ACCEL_PREFIX + quote(path)
+        else:
+            response['X-Sendfile'] = full_path
+        return _cache_headers(response, path, stat, etag)
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    # If-Range khác ETag hiện tại -> file đã đổi, trả cả file
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+
+    if byte_range is None:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(full_path, start, end - start + 1),
+                                         status=206, content_type=content_type)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Accept-Ranges'] = 'bytes'
+    return _cache_headers(response, path, stat, etag)
@@ -0,0 +1,68 @@
+import os
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+
+# Dọn file media không còn dòng nào trong DB trỏ tới:
+# - Xóa dòng ảnh (xóa ảnh khi sửa phiếu, xóa phiếu -> cascade), đổi chữ ký -> xóa file sau khi commit
+#   (ảnh lưu theo nội dung thì blobs.release đếm lượt dùng; file kiểu cũ thì kiểm tra lại DB trước khi xóa)
+# - Lệnh sweep_media chạy định kỳ: liệt kê file trên đĩa, lấy mọi tên file trong DB,
+#   phép trừ tập hợp -> file mồ côi (sót do process chết, lỗi giữa chừng...)
+
+
+def file_fields():
+    """Mọi (model, tên field) kiểu FileField / ImageField của project"""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.get_fields()
+        if isinstance(field, models.FileField)
+    ]
+
+
+def referenced_files():
+    """Tập tên file (tương đối trong MEDIA_ROOT) đang được DB trỏ tới"""
+    names = set()
+    for model, field in file_fields():
+        queryset = model._default_manager.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''})
+        names.update(queryset.values_list(field, flat=True).distinct().iterator())
+    return names
+
+
+def is_referenced(name):
+    return any(model._default_manager.filter(**{field: name}).exists() for model, field in file_fields())
+
+
+def _delete_unreferenced(names):
+    for name in names:
+        if not is_referenced(name):
+            default_storage.delete(name)
+
+
+def delete_on_commit(names):
+    """Xóa các file sau khi transaction commit, nếu lúc đó không còn dòng nào dùng (rollback -> giữ nguyên)"""
+    names = [name for name in names if name]
+    if names:
+        transaction.on_commit(partial(_delete_unreferenced, names))
+
+
+def walk_media(root=None):
+    """Duyệt MEDIA_ROOT -> (tên file tương đối, dung lượng, mtime) cho từng file"""
+    root = str(root or settings.MEDIA_ROOT)
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                yield name, stat.st_size, stat.st_mtime
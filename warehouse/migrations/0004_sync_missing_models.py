@@ -0,0 +1,140 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+# Các model này đã có bảng trên DB production nhưng chưa từng được ghi vào migration.
+# Migration này bổ sung chúng vào state, và chỉ tạo bảng nếu DB chưa có (DB mới / test).
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+MISSING_MODELS = [
+    'Employee', 'LoanSlip', 'LoanItem', 'LoanImage', 'LoanHistory',
+    'PurchaseHistory', 'PurchaseImage', 'UserProfile',
+]
+
+
+def create_missing_tables(apps, schema_editor):
+    existing = schema_editor.connection.introspection.table_names()
+    for name in MISSING_MODELS:
+        model = apps.get_model('warehouse', name)
+        if model._meta.db_table not in existing:
+            schema_editor.create_model(model)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0003_employee_exportslip_exportitem_exportimage_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Employee',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ma_nhan_vien', models.CharField(max_length=20, unique=True)),
+                        ('ho_ten', models.CharField(max_length=100)),
+                        ('email', models.EmailField(max_length=254)),
+                        ('chuc_vu', models.CharField(max_length=100)),
+                        ('phong_ban', models.CharField(max_length=100)),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='LoanSlip',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ma_nhan_vien', models.CharField(max_length=20, verbose_name='Mã NV')),
+                        ('nguoi_muon', models.CharField(max_length=100, verbose_name='Họ tên')),
+                        ('email', models.EmailField(max_length=254, verbose_name='Email')),
+                        ('chuc_vu', models.CharField(max_length=100, verbose_name='Chức vụ')),
+                        ('phong_ban', models.CharField(max_length=100, verbose_name='Phòng ban')),
+                        ('ly_do', models.TextField(verbose_name='Lý do mượn')),
+                        ('ghi_chu', models.TextField(blank=True, null=True, verbose_name='Ghi chú')),
+                        ('ngay_muon', models.DateField(default=django.utils.timezone.now, verbose_name='Ngày mượn')),
+                        ('ngay_tra_du_kien', models.DateField(blank=True, null=True, verbose_name='Ngày trả dự kiến')),
+                        ('ngay_tao', models.DateTimeField(auto_now_add=True)),
+                        ('ngay_tra_thuc_te', models.DateTimeField(blank=True, null=True, verbose_name='Ngày trả thực tế')),
+                        ('status', models.CharField(choices=[('draft', 'Nháp (Chờ gửi)'), ('dept_pending', 'Chờ Trưởng phòng duyệt'), ('director_pending', 'Chờ Giám đốc duyệt'), ('warehouse_pending', 'Chờ Kho xuất hàng'), ('borrowing', 'Đang mượn (Đã xuất kho)'), ('returning', 'Chờ xác nhận trả'), ('returned', 'Đã trả / Hoàn tất'), ('rejected', 'Đã từ chối')], default='draft', max_length=20)),
+                        ('ngay_gui', models.DateTimeField(blank=True, null=True, verbose_name='Ngày gửi duyệt')),
+                        ('ngay_truong_phong_duyet', models.DateTimeField(blank=True, null=True, verbose_name='Ngày TP duyệt')),
+                        ('ngay_giam_doc_duyet', models.DateTimeField(blank=True, null=True, verbose_name='Ngày GĐ duyệt')),
+                        ('ngay_kho_xac_nhan_muon', models.DateTimeField(blank=True, null=True, verbose_name='Ngày xuất kho')),
+                        ('ngay_kho_xac_nhan_tra', models.DateTimeField(blank=True, null=True, verbose_name='Ngày nhập kho lại')),
+                        ('ngay_tu_choi', models.DateTimeField(blank=True, null=True, verbose_name='Ngày từ chối')),
+                        ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                        ('user_giam_doc', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duyet_gd', to=settings.AUTH_USER_MODEL)),
+                        ('user_nguoi_tra', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='nguoi_tra', to=settings.AUTH_USER_MODEL)),
+                        ('user_thu_kho_nhap', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duyet_kho_nhap', to=settings.AUTH_USER_MODEL)),
+                        ('user_thu_kho_xuat', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duyet_kho_xuat', to=settings.AUTH_USER_MODEL)),
+                        ('user_truong_phong', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duyet_tp', to=settings.AUTH_USER_MODEL)),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='LoanItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('ten_tai_san', models.CharField(max_length=200, verbose_name='Tên tài sản')),
+                        ('don_vi_tinh', models.CharField(max_length=50, verbose_name='Đơn vị tính')),
+                        ('so_luong', models.IntegerField(default=1, verbose_name='Số lượng')),
+                        ('tinh_trang', models.CharField(choices=[('binh_thuong', 'Bình thường'), ('hu_hong', 'Hư hỏng'), ('khac', 'Khác (Ghi chú thêm)')], default='binh_thuong', max_length=20, verbose_name='Tình trạng')),
+                        ('tinh_trang_khac', models.CharField(blank=True, max_length=200, null=True, verbose_name='Chi tiết (nếu chọn Khác)')),
+                        ('ghi_chu', models.CharField(blank=True, max_length=200, null=True, verbose_name='Ghi chú chung')),
+                        ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='warehouse.loanslip')),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='LoanImage',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('image', models.ImageField(upload_to='loan_photos/%Y/%m/')),
+                        ('image_type', models.CharField(choices=[('borrow', 'Trước khi mượn'), ('return', 'Sau khi trả')], max_length=10)),
+                        ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                        ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='warehouse.loanslip')),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='LoanHistory',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('action', models.CharField(max_length=100, verbose_name='Hành động')),
+                        ('timestamp', models.DateTimeField(auto_now_add=True)),
+                        ('note', models.TextField(blank=True, null=True, verbose_name='Ghi chú')),
+                        ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                        ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='warehouse.loanslip')),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='PurchaseHistory',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('action', models.CharField(max_length=100, verbose_name='Hành động')),
+                        ('timestamp', models.DateTimeField(auto_now_add=True)),
+                        ('note', models.TextField(blank=True, null=True, verbose_name='Ghi chú')),
+                        ('slip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history', to='warehouse.purchaseslip')),
+                        ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='PurchaseImage',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('image', models.ImageField(upload_to='purchase_photos/%Y/%m/')),
+                        ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                        ('slip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='images', to='warehouse.purchaseslip')),
+                    ],
+                ),
+                migrations.CreateModel(
+                    name='UserProfile',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('signature', models.ImageField(blank=True, null=True, upload_to='signatures/', verbose_name='Ảnh chữ ký')),
+                        ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='profile', to=settings.AUTH_USER_MODEL)),
+                    ],
+                ),
+            ],
+        ),
+        migrations.RunPython(create_missing_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0004_sync_missing_models'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exportslip',
+            index=models.Index(fields=['status', 'id'], name='export_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportslip',
+            index=models.Index(fields=['status', 'ngay_tao'], name='export_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportslip',
+            index=models.Index(fields=['ngay_tao', 'id'], name='export_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportslip',
+            index=models.Index(fields=['phong_ban', 'id'], name='export_dept_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportslip',
+            index=models.Index(fields=['nguoi_de_xuat', 'id'], name='export_proposer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportslip',
+            index=models.Index(fields=['ma_nhan_vien'], name='export_emp_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['status', 'id'], name='loan_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['status', 'ngay_tao'], name='loan_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['status', 'ngay_tra_du_kien'], name='loan_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['ngay_tao', 'id'], name='loan_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['ngay_tra_du_kien', 'id'], name='loan_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['phong_ban', 'id'], name='loan_dept_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['nguoi_muon', 'id'], name='loan_borrower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanslip',
+            index=models.Index(fields=['ma_nhan_vien'], name='loan_emp_code_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['status', 'id'], name='purchase_status_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['status', 'ngay_tao'], name='purchase_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['ngay_tao', 'id'], name='purchase_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['phong_ban', 'id'], name='purchase_dept_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['nguoi_de_xuat', 'id'], name='purchase_proposer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['nha_cung_cap', 'id'], name='purchase_supplier_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchaseslip',
+            index=models.Index(fields=['ma_nhan_vien'], name='purchase_emp_code_idx'),
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+from warehouse.search import fold_text
+
+# Giữ cố định tại thời điểm migration (model lịch sử không có SEARCH_FIELDS)
+SEARCH_FIELDS = {
+    'LoanSlip': ('nguoi_muon', 'ma_nhan_vien'),
+    'PurchaseSlip': ('nguoi_de_xuat', 'ma_nhan_vien', 'nha_cung_cap'),
+    'ExportSlip': ('nguoi_de_xuat', 'ma_nhan_vien'),
+}
+
+
+def fill_search_text(apps, schema_editor):
+    for name, fields in SEARCH_FIELDS.items():
+        model = apps.get_model('warehouse', name)
+        batch = []
+        for slip in model.objects.only(*fields).iterator(chunk_size=1000):
+            slip.search_text = fold_text(' '.join(str(getattr(slip, f) or '') for f in fields))
+            batch.append(slip)
+            if len(batch) >= 1000:
+                model.objects.bulk_update(batch, ['search_text'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['search_text'])
+
+
+def create_search_index(apps, schema_editor):
+    """Postgres: index GIN trên tsvector. SQLite: bảng ảo FTS5 (rowid = id phiếu)"""
+    vendor = schema_editor.connection.vendor
+    for name in SEARCH_FIELDS:
+        table = apps.get_model('warehouse', name)._meta.db_table
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                f'CREATE INDEX "{table}_search_gin" ON "{table}" '
+                f"USING gin (to_tsvector('simple', \"search_text\"))"
+            )
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'CREATE VIRTUAL TABLE "{table}_fts" USING fts5(search_text)')
+            schema_editor.execute(
+                f'INSERT INTO "{table}_fts" (rowid, search_text) SELECT id, search_text FROM "{table}"'
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for name in SEARCH_FIELDS:
+        table = apps.get_model('warehouse', name)._meta.db_table
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS "{table}_search_gin"')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS "{table}_fts"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0005_slip_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportslip',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='loanslip',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='purchaseslip',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:29
+
+from django.db import migrations, models
+
+from warehouse.search import fold_text
+
+
+def fill_search_text(apps, schema_editor):
+    Employee = apps.get_model('warehouse', 'Employee')
+    batch = []
+    for emp in Employee.objects.only('ma_nhan_vien', 'ho_ten').iterator(chunk_size=1000):
+        emp.search_text = fold_text(f'{emp.ma_nhan_vien} {emp.ho_ten}')
+        batch.append(emp)
+        if len(batch) >= 1000:
+            Employee.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        Employee.objects.bulk_update(batch, ['search_text'])
+
+
+def create_trigram_index(apps, schema_editor):
+    """Chỉ Postgres: index trigram cho LIKE '%...%' (DB khác dùng danh bạ trong bộ nhớ)"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX "warehouse_employee_search_trgm" ON "warehouse_employee" '
+        'USING gin ("search_text" gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS "warehouse_employee_search_trgm"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0006_slip_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='employee',
+            name='search_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=130),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
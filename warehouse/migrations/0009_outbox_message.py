@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0008_pdf_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Tiêu đề')),
+                ('html', models.TextField(verbose_name='Nội dung')),
+                ('recipients', models.JSONField(default=list, verbose_name='Người nhận')),
+                ('attachment_kind', models.CharField(blank=True, max_length=20)),
+                ('attachment_slip_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('attachment_name', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'Chờ gửi'), ('sending', 'Đang gửi'), ('sent', 'Đã gửi'), ('failed', 'Gửi lỗi')], default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Số lần thử')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claim_token', models.CharField(blank=True, max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('provider_id', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'), models.Index(fields=['claim_token'], name='outbox_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0009_outbox_message'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20, verbose_name='Loại phiếu')),
+                ('slip_id', models.PositiveIntegerField(verbose_name='Số phiếu')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/', verbose_name='File Excel')),
+                ('file_name', models.CharField(max_length=255, verbose_name='Tên file')),
+                ('status', models.CharField(choices=[('pending', 'Đang chờ'), ('running', 'Đang nhập'), ('done', 'Hoàn tất'), ('failed', 'Lỗi')], default='pending', max_length=20)),
+                ('rows_parsed', models.PositiveIntegerField(default=0, verbose_name='Số dòng đã đọc')),
+                ('rows_inserted', models.PositiveIntegerField(default=0, verbose_name='Số dòng đã thêm')),
+                ('rows_rejected', models.PositiveIntegerField(default=0, verbose_name='Số dòng lỗi')),
+                ('row_errors', models.JSONField(blank=True, default=list, verbose_name='Dòng lỗi')),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'slip_id'], name='importjob_slip_idx'), models.Index(fields=['status', 'created_at'], name='importjob_status_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0010_import_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='preview_token',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Mã bản xem trước'),
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='file',
+            field=models.FileField(blank=True, upload_to='imports/%Y/%m/', verbose_name='File Excel'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0011_import_job_preview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='export_photos/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='loanimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='loan_photos/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='purchaseimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='purchase_photos/%Y/%m/'),
+        ),
+    ]
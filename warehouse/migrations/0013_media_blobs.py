@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:20
+
+import warehouse.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0012_image_thumbnails'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportimage',
+            name='image',
+            field=models.ImageField(storage=warehouse.storage.ContentAddressedStorage(), upload_to='export_photos/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='exportimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, storage=warehouse.storage.ContentAddressedStorage(), upload_to='export_photos/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='loanimage',
+            name='image',
+            field=models.ImageField(storage=warehouse.storage.ContentAddressedStorage(), upload_to='loan_photos/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='loanimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, storage=warehouse.storage.ContentAddressedStorage(), upload_to='loan_photos/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='purchaseimage',
+            name='image',
+            field=models.ImageField(storage=warehouse.storage.ContentAddressedStorage(), upload_to='purchase_photos/%Y/%m/'),
+        ),
+        migrations.AlterField(
+            model_name='purchaseimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, storage=warehouse.storage.ContentAddressedStorage(), upload_to='purchase_photos/%Y/%m/'),
+        ),
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='File')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Dung lượng (byte)')),
+                ('refcount', models.IntegerField(default=0, verbose_name='Số dòng đang dùng')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount'], name='mediablob_refcount_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:40
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """Trước khi thêm ràng buộc: mỗi phiên bản chỉ giữ job đang chạy mới nhất, các job trùng coi như lỗi"""
+    PdfJob = apps.get_model('warehouse', 'PdfJob')
+    seen, duplicates = set(), []
+    active = PdfJob.objects.filter(status__in=['pending', 'running']).order_by('-id')
+    for job in active.only('id', 'kind', 'slip_id', 'version').iterator():
+        key = (job.kind, job.slip_id, job.version)
+        if key in seen:
+            duplicates.append(job.pk)
+        seen.add(key)
+    PdfJob.objects.filter(pk__in=duplicates).update(
+        status='failed', error='Trùng job đang tạo', finished_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0014_photo_uploads'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pdfjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('kind', 'slip_id', 'version'), name='pdfjob_one_active_version'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('warehouse', '0015_pdfjob_one_active_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportitem',
+            name='import_job_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Job import'),
+        ),
+        migrations.AddField(
+            model_name='loanitem',
+            name='import_job_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Job import'),
+        ),
+        migrations.AddField(
+            model_name='purchaseitem',
+            name='import_job_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Job import'),
+        ),
+    ]
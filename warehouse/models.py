@@ -1,6 +1,9 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 from django.contrib.auth.models import User
+from .storage import photo_storage
 
 # 1. Model Nhân Viên
 class Employee(models.Model):
@@ -9,6 +12,8 @@ class Employee(models.Model):
     email = models.EmailField()
     chuc_vu = models.CharField(max_length=100)
     phong_ban = models.CharField(max_length=100)
+    # Mã + họ tên đã bỏ dấu, dùng cho ô gợi ý nhân viên (xem warehouse/employees.py)
+    search_text = models.CharField(max_length=130, default='', blank=True, editable=False)
 
     def __str__(self):
         return f"{self.ma_nhan_vien} - {self.ho_ten}"
@@ -62,6 +67,25 @@ class LoanSlip(models.Model):
     ngay_kho_xac_nhan_tra = models.DateTimeField("Ngày nhập kho lại", null=True, blank=True)
     ngay_tu_choi = models.DateTimeField("Ngày từ chối", null=True, blank=True)
 
+    # Cột tìm kiếm: gộp các trường bên dưới, đã bỏ dấu (xem warehouse/search.py)
+    SEARCH_FIELDS = ('nguoi_muon', 'ma_nhan_vien')
+    # Các cột được phép sắp xếp ở trang danh sách / file tải xuống (xem warehouse/filters.py)
+    LIST_SORT_FIELDS = ('id', 'nguoi_muon', 'phong_ban', 'ngay_tao', 'ngay_tra_du_kien', 'status')
+    search_text = models.TextField(default='', blank=True, editable=False)
+
+    class Meta:
+        # Index khớp với các bộ lọc / sắp xếp của trang danh sách (luôn kèm id cho phân trang)
+        indexes = [
+            models.Index(fields=['status', 'id'], name='loan_status_id_idx'),
+            models.Index(fields=['status', 'ngay_tao'], name='loan_status_created_idx'),
+            models.Index(fields=['status', 'ngay_tra_du_kien'], name='loan_status_due_idx'),
+            models.Index(fields=['ngay_tao', 'id'], name='loan_created_idx'),
+            models.Index(fields=['ngay_tra_du_kien', 'id'], name='loan_due_idx'),
+            models.Index(fields=['phong_ban', 'id'], name='loan_dept_idx'),
+            models.Index(fields=['nguoi_muon', 'id'], name='loan_borrower_idx'),
+            models.Index(fields=['ma_nhan_vien'], name='loan_emp_code_idx'),
+        ]
+
     def __str__(self):
         return f"Phiếu mượn #{self.id} - {self.nguoi_muon}"
 
@@ -95,6 +119,8 @@ class LoanItem(models.Model):
     
     # Chỉ khai báo ghi_chu 1 lần ở đây:
     ghi_chu = models.CharField("Ghi chú chung", max_length=200, blank=True, null=True)
+    # Job import Excel đã thêm dòng này (xem import_jobs.py): job lỗi giữa chừng -> xóa đúng các dòng của job
+    import_job_id = models.PositiveIntegerField("Job import", null=True, blank=True, editable=False)
 
     @property
     def chi_tiet_tinh_trang(self):
@@ -103,13 +129,21 @@ class LoanItem(models.Model):
         return self.get_tinh_trang_display()
 
 # 4. Model Ảnh
-class LoanImage(models.Model):
+class SlipPhotoMixin:
+    """Ảnh đính kèm phiếu: hiển thị ảnh thu nhỏ, ảnh cũ chưa có ảnh thu nhỏ thì dùng ảnh gốc"""
+
+    @property
+    def thumb_url(self):
+        return (self.thumbnail or self.image).url
+
+class LoanImage(SlipPhotoMixin, models.Model):
     TYPE_CHOICES = (
         ('borrow', 'Trước khi mượn'),
         ('return', 'Sau khi trả'),
     )
     loan = models.ForeignKey(LoanSlip, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='loan_photos/%Y/%m/')
+    image = models.ImageField(upload_to='loan_photos/%Y/%m/', storage=photo_storage)
+    thumbnail = models.ImageField(upload_to='loan_photos/%Y/%m/', storage=photo_storage, blank=True)
     image_type = models.CharField(max_length=10, choices=TYPE_CHOICES)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -166,6 +200,22 @@ class PurchaseSlip(models.Model):
     ngay_giam_doc_duyet = models.DateTimeField(null=True, blank=True)
     ngay_tu_choi = models.DateTimeField(null=True, blank=True)
 
+    SEARCH_FIELDS = ('nguoi_de_xuat', 'ma_nhan_vien', 'nha_cung_cap')
+    # Các cột được phép sắp xếp ở trang danh sách / file tải xuống (xem warehouse/filters.py)
+    LIST_SORT_FIELDS = ('id', 'nguoi_de_xuat', 'phong_ban', 'ngay_tao', 'status', 'nha_cung_cap')
+    search_text = models.TextField(default='', blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='purchase_status_id_idx'),
+            models.Index(fields=['status', 'ngay_tao'], name='purchase_status_created_idx'),
+            models.Index(fields=['ngay_tao', 'id'], name='purchase_created_idx'),
+            models.Index(fields=['phong_ban', 'id'], name='purchase_dept_idx'),
+            models.Index(fields=['nguoi_de_xuat', 'id'], name='purchase_proposer_idx'),
+            models.Index(fields=['nha_cung_cap', 'id'], name='purchase_supplier_idx'),
+            models.Index(fields=['ma_nhan_vien'], name='purchase_emp_code_idx'),
+        ]
+
     def __str__(self):
         return f"Phiếu mua #{self.id} - {self.nguoi_de_xuat}"
 
@@ -194,11 +244,14 @@ class PurchaseItem(models.Model):
     don_vi_tinh = models.CharField("ĐVT", max_length=50)
     so_luong = models.IntegerField("Số lượng", default=1)
     ghi_chu = models.CharField("Ghi chú", max_length=255, blank=True, null=True)
+    # Job import Excel đã thêm dòng này (xem import_jobs.py): job lỗi giữa chừng -> xóa đúng các dòng của job
+    import_job_id = models.PositiveIntegerField("Job import", null=True, blank=True, editable=False)
 
 # 3. THÊM MODEL ẢNH CHO MUA HÀNG (MỚI)
-class PurchaseImage(models.Model):
+class PurchaseImage(SlipPhotoMixin, models.Model):
     slip = models.ForeignKey(PurchaseSlip, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='purchase_photos/%Y/%m/')
+    image = models.ImageField(upload_to='purchase_photos/%Y/%m/', storage=photo_storage)
+    thumbnail = models.ImageField(upload_to='purchase_photos/%Y/%m/', storage=photo_storage, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
 # 4. THÊM MODEL LỊCH SỬ CHO MUA HÀNG (MỚI)
@@ -249,6 +302,21 @@ class ExportSlip(models.Model):
     ngay_giam_doc_duyet = models.DateTimeField(null=True, blank=True)
     ngay_tu_choi = models.DateTimeField(null=True, blank=True)
 
+    SEARCH_FIELDS = ('nguoi_de_xuat', 'ma_nhan_vien')
+    # Các cột được phép sắp xếp ở trang danh sách / file tải xuống (xem warehouse/filters.py)
+    LIST_SORT_FIELDS = ('id', 'nguoi_de_xuat', 'phong_ban', 'ngay_tao', 'status')
+    search_text = models.TextField(default='', blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='export_status_id_idx'),
+            models.Index(fields=['status', 'ngay_tao'], name='export_status_created_idx'),
+            models.Index(fields=['ngay_tao', 'id'], name='export_created_idx'),
+            models.Index(fields=['phong_ban', 'id'], name='export_dept_idx'),
+            models.Index(fields=['nguoi_de_xuat', 'id'], name='export_proposer_idx'),
+            models.Index(fields=['ma_nhan_vien'], name='export_emp_code_idx'),
+        ]
+
     def __str__(self):
         return f"Phiếu xuất #{self.id} - {self.nguoi_de_xuat}"
 
@@ -267,10 +335,13 @@ class ExportItem(models.Model):
     don_vi_tinh = models.CharField("ĐVT", max_length=50)
     so_luong = models.IntegerField("Số lượng", default=1)
     ghi_chu = models.CharField("Ghi chú", max_length=255, blank=True, null=True)
+    # Job import Excel đã thêm dòng này (xem import_jobs.py): job lỗi giữa chừng -> xóa đúng các dòng của job
+    import_job_id = models.PositiveIntegerField("Job import", null=True, blank=True, editable=False)
 
-class ExportImage(models.Model):
+class ExportImage(SlipPhotoMixin, models.Model):
     slip = models.ForeignKey(ExportSlip, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='export_photos/%Y/%m/')
+    image = models.ImageField(upload_to='export_photos/%Y/%m/', storage=photo_storage)
+    thumbnail = models.ImageField(upload_to='export_photos/%Y/%m/', storage=photo_storage, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
 class ExportHistory(models.Model):
@@ -279,9 +350,152 @@ class ExportHistory(models.Model):
     action = models.CharField("Hành động", max_length=100)
     timestamp = models.DateTimeField(auto_now_add=True)
     note = models.TextField("Ghi chú", blank=True, null=True)
-    
-from django.db.models.signals import post_save
+
+# --- HÀNG ĐỢI TẠO PDF (xem pdf_jobs.py) ---
+class PdfJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Đang chờ'),
+        ('running', 'Đang tạo'),
+        ('done', 'Hoàn tất'),
+        ('failed', 'Lỗi'),
+    )
+    kind = models.CharField("Loại phiếu", max_length=20)  # model_name: loanslip, purchaseslip, exportslip
+    slip_id = models.PositiveIntegerField("Số phiếu")
+    version = models.CharField("Phiên bản nội dung", max_length=32)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'slip_id', 'version'], name='pdfjob_slip_version_idx'),
+            models.Index(fields=['status', 'created_at'], name='pdfjob_status_created_idx'),
+        ]
+        constraints = [
+            # Mỗi phiên bản PDF của phiếu chỉ có 1 job đang chờ / đang tạo (chặn 2 request tạo trùng)
+            models.UniqueConstraint(
+                fields=['kind', 'slip_id', 'version'], condition=models.Q(status__in=['pending', 'running']),
+                name='pdfjob_one_active_version',
+            ),
+        ]
+
+    def __str__(self):
+        return f"PDF {self.kind} #{self.slip_id} ({self.status})"
+
+# --- HÀNG ĐỢI EMAIL (OUTBOX, xem outbox.py) ---
+class OutboxMessage(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Chờ gửi'),
+        ('sending', 'Đang gửi'),
+        ('sent', 'Đã gửi'),
+        ('failed', 'Gửi lỗi'),
+    )
+    subject = models.CharField("Tiêu đề", max_length=255)
+    html = models.TextField("Nội dung")
+    recipients = models.JSONField("Người nhận", default=list)
+    # PDF đính kèm: phiếu nào (model_name + id) và tên file
+    attachment_kind = models.CharField(max_length=20, blank=True)
+    attachment_slip_id = models.PositiveIntegerField(null=True, blank=True)
+    attachment_name = models.CharField(max_length=100, blank=True)
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField("Số lần thử", default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    provider_id = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_next_idx'),
+            models.Index(fields=['claim_token'], name='outbox_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
+
+# --- IMPORT EXCEL CHẠY NỀN (xem import_jobs.py) ---
+class ImportJob(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Đang chờ'),
+        ('running', 'Đang nhập'),
+        ('done', 'Hoàn tất'),
+        ('failed', 'Lỗi'),
+    )
+    kind = models.CharField("Loại phiếu", max_length=20)  # model_name: loanslip, purchaseslip, exportslip
+    slip_id = models.PositiveIntegerField("Số phiếu")
+    file = models.FileField("File Excel", upload_to='imports/%Y/%m/', blank=True)
+    file_name = models.CharField("Tên file", max_length=255)
+    preview_token = models.CharField("Mã bản xem trước", max_length=64, blank=True)  # xem import_preview.py
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    rows_parsed = models.PositiveIntegerField("Số dòng đã đọc", default=0)
+    rows_inserted = models.PositiveIntegerField("Số dòng đã thêm", default=0)
+    rows_rejected = models.PositiveIntegerField("Số dòng lỗi", default=0)
+    row_errors = models.JSONField("Dòng lỗi", default=list, blank=True)  # [[số dòng Excel, lý do], ...]
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'slip_id'], name='importjob_slip_idx'),
+            models.Index(fields=['status', 'created_at'], name='importjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Import {self.file_name} -> {self.kind} #{self.slip_id} ({self.status})"
+
+# --- FILE ẢNH LƯU THEO NỘI DUNG (xem storage.py, blobs.py) ---
+class MediaBlob(models.Model):
+    name = models.CharField("File", max_length=255, unique=True)  # photos/ab/cd/<sha256>.<đuôi>
+    size = models.PositiveBigIntegerField("Dung lượng (byte)", default=0)
+    refcount = models.IntegerField("Số dòng đang dùng", default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount'], name='mediablob_refcount_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+# --- TẢI ẢNH THEO TỪNG ĐOẠN, MẤT MẠNG THÌ TẢI TIẾP (xem uploads.py) ---
+class PhotoUpload(models.Model):
+    STATUS_CHOICES = (
+        ('uploading', 'Đang tải'),
+        ('complete', 'Đã tải xong'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='photo_uploads')
+    file_name = models.CharField("Tên file", max_length=255)
+    size = models.PositiveBigIntegerField("Dung lượng (byte)")
+    received = models.PositiveBigIntegerField("Đã nhận (byte)", default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at'], name='photoupload_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.file_name} {self.received}/{self.size} ({self.status})"
+
+from django.db.models.signals import post_save, pre_save, post_delete, m2m_changed
+from django.contrib.auth.models import Group
 from django.dispatch import receiver
+from .search import build_search_text, update_search_index, remove_search_index
+from .pdf_cache import invalidate_slip_pdf
 
 @receiver(post_save, sender=User)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
@@ -298,3 +512,165 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         UserProfile.objects.get_or_create(user=instance)
         # Sau đó lưu (nếu cần thiết, thực ra get_or_create đã lưu rồi)
         instance.profile.save()
+
+# --- CHỈ MỤC TÌM KIẾM CHO CÁC LOẠI PHIẾU ---
+@receiver(pre_save, sender=LoanSlip)
+@receiver(pre_save, sender=PurchaseSlip)
+@receiver(pre_save, sender=ExportSlip)
+def fill_slip_search_text(sender, instance, **kwargs):
+    """Cập nhật cột search_text (đã bỏ dấu) mỗi khi lưu phiếu"""
+    instance.search_text = build_search_text(instance)
+
+@receiver(post_save, sender=LoanSlip)
+@receiver(post_save, sender=PurchaseSlip)
+@receiver(post_save, sender=ExportSlip)
+def sync_slip_search_index(sender, instance, **kwargs):
+    update_search_index(instance)
+
+@receiver(post_delete, sender=LoanSlip)
+@receiver(post_delete, sender=PurchaseSlip)
+@receiver(post_delete, sender=ExportSlip)
+def drop_slip_search_index(sender, instance, **kwargs):
+    remove_search_index(instance)
+
+# --- ẢNH ĐÍNH KÈM PHIẾU: NÉN + ẢNH THU NHỎ ---
+@receiver(pre_save, sender=LoanImage)
+@receiver(pre_save, sender=PurchaseImage)
+@receiver(pre_save, sender=ExportImage)
+def ingest_slip_photo(sender, instance, **kwargs):
+    """Ảnh mới tải lên (chưa ghi xuống storage) -> xoay, bỏ metadata, thu nhỏ, nén và tạo ảnh thu nhỏ"""
+    from .images import ingest_image
+    if instance.image and not instance.image._committed:
+        ingest_image(instance)
+
+@receiver(pre_save, sender=LoanImage)
+@receiver(pre_save, sender=PurchaseImage)
+@receiver(pre_save, sender=ExportImage)
+def remember_slip_photo_files(sender, instance, **kwargs):
+    """Sửa dòng ảnh đã có (vd. đổi ảnh trong admin) -> nhớ file cũ để trả lại lượt dùng sau khi lưu"""
+    if not instance._state.adding:
+        previous = sender.objects.filter(pk=instance.pk).values_list('image', 'thumbnail').first()
+        instance._previous_photo_files = [name for name in previous or () if name]
+
+@receiver(post_save, sender=LoanImage)
+@receiver(post_save, sender=PurchaseImage)
+@receiver(post_save, sender=ExportImage)
+def count_slip_photo_files(sender, instance, created, **kwargs):
+    from .blobs import photo_names, retain, release
+    current = photo_names(instance)
+    previous = [] if created else getattr(instance, '_previous_photo_files', [])
+    retain([name for name in current if name not in previous])
+    release([name for name in previous if name not in current])
+
+@receiver(post_delete, sender=LoanImage)
+@receiver(post_delete, sender=PurchaseImage)
+@receiver(post_delete, sender=ExportImage)
+def release_slip_photo_files(sender, instance, **kwargs):
+    from .blobs import photo_names, release
+    release(photo_names(instance))
+
+# --- ĐỔI CHỮ KÝ: XÓA FILE CHỮ KÝ CŨ ---
+@receiver(pre_save, sender=UserProfile)
+def remember_previous_signature(sender, instance, **kwargs):
+    if instance.pk:
+        instance._previous_signature = sender.objects.filter(pk=instance.pk).values_list('signature', flat=True).first()
+
+@receiver(post_save, sender=UserProfile)
+def drop_replaced_signature(sender, instance, **kwargs):
+    from .media_gc import delete_on_commit
+    previous = getattr(instance, '_previous_signature', None)
+    if previous and previous != (instance.signature.name if instance.signature else None):
+        delete_on_commit([previous])
+
+@receiver(post_delete, sender=UserProfile)
+def drop_deleted_signature(sender, instance, **kwargs):
+    from .media_gc import delete_on_commit
+    if instance.signature:
+        delete_on_commit([instance.signature.name])
+
+# --- DANH BẠ NHÂN VIÊN (GỢI Ý MÃ NV) ---
+@receiver(pre_save, sender=Employee)
+def fill_employee_search_text(sender, instance, **kwargs):
+    from .employees import employee_search_text
+    instance.search_text = employee_search_text(instance)
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def refresh_employee_directory(sender, instance, **kwargs):
+    """Nhân viên thay đổi -> đánh dấu danh bạ trong bộ nhớ cần dựng lại"""
+    from .employees import invalidate_employee_directory
+    invalidate_employee_directory()
+
+# --- CACHE PDF CỦA PHIẾU ---
+@receiver(post_save, sender=LoanSlip)
+@receiver(post_save, sender=PurchaseSlip)
+@receiver(post_save, sender=ExportSlip)
+@receiver(post_delete, sender=LoanSlip)
+@receiver(post_delete, sender=PurchaseSlip)
+@receiver(post_delete, sender=ExportSlip)
+def drop_slip_pdf_cache(sender, instance, **kwargs):
+    """Lưu / duyệt / xóa phiếu -> bỏ bản PDF đã cache"""
+    invalidate_slip_pdf(sender._meta.model_name, instance.pk)
+
+# --- BỘ ĐẾM "CHỜ TÔI DUYỆT" ---
+@receiver(post_save, sender=LoanSlip)
+@receiver(post_save, sender=PurchaseSlip)
+@receiver(post_save, sender=ExportSlip)
+@receiver(post_delete, sender=LoanSlip)
+@receiver(post_delete, sender=PurchaseSlip)
+@receiver(post_delete, sender=ExportSlip)
+def drop_pending_counts(sender, instance, **kwargs):
+    """Tạo / sửa / xóa phiếu ngoài quy trình duyệt -> đếm lại sau khi commit (duyệt thì workflow.py tự cộng trừ)"""
+    from .workflow import MODEL_KINDS, invalidate_pending_counts
+    invalidate_pending_counts(MODEL_KINDS[sender])
+
+@receiver(post_save, sender=LoanItem)
+@receiver(post_save, sender=PurchaseItem)
+@receiver(post_save, sender=ExportItem)
+@receiver(post_delete, sender=LoanItem)
+@receiver(post_delete, sender=PurchaseItem)
+@receiver(post_delete, sender=ExportItem)
+def drop_item_slip_pdf_cache(sender, instance, **kwargs):
+    """Thêm / sửa / xóa dòng vật tư -> bỏ bản PDF đã cache của phiếu chứa nó"""
+    fk = 'loan' if sender is LoanItem else 'slip'
+    slip_model = sender._meta.get_field(fk).related_model
+    invalidate_slip_pdf(slip_model._meta.model_name, getattr(instance, f'{fk}_id'))
+
+# --- VAI TRÒ (NHÓM) CỦA USER: xóa bản đã cache (xem roles.py) ---
+@receiver(m2m_changed, sender=User.groups.through)
+def drop_cached_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    """Thêm / bớt user khỏi nhóm (từ phía user hoặc phía nhóm)"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    from .roles import invalidate_roles
+    if reverse:
+        invalidate_roles(pk_set)  # group.user_set.clear(): pk_set None -> xóa của mọi user
+    else:
+        instance.__dict__.pop('_group_names', None)
+        invalidate_roles([instance.pk])
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def drop_all_cached_roles(sender, instance, **kwargs):
+    """Đổi tên / xóa nhóm -> nhóm đã cache của mọi user không còn đúng"""
+    from .roles import invalidate_roles
+    invalidate_roles()
+
+# --- DANH BẠ NGƯỜI NHẬN MAIL THEO NHÓM (xem recipients.py) ---
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def drop_recipient_directory(sender, instance, update_fields=None, **kwargs):
+    """Đổi email / xóa user, đổi tên / xóa nhóm"""
+    if update_fields and set(update_fields) <= {'last_login'}:
+        return  # mỗi lần đăng nhập Django lưu last_login, không liên quan email
+    from .recipients import invalidate_recipients
+    invalidate_recipients()
+
+@receiver(m2m_changed, sender=User.groups.through)
+def drop_recipient_directory_on_membership(sender, action, **kwargs):
+    """Thêm / bớt thành viên nhóm"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        from .recipients import invalidate_recipients
+        invalidate_recipients()
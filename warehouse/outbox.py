@@ -0,0 +1,347 @@
+import base64
+import json
+import logging
+import os
+import random
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+import resend
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxMessage, LoanSlip, PurchaseSlip, ExportSlip
+from .pdf import slip_pdf, slip_pdf_version
+from .pdf_cache import read_cached_pdf
+from .pdf_jobs import get_executor, submit_slip_pdf, wait_for_pdf
+
+logger = logging.getLogger(__name__)
+
+# Hàng đợi email (transactional outbox):
+# - View chỉ ghi 1 dòng OutboxMessage trong cùng transaction với việc đổi trạng thái phiếu
+#   -> người duyệt không phải chờ tạo PDF / gọi API gửi mail, và mail không bị mất khi lỗi.
+# - Sau khi commit sẽ thử gửi ngay ở thread nền; lỗi thì lệnh process_outbox thử lại
+#   với thời gian chờ tăng dần (exponential backoff).
+# - Thread nền trong process web không tự tạo PDF đính kèm: nhờ pdf_jobs tạo ở process riêng,
+#   PDF chưa xong thì để lệnh process_outbox gửi.
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 6)
+RETRY_BASE = getattr(settings, 'OUTBOX_RETRY_BASE', 30)  # giây, nhân đôi sau mỗi lần lỗi
+RETRY_MAX = getattr(settings, 'OUTBOX_RETRY_MAX', 3600)
+SENDING_TIMEOUT = 300  # tin ở trạng thái "sending" quá lâu (worker chết) -> gửi lại
+SEND_ON_COMMIT = getattr(settings, 'OUTBOX_SEND_ON_COMMIT', True)
+PDF_WAIT = getattr(settings, 'OUTBOX_PDF_WAIT', 30)  # giây thread nền chờ pdf_jobs tạo file đính kèm
+FROM_EMAIL = getattr(settings, 'OUTBOX_FROM_EMAIL', 'system@sun-automation.id.vn')
+TRANSPORT = getattr(settings, 'OUTBOX_TRANSPORT', 'warehouse.outbox.ResendTransport')
+
+SLIP_MODELS = {model._meta.model_name: model for model in (LoanSlip, PurchaseSlip, ExportSlip)}
+
+
+# ============================================
+# 1. TRANSPORT (có thể thay bằng OUTBOX_TRANSPORT trong settings)
+# ============================================
+
+class BaseTransport:
+    """
+    Giao diện gửi mail. send() trả về id của nhà cung cấp (hoặc '') và ném lỗi khi thất bại.
+    attachments: list (tên file, bytes)
+    """
+
+    def send(self, message, attachments):
+        raise NotImplementedError
+
+    def send_batch(self, items):
+        """items: list (message, attachments) -> list kết quả (id hoặc Exception), cùng thứ tự"""
+        results = []
+        for message, attachments in items:
+            try:
+                results.append(self.send(message, attachments))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def encode_attachment(data):
+    """bytes -> chuỗi base64 để đưa vào JSON gửi Resend (~1.33 lần kích thước file)"""
+    return base64.b64encode(data).decode('ascii')
+
+
+class ResendTransport(BaseTransport):
+    BATCH_LIMIT = 100  # giới hạn của API /emails/batch
+
+    def __init__(self):
+        resend.api_key = settings.RESEND_API_KEY or os.environ.get('RESEND_API_KEY')
+
+    def params(self, message, attachments, encoded=None):
+        params = {
+            "from": FROM_EMAIL,
+            "to": message.recipients,
+            "subject": message.subject,
+            "html": message.html,
+        }
+        if attachments:
+            # content dạng base64 (không dùng list(bytes): mỗi byte thành 1 object int)
+            encoded = {} if encoded is None else encoded
+            params["attachments"] = []
+            for name, data in attachments:
+                if id(data) not in encoded:
+                    encoded[id(data)] = encode_attachment(data)
+                params["attachments"].append({"filename": name, "content": encoded[id(data)]})
+        return params
+
+    def send(self, message, attachments, encoded=None):
+        r = resend.Emails.send(self.params(message, attachments, encoded))
+        return r.get('id', '')
+
+    def send_batch(self, items):
+        # Các tin cùng phiếu dùng chung 1 object bytes -> chỉ mã hóa base64 một lần
+        encoded = {}
+        # API batch không nhận file đính kèm -> chỉ gộp các mail không có PDF
+        plain = [i for i, (_, attachments) in enumerate(items) if not attachments]
+        results = [None] * len(items)
+        for start in range(0, len(plain) if len(plain) > 1 else 0, self.BATCH_LIMIT):
+            chunk = plain[start:start + self.BATCH_LIMIT]
+            try:
+                r = resend.Batch.send([self.params(*items[i]) for i in chunk])
+                for i, sent in zip(chunk, r.get('data') or []):
+                    results[i] = sent.get('id', '')
+            except Exception as e:
+                for i in chunk:
+                    results[i] = e
+        for i, (message, attachments) in enumerate(items):
+            if results[i] is None:
+                try:
+                    results[i] = self.send(message, attachments, encoded)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+
+class ConsoleTransport(BaseTransport):
+    """In mail ra màn hình (dùng khi phát triển)"""
+
+    def send(self, message, attachments):
+        names = ', '.join(f'{name} ({len(data)} bytes)' for name, data in attachments) or 'không có'
+        logger.info("📧 [%s] %s -> %s | đính kèm: %s", message.pk, message.subject, ', '.join(message.recipients), names)
+        return f'console-{message.pk}'
+
+
+class FileTransport(BaseTransport):
+    """Ghi mỗi mail ra 1 file JSON (+ file đính kèm) trong OUTBOX_FILE_DIR (dùng khi test)"""
+
+    def __init__(self):
+        self.directory = getattr(settings, 'OUTBOX_FILE_DIR', os.path.join(settings.BASE_DIR, 'outbox_mails'))
+        os.makedirs(self.directory, exist_ok=True)
+
+    def send(self, message, attachments):
+        for name, data in attachments:
+            with open(os.path.join(self.directory, f'{message.pk}-{name}'), 'wb') as f:
+                f.write(data)
+        with open(os.path.join(self.directory, f'{message.pk}.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'subject': message.subject, 'to': message.recipients, 'html': message.html,
+                'attachments': [name for name, _ in attachments],
+            }, f, ensure_ascii=False)
+        return f'file-{message.pk}'
+
+
+def get_transport():
+    return import_string(TRANSPORT)()
+
+
+# ============================================
+# 2. GHI VÀO HÀNG ĐỢI
+# ============================================
+
+def enqueue_email(subject, html, recipients, slip=None, attachment_name=''):
+    """
+    Ghi 1 mail vào outbox. Gọi bên trong transaction của thao tác đổi trạng thái:
+    transaction rollback thì mail cũng không được gửi.
+    """
+    recipients = list(dict.fromkeys(r for r in recipients if r))
+    if not recipients:
+        return None
+    message = OutboxMessage.objects.create(
+        subject=subject, html=html, recipients=recipients,
+        attachment_kind=slip._meta.model_name if slip is not None else '',
+        attachment_slip_id=slip.pk if slip is not None else None,
+        attachment_name=attachment_name,
+    )
+    if SEND_ON_COMMIT:
+        transaction.on_commit(partial(_send_in_background, message.pk))
+    return message
+
+
+def _send_in_background(message_id):
+    def run():
+        try:
+            _prepare_attachment(message_id)
+            process_outbox(ids=[message_id], workers=1, render=False)
+        finally:
+            connection.close()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _prepare_attachment(message_id):
+    """Nhờ pdf_jobs tạo PDF đính kèm ở process riêng, chờ tối đa PDF_WAIT giây"""
+    message = OutboxMessage.objects.filter(pk=message_id).first()
+    # Không có pool (PDF_RENDER_WORKERS = 0) -> không tạo trong process web, để worker outbox lo
+    if message is None or not message.attachment_kind or get_executor() is None:
+        return
+    slip = SLIP_MODELS[message.attachment_kind].objects.filter(pk=message.attachment_slip_id).first()
+    if slip is not None:
+        _, future = submit_slip_pdf(slip)
+        wait_for_pdf(future, PDF_WAIT)
+
+
+# ============================================
+# 3. GỬI (worker)
+# ============================================
+
+def claim_messages(limit=50, ids=None):
+    """Giành quyền gửi một lô tin: UPDATE có điều kiện nên 2 worker không gửi trùng"""
+    now = timezone.now()
+    OutboxMessage.objects.filter(
+        status='sending', claimed_at__lt=now - timedelta(seconds=SENDING_TIMEOUT)
+    ).update(status='pending')
+
+    due = OutboxMessage.objects.filter(status='pending', next_attempt_at__lte=now)
+    if ids is not None:
+        due = due.filter(pk__in=ids)
+    due_ids = list(due.order_by('id').values_list('id', flat=True)[:limit])
+    if not due_ids:
+        return []
+    token = uuid.uuid4().hex
+    OutboxMessage.objects.filter(pk__in=due_ids, status='pending').update(
+        status='sending', claim_token=token, claimed_at=now
+    )
+    return list(OutboxMessage.objects.filter(claim_token=token, status='sending').order_by('id'))
+
+
+def retry_delay(attempts):
+    """30s, 60s, 120s... tối đa RETRY_MAX, cộng trừ 20% để các tin lỗi không dồn cùng lúc"""
+    delay = min(RETRY_MAX, RETRY_BASE * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class PdfNotReady(Exception):
+    """PDF đính kèm chưa có trong cache mà lượt gửi không được tự tạo (render=False)"""
+
+
+def _load_pdf(kind, slip_id, render=True):
+    slip = SLIP_MODELS[kind].objects.filter(pk=slip_id).first()
+    if slip is None:
+        return None
+    if render:
+        return slip_pdf(slip)
+    data = read_cached_pdf(kind, slip.pk, slip_pdf_version(slip))
+    if data is None:
+        raise PdfNotReady
+    return data
+
+
+def load_pdfs(messages, render=True):
+    """
+    Tạo / đọc PDF đính kèm của cả lô trước khi chia cho các thread gửi: mỗi phiếu đúng 1 lần,
+    các thread chỉ đọc dict kết quả. Giá trị: bytes, None (phiếu đã xóa) hoặc Exception.
+    """
+    pdfs = {}
+    for message in messages:
+        key = (message.attachment_kind, message.attachment_slip_id)
+        if message.attachment_kind and key not in pdfs:
+            try:
+                pdfs[key] = _load_pdf(*key, render=render)
+            except Exception as e:
+                pdfs[key] = e
+    return pdfs
+
+
+def _attachments(message, pdfs):
+    if not message.attachment_kind:
+        return []
+    data = pdfs[(message.attachment_kind, message.attachment_slip_id)]
+    if isinstance(data, Exception):
+        raise data
+    if data is None:
+        return []
+    return [(message.attachment_name, data)]
+
+
+def _mark(message, result):
+    """Ghi kết quả gửi; chỉ khi tin vẫn thuộc lượt giành của worker này (worker khác chưa giành lại)"""
+    now = timezone.now()
+    attempts = message.attempts + 1
+    claimed = OutboxMessage.objects.filter(pk=message.pk, claim_token=message.claim_token)
+    if not isinstance(result, Exception):
+        claimed.update(status='sent', attempts=attempts, sent_at=now, provider_id=result or '', last_error='')
+        return True
+    error = f'{type(result).__name__}: {result}'
+    if attempts >= MAX_ATTEMPTS:
+        claimed.update(status='failed', attempts=attempts, last_error=error)
+    else:
+        claimed.update(
+            status='pending', attempts=attempts, last_error=error,
+            next_attempt_at=now + timedelta(seconds=retry_delay(attempts)),
+        )
+    return False
+
+
+def _release(message):
+    """Trả tin về hàng đợi mà không tính là lỗi (chờ worker outbox gửi)"""
+    OutboxMessage.objects.filter(pk=message.pk, claim_token=message.claim_token).update(status='pending')
+
+
+def _send_group(transport, pdfs, messages):
+    """
+    Gửi các tin của cùng một nhóm người nhận, theo thứ tự tạo -> (số gửi được, số lỗi).
+    pdfs: kết quả load_pdfs của cả lô, dùng chung (chỉ đọc) giữa các nhóm
+    """
+    items, results = [], {}
+    for message in messages:
+        try:
+            items.append((message, _attachments(message, pdfs)))
+        except PdfNotReady:
+            _release(message)
+        except Exception as e:  # không tạo được PDF -> tính là 1 lần lỗi
+            results[message.pk] = e
+    if items:
+        for (message, _), result in zip(items, transport.send_batch(items)):
+            results[message.pk] = result
+    sent = sum(_mark(message, results[message.pk]) for message in messages if message.pk in results)
+    return sent, len(results) - sent
+
+
+def _send_group_in_thread(transport, pdfs, messages):
+    try:
+        return _send_group(transport, pdfs, messages)
+    finally:
+        connection.close()  # kết nối DB riêng của thread trong pool
+
+
+def process_outbox(batch_size=50, workers=4, transport=None, ids=None, render=True):
+    """
+    Gửi một lô tin đến hạn -> (số gửi được, số lỗi).
+    render=False: không tự tạo PDF đính kèm (thread nền trong process web), tin có PDF chưa sẵn được trả về hàng đợi
+    """
+    messages = claim_messages(batch_size, ids)
+    if not messages:
+        return 0, 0
+    transport = transport or get_transport()
+
+    # Gom theo người nhận: mỗi nhóm do 1 thread gửi, các nhóm chạy song song
+    groups = defaultdict(list)
+    for message in messages:
+        groups[tuple(sorted(message.recipients))].append(message)
+
+    pdfs = load_pdfs(messages, render)
+    if workers <= 1 or len(groups) == 1:
+        counts = [_send_group(transport, pdfs, group) for group in groups.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+            counts = list(pool.map(partial(_send_group_in_thread, transport, pdfs), groups.values()))
+    return sum(sent for sent, _ in counts), sum(failed for _, failed in counts)
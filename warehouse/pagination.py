@@ -0,0 +1,160 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+
+# Số dòng mỗi trang và ngưỡng đếm tối đa (quá ngưỡng thì hiển thị "1000+")
+PAGE_SIZE = 50
+COUNT_LIMIT = 1000
+
+
+class KeysetPage:
+    """
+    Một trang kết quả phân trang theo con trỏ (keyset).
+    Có thể lặp trực tiếp trong template như một danh sách.
+    """
+
+    def __init__(self, object_list, next_cursor=None, prev_cursor=None, count=0, count_limited=False):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.count = count
+        self.count_limited = count_limited
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    @property
+    def count_display(self):
+        """Số kết quả dạng chữ, bị chặn trên bởi COUNT_LIMIT"""
+        if self.count_limited:
+            return f"{COUNT_LIMIT}+"
+        return str(self.count)
+
+
+def _encode_cursor(sort, obj, field_name):
+    value = getattr(obj, field_name)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    payload = json.dumps({'s': sort, 'v': value, 'id': obj.pk}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, sort, field):
+    """Giải mã con trỏ -> (giá trị cột sắp xếp, id). Con trỏ hỏng/lệch sort -> None"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload.get('s') != sort:
+            return None
+        value = payload.get('v')
+        if value is not None:
+            value = field.to_python(value)
+        return value, int(payload['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError, ValidationError):
+        return None
+
+
+def keyset_paginate(queryset, sort, after=None, before=None, page_size=PAGE_SIZE):
+    """
+    Phân trang theo con trỏ: sắp xếp theo (cột sort, id) rồi lọc
+    "sau/trước dòng cuối của trang trước" thay vì OFFSET,
+    nên chi phí mỗi trang không phụ thuộc vào độ sâu của bảng.
+    - sort: tên cột, có thể có dấu '-' phía trước (giảm dần)
+    - after / before: con trỏ lấy từ trang trước (chuỗi base64)
+    """
+    desc = sort.startswith('-')
+    field_name = sort.lstrip('-')
+    try:
+        field = queryset.model._meta.get_field(field_name)
+    except FieldDoesNotExist:
+        annotation = queryset.query.annotations.get(field_name)
+        if annotation is not None:
+            # Cột tính toán, ví dụ search_rank của tìm kiếm
+            field = annotation.output_field
+        else:
+            field_name, desc, sort = 'id', True, '-id'
+            field = queryset.model._meta.get_field('id')
+    is_pk = field.primary_key
+    nullable = field.null
+
+    # Đếm có giới hạn (không COUNT toàn bảng)
+    count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+    count_limited = count > COUNT_LIMIT
+
+    backward = False
+    cursor = _decode_cursor(after, sort, field)
+    if cursor is None:
+        cursor = _decode_cursor(before, sort, field)
+        backward = cursor is not None
+
+    # Khi đi lùi thì đảo chiều sắp xếp, lấy xong sẽ đảo lại
+    descending = desc != backward
+
+    def order(name, null_aware=False):
+        expr = F(name)
+        kwargs = {}
+        if null_aware:
+            # Luôn đẩy NULL xuống cuối theo chiều xem "xuôi"
+            kwargs = {'nulls_first': True} if backward else {'nulls_last': True}
+        return expr.desc(**kwargs) if descending else expr.asc(**kwargs)
+
+    if is_pk:
+        ordering = [order('id')]
+    else:
+        ordering = [order(field_name, null_aware=nullable), order('id')]
+    qs = queryset.order_by(*ordering)
+
+    if cursor is not None:
+        value, last_id = cursor
+        op = 'lt' if descending else 'gt'
+        if is_pk:
+            condition = Q(**{f'id__{op}': last_id})
+        elif value is None:
+            # Con trỏ nằm trong vùng NULL
+            condition = Q(**{f'{field_name}__isnull': True, f'id__{op}': last_id})
+            if backward:
+                condition |= Q(**{f'{field_name}__isnull': False})
+        else:
+            condition = (
+                Q(**{f'{field_name}__{op}': value}) |
+                Q(**{field_name: value, f'id__{op}': last_id})
+            )
+            if nullable and not backward:
+                condition |= Q(**{f'{field_name}__isnull': True})
+        qs = qs.filter(condition)
+
+    rows = list(qs[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    next_cursor = prev_cursor = None
+    if backward:
+        rows.reverse()
+        if rows:
+            next_cursor = _encode_cursor(sort, rows[-1], field_name)
+            if has_more:
+                prev_cursor = _encode_cursor(sort, rows[0], field_name)
+    elif rows:
+        if has_more:
+            next_cursor = _encode_cursor(sort, rows[-1], field_name)
+        if cursor is not None:
+            prev_cursor = _encode_cursor(sort, rows[0], field_name)
+
+    return KeysetPage(rows, next_cursor, prev_cursor, count, count_limited)
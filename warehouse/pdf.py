@@ -0,0 +1,202 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.template.loader import render_to_string
+from django.utils import timezone
+from weasyprint import HTML
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+from .pdf_cache import read_cached_pdf, write_cached_pdf
+
+# Tạo PDF hoàn toàn offline: font, CSS, ảnh chữ ký đều đọc từ đĩa (qua cache RAM),
+# không bao giờ gọi ra mạng -> thời gian tạo PDF chỉ còn là thời gian dàn trang.
+ASSET_SCHEME = 'asset'
+ASSET_CACHE_BYTES = getattr(settings, 'PDF_ASSET_CACHE_BYTES', 32 * 1024 * 1024)
+FONT_DIRS = getattr(settings, 'PDF_FONT_DIRS', [
+    os.path.join(settings.BASE_DIR, 'static', 'fonts'),
+    '/usr/share/fonts/truetype/noto',  # gói fonts-noto-core (xem Dockerfile)
+])
+
+mimetypes.add_type('font/ttf', '.ttf')
+mimetypes.add_type('font/otf', '.otf')
+mimetypes.add_type('font/woff2', '.woff2')
+
+
+class AssetCache:
+    """Cache LRU trong bộ nhớ, giới hạn theo tổng số byte, dùng chung giữa các thread"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def set(self, key, body, mime_type):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._items[key] = (body, mime_type)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+asset_cache = AssetCache(ASSET_CACHE_BYTES)
+
+
+def _allowed_roots():
+    roots = [settings.MEDIA_ROOT, settings.STATIC_ROOT, *settings.STATICFILES_DIRS, *FONT_DIRS]
+    return [os.path.realpath(r) for r in roots if r]
+
+
+def _is_allowed(path):
+    path = os.path.realpath(path)
+    for root in _allowed_roots():
+        if os.path.commonpath([root, path]) == root:
+            return True
+    return False
+
+
+def find_asset(name):
+    """'fonts/NotoSerif-Regular.ttf' -> đường dẫn file: tìm trong static trước, rồi tới thư mục font"""
+    name = name.lstrip('/')
+    path = finders.find(name)
+    if path:
+        return path
+    for font_dir in FONT_DIRS:
+        candidate = os.path.join(font_dir, os.path.basename(name))
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f'Không tìm thấy tài nguyên PDF: {name}')
+
+
+def read_asset(path):
+    """Đọc file qua cache; khóa gồm mtime + size nên file đổi (vd. ký lại) sẽ tự đọc lại"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    item = asset_cache.get(key)
+    if item is None:
+        with open(path, 'rb') as f:
+            body = f.read()
+        mime_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if mime_type == 'text/css':
+            mime_type = 'text/css; charset=utf-8'
+        asset_cache.set(key, body, mime_type)
+        item = (body, mime_type)
+    return item
+
+
+class OfflineURLFetcher(URLFetcher):
+    """
+    url_fetcher cho WeasyPrint:
+    - asset:<đường dẫn static>  -> file trong static / thư mục font
+    - file://...               -> chỉ cho phép trong MEDIA_ROOT, static, thư mục font
+    - data:                    -> để WeasyPrint tự xử lý
+    - còn lại (http, https...) -> từ chối, không tải qua mạng
+    """
+
+    def fetch(self, url, headers=None):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme == 'data':
+            return super().fetch(url, headers)
+        if scheme == ASSET_SCHEME:
+            path = find_asset(unquote(url.split(':', 1)[1]))
+        elif scheme == 'file':
+            path = unquote(parts.path)
+            if not _is_allowed(path):
+                raise ValueError(f'Không cho phép đọc file ngoài thư mục media/static: {path}')
+        else:
+            raise ValueError(f'PDF không tải tài nguyên qua mạng: {url}')
+        body, mime_type = read_asset(path)
+        return URLFetcherResponse(url, body, {'Content-Type': mime_type})
+
+
+def render_html_pdf(html_string, target=None):
+    """
+    HTML đã render -> PDF. Không đụng tới DB nên chạy được trong process con (pdf_jobs).
+    Có target (vd. HttpResponse) thì ghi thẳng vào đó, không thì trả về bytes.
+    """
+    return HTML(string=html_string, url_fetcher=OfflineURLFetcher()).write_pdf(target)
+
+
+def render_pdf(template_name, context, target=None):
+    return render_html_pdf(render_to_string(template_name, context), target)
+
+
+# Template PDF và tên biến phiếu trong template, theo model_name
+SLIP_PDFS = {
+    'loanslip': ('warehouse/pdf/loan_template.html', 'loan'),
+    'purchaseslip': ('warehouse/pdf/purchase_template.html', 'slip'),
+    'exportslip': ('warehouse/pdf/export_template.html', 'slip'),
+}
+PDF_FILENAMES = {
+    'loanslip': 'phieu_{pk}.pdf',
+    'purchaseslip': 'phieu_mua_{pk}.pdf',
+    'exportslip': 'phieu_xuat_{pk}.pdf',
+}
+
+
+def slip_pdf_version(slip):
+    """
+    Hash mọi thứ có mặt trên bản PDF: các cột của phiếu, các dòng vật tư,
+    tên + file chữ ký (mtime, size) của những người ký, và ngày in ({% now %} trong template).
+    """
+    parts = [timezone.localdate().isoformat()]
+    fields = slip._meta.concrete_fields
+    parts += [f.value_to_string(slip) for f in fields]
+    parts += [repr(row) for row in slip.items.order_by('pk').values_list()]
+
+    user_ids = {getattr(slip, f.attname) for f in fields if f.is_relation and f.related_model is User}
+    user_ids.discard(None)
+    signers = User.objects.filter(pk__in=user_ids).order_by('pk').values_list(
+        'pk', 'username', 'first_name', 'last_name', 'profile__signature'
+    )
+    for row in signers:
+        parts.append(repr(row))
+        if row[-1]:
+            try:
+                stat = os.stat(os.path.join(settings.MEDIA_ROOT, row[-1]))
+                parts.append(f'{stat.st_mtime_ns}:{stat.st_size}')
+            except OSError:
+                parts.append('missing')
+    return hashlib.sha256('\x1f'.join(parts).encode()).hexdigest()[:32]
+
+
+def render_slip_html(slip, request=None):
+    template_name, var_name = SLIP_PDFS[slip._meta.model_name]
+    return render_to_string(template_name, {var_name: slip, 'items': slip.items.all(), 'request': request})
+
+
+def slip_pdf(slip, request=None):
+    """PDF của một phiếu (bytes): lấy từ cache trên đĩa nếu phiếu chưa đổi, không thì render rồi lưu"""
+    kind = slip._meta.model_name
+    version = slip_pdf_version(slip)
+    data = read_cached_pdf(kind, slip.pk, version)
+    if data is None:
+        data = render_html_pdf(render_slip_html(slip, request))
+        write_cached_pdf(kind, slip.pk, version, data)
+    return data
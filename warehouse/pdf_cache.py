@@ -0,0 +1,89 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from django.conf import settings
+
+# Cache file PDF đã render trên đĩa: <PDF_CACHE_DIR>/<loại phiếu>/<id>/<version>.pdf
+# - version là hash nội dung (xem pdf.slip_pdf_version) -> phiếu đổi thì tự ra file mới
+# - lưu / sửa vật tư / duyệt phiếu -> signal xóa cả thư mục của phiếu đó
+# - tổng dung lượng vượt PDF_CACHE_MAX_BYTES -> xóa file ít dùng nhất (LRU theo mtime)
+CACHE_DIR = getattr(settings, 'PDF_CACHE_DIR', os.path.join(settings.BASE_DIR, 'pdf_cache'))
+CACHE_MAX_BYTES = getattr(settings, 'PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+logger = logging.getLogger(__name__)
+
+_evict_lock = threading.Lock()
+
+
+def _slip_dir(kind, pk):
+    return os.path.join(CACHE_DIR, kind, str(int(pk)))
+
+
+def cache_path(kind, pk, version):
+    return os.path.join(_slip_dir(kind, pk), f'{version}.pdf')
+
+
+def read_cached_pdf(kind, pk, version):
+    """Trả về bytes nếu có trong cache, không thì None. Mỗi lần đọc "chạm" mtime để LRU"""
+    path = cache_path(kind, pk, version)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+    except OSError:
+        return None
+    return data
+
+
+def write_cached_pdf(kind, pk, version, data):
+    """Ghi file tạm rồi os.replace để request khác không đọc phải file dở dang"""
+    slip_dir = _slip_dir(kind, pk)
+    try:
+        os.makedirs(slip_dir, exist_ok=True)
+        # Chỉ giữ bản mới nhất của mỗi phiếu
+        for name in os.listdir(slip_dir):
+            if name.endswith('.pdf'):
+                os.remove(os.path.join(slip_dir, name))
+        fd, tmp = tempfile.mkstemp(dir=slip_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, cache_path(kind, pk, version))
+    except OSError:
+        logger.warning("Không ghi được cache PDF %s #%s", kind, pk, exc_info=True)
+        return
+    evict_pdf_cache()
+
+
+def invalidate_slip_pdf(kind, pk):
+    """Xóa mọi bản PDF đã cache của một phiếu"""
+    shutil.rmtree(_slip_dir(kind, pk), ignore_errors=True)
+
+
+def evict_pdf_cache(max_bytes=None):
+    """Xóa file cũ nhất (mtime nhỏ nhất) tới khi tổng dung lượng <= max_bytes"""
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        entries, total = [], 0
+        for root, _, files in os.walk(CACHE_DIR):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, path))
+                total += stat.st_size
+        if total <= max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= max_bytes:
+                break
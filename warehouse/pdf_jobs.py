@@ -0,0 +1,168 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import PdfJob, LoanSlip, PurchaseSlip, ExportSlip
+from .pdf import render_html_pdf, render_slip_html, slip_pdf_version
+from .pdf_cache import read_cached_pdf, write_cached_pdf
+
+# Tạo PDF ngoài luồng request:
+# - Template được render trong process web (cần DB), còn WeasyPrint (tốn CPU) chạy
+#   trong ProcessPoolExecutor có giới hạn số process -> không chiếm GIL của gunicorn.
+# - Mỗi lần tạo có 1 dòng PdfJob để mọi worker gunicorn đều xem được trạng thái,
+#   file kết quả nằm trong cache PDF trên đĩa (pdf_cache.py).
+# - Process web chết giữa chừng -> lệnh process_pdf_jobs sẽ làm nốt các job bị treo.
+RENDER_WORKERS = getattr(settings, 'PDF_RENDER_WORKERS', 2)  # 0 = tạo ngay trong request
+RENDER_BUDGET = getattr(settings, 'PDF_RENDER_BUDGET', 3.0)  # giây chờ trước khi chuyển sang chạy nền
+
+# Loại phiếu trên URL -> model
+URL_KINDS = {'loan': LoanSlip, 'purchase': PurchaseSlip, 'export': ExportSlip}
+SLIP_MODELS = {model._meta.model_name: model for model in URL_KINDS.values()}
+MODEL_URL_KINDS = {model._meta.model_name: kind for kind, model in URL_KINDS.items()}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def get_executor():
+    global _executor
+    if RENDER_WORKERS <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            # spawn: process con không thừa hưởng kết nối DB / lock của process web
+            _executor = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def finish_job(job_id, data=None, error=''):
+    """Ghi kết quả vào cache PDF + cập nhật trạng thái job"""
+    job = PdfJob.objects.get(pk=job_id)
+    if data is not None:
+        write_cached_pdf(job.kind, job.slip_id, job.version, data)
+    PdfJob.objects.filter(pk=job_id).update(
+        status='failed' if error else 'done', error=error, finished_at=timezone.now()
+    )
+
+
+def _on_done(job_id, future):
+    # Chạy trong thread quản lý của pool -> tự đóng kết nối DB của thread này
+    try:
+        try:
+            finish_job(job_id, data=future.result())
+        except Exception as e:
+            finish_job(job_id, error=f'{type(e).__name__}: {e}')
+    finally:
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def submit_slip_pdf(slip, request=None, user=None, version=None):
+    """
+    Đưa việc tạo PDF của phiếu vào hàng đợi -> (job, future).
+    future = None khi PDF đã có sẵn (job done) hoặc đang được tạo bởi request/process khác.
+    """
+    kind = slip._meta.model_name
+    version = version or slip_pdf_version(slip)
+    user = user if user is not None and user.is_authenticated else None
+
+    if read_cached_pdf(kind, slip.pk, version) is not None:
+        job = PdfJob.objects.create(
+            kind=kind, slip_id=slip.pk, version=version, status='done',
+            requested_by=user, finished_at=timezone.now(),
+        )
+        return job, None
+    active = PdfJob.objects.filter(kind=kind, slip_id=slip.pk, version=version, status__in=['pending', 'running'])
+    job = active.first()
+    if job is not None:
+        return job, None
+
+    try:
+        with transaction.atomic():
+            job = PdfJob.objects.create(kind=kind, slip_id=slip.pk, version=version, requested_by=user)
+    except IntegrityError:
+        # Request / process khác vừa tạo job cho đúng phiên bản này (ràng buộc pdfjob_one_active_version)
+        job = active.first()
+        if job is not None:
+            return job, None
+        # Job đó vừa kết thúc -> làm lại từ đầu (thường lấy được PDF có sẵn trong cache)
+        return submit_slip_pdf(slip, request, user, version)
+    html_string = render_slip_html(slip, request)
+    PdfJob.objects.filter(pk=job.pk).update(status='running', started_at=timezone.now())
+
+    executor = get_executor()
+    if executor is not None:
+        try:
+            future = executor.submit(render_html_pdf, html_string)
+        except BrokenProcessPool:
+            # Một process con bị kill -> dựng pool mới
+            _reset_executor()
+            future = get_executor().submit(render_html_pdf, html_string)
+        future.add_done_callback(partial(_on_done, job.pk))
+        return job, future
+
+    # Không dùng pool: tạo ngay trong luồng hiện tại
+    future = Future()
+    try:
+        data = render_html_pdf(html_string)
+    except Exception as e:
+        finish_job(job.pk, error=f'{type(e).__name__}: {e}')
+        future.set_exception(e)
+    else:
+        finish_job(job.pk, data=data)
+        future.set_result(data)
+    return job, future
+
+
+def wait_for_pdf(future, timeout=RENDER_BUDGET):
+    """Chờ tối đa `timeout` giây -> bytes, hoặc None nếu quá hạn (job vẫn chạy tiếp ở nền)"""
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        return None
+
+
+def job_pdf(job):
+    """File PDF của job đã xong (None nếu đã bị xóa khỏi cache, vd. phiếu vừa sửa)"""
+    if job.status != 'done':
+        return None
+    return read_cached_pdf(job.kind, job.slip_id, job.version)
+
+
+def run_job(job):
+    """Tạo PDF cho một job ngay trong process hiện tại (dùng cho lệnh process_pdf_jobs)"""
+    model = SLIP_MODELS[job.kind]
+    slip = model.objects.filter(pk=job.slip_id).first()
+    if slip is None:
+        finish_job(job.pk, error='Phiếu không còn tồn tại')
+        return
+    PdfJob.objects.filter(pk=job.pk).update(status='running', started_at=timezone.now())
+    try:
+        data = render_html_pdf(render_slip_html(slip))
+    except Exception as e:
+        finish_job(job.pk, error=f'{type(e).__name__}: {e}')
+    else:
+        finish_job(job.pk, data=data)
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+# Danh bạ người nhận mail theo nhóm (TruongPhong, GiamDoc, ThuKho...):
+# - Mỗi nhóm 1 danh sách email trong cache 'default', thao tác duyệt chỉ lấy đúng nhóm cần báo.
+# - Đổi user (email), nhóm hoặc thành viên nhóm -> tăng số phiên bản, mọi danh sách cũ hết hiệu lực
+#   (xem signal trong models.py). LocMemCache thì worker khác thấy thay đổi sau tối đa RECIPIENT_CACHE_TTL.
+RECIPIENT_CACHE_TTL = getattr(settings, 'RECIPIENT_CACHE_TTL', 300)
+RECIPIENT_VERSION_KEY = 'recipients:version'
+
+
+def group_emails(group_name):
+    """Email của các thành viên nhóm (bỏ user không có email)"""
+    key = f'recipients:{cache.get(RECIPIENT_VERSION_KEY, 0)}:{group_name}'
+    emails = cache.get(key)
+    if emails is None:
+        emails = list(
+            User.objects.filter(groups__name=group_name).exclude(email='')
+            .order_by('pk').values_list('email', flat=True)
+        )
+        cache.set(key, emails, RECIPIENT_CACHE_TTL)
+    return emails
+
+
+def invalidate_recipients():
+    try:
+        cache.incr(RECIPIENT_VERSION_KEY)
+    except ValueError:
+        cache.set(RECIPIENT_VERSION_KEY, 1, None)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+
+# Nhóm (vai trò) của user: đọc 1 lần rồi giữ trên chính object user
+# -> mỗi request (request.user) chỉ tốn tối đa 1 query, dù template / view kiểm tra quyền bao nhiêu lần.
+# Tùy chọn giữ qua nhiều request trong cache 'default' (ROLE_CACHE_TTL giây, 0 = tắt);
+# đổi nhóm của user / sửa, xóa nhóm -> xóa cache (xem signal trong models.py).
+# LocMemCache thì mỗi worker giữ bản riêng: chỉ bật khi dùng cache chung (Redis / Memcached).
+ROLE_CACHE_TTL = getattr(settings, 'ROLE_CACHE_TTL', 0)
+ROLE_VERSION_KEY = 'roles:version'
+
+
+def _cache_key(user_id):
+    return f'roles:{cache.get(ROLE_VERSION_KEY, 0)}:{user_id}'
+
+
+def group_names(user):
+    """Tập tên nhóm của user (frozenset), đọc DB tối đa 1 lần cho mỗi object user"""
+    if not user.is_authenticated:
+        return frozenset()
+    names = getattr(user, '_group_names', None)
+    if names is None:
+        key = _cache_key(user.pk) if ROLE_CACHE_TTL else None
+        names = cache.get(key) if key else None
+        if names is None:
+            names = frozenset(user.groups.values_list('name', flat=True))
+            if key:
+                cache.set(key, names, ROLE_CACHE_TTL)
+        user._group_names = names
+    return names
+
+
+def has_group(user, group_name):
+    return group_name in group_names(user)
+
+
+def invalidate_roles(user_ids=None):
+    """Xóa nhóm đã cache của các user (None = của mọi user)"""
+    if not ROLE_CACHE_TTL:
+        return
+    if user_ids is None:
+        try:
+            cache.incr(ROLE_VERSION_KEY)
+        except ValueError:
+            cache.set(ROLE_VERSION_KEY, 1, None)
+    else:
+        cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,127 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import BooleanField, Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+# Số phiếu gõ trực tiếp: "12", "#0012"
+SLIP_NUMBER_RE = re.compile(r'^#?\s*(\d{1,18})$')
+# Độ khớp của phiếu trùng số khi gõ số không có # -> luôn đứng trên mọi kết quả full-text
+PK_MATCH_RANK = 1e9
+
+
+def fold_text(text):
+    """
+    Chuẩn hóa chuỗi để tìm kiếm: bỏ dấu tiếng Việt, đ -> d, viết thường.
+    Ví dụ: "Nguyễn Văn Đạt" -> "nguyen van dat"
+    """
+    if not text:
+        return ''
+    text = str(text).replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def build_search_text(slip):
+    """Nội dung cột search_text của một phiếu (gộp các trường trong SEARCH_FIELDS)"""
+    return fold_text(' '.join(str(getattr(slip, f) or '') for f in slip.SEARCH_FIELDS))
+
+
+def fts_table(model):
+    """Tên bảng FTS5 (chỉ dùng trên SQLite)"""
+    return f'{model._meta.db_table}_fts'
+
+
+_fts_tables = {}
+
+
+def _has_fts_table(model):
+    # Cache theo DB đang dùng (DB test có tên khác DB chính)
+    key = (connection.settings_dict['NAME'], fts_table(model))
+    if key not in _fts_tables:
+        _fts_tables[key] = key[1] in connection.introspection.table_names()
+    return _fts_tables[key]
+
+
+def _tokens(query):
+    return re.findall(r'\w+', fold_text(query))
+
+
+def update_search_index(slip):
+    """Đồng bộ bảng FTS5 của SQLite sau khi lưu phiếu (Postgres dùng index GIN, không cần)"""
+    if connection.vendor != 'sqlite' or not _has_fts_table(type(slip)):
+        return
+    table = fts_table(type(slip))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{table}" WHERE rowid = %s', [slip.pk])
+        cursor.execute(f'INSERT INTO "{table}" (rowid, search_text) VALUES (%s, %s)', [slip.pk, slip.search_text])
+
+
+def remove_search_index(slip):
+    if connection.vendor != 'sqlite' or not _has_fts_table(type(slip)):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{fts_table(type(slip))}" WHERE rowid = %s', [slip.pk])
+
+
+def search_slips(queryset, query):
+    """
+    Tìm phiếu theo từ khóa, không phân biệt dấu.
+    - Gõ số phiếu có dấu # ("#0012") -> tra thẳng theo khóa chính
+    - Còn lại -> full-text (Postgres: tsvector + GIN, SQLite: FTS5), mỗi từ khớp theo tiền tố;
+      từ khóa chỉ gồm chữ số ("12") thì phiếu có số đó được xếp lên đầu, cùng các phiếu khớp full-text
+    Kết quả luôn có cột search_rank (càng lớn càng khớp) để sắp xếp.
+    """
+    query = query.strip()
+    match = SLIP_NUMBER_RE.match(query)
+    pk = int(match.group(1)) if match else None
+    if pk is not None and query.startswith('#'):
+        by_pk = queryset.filter(pk=pk)
+        if by_pk.exists():
+            return by_pk.annotate(search_rank=Value(1.0, output_field=FloatField()))
+
+    tokens = _tokens(query)
+    if not tokens:
+        return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    condition, rank = _full_text(queryset.model, tokens)
+    if pk is None:
+        return queryset.filter(condition).annotate(search_rank=rank)
+    return queryset.filter(Q(pk=pk) | condition).annotate(search_rank=Case(
+        When(pk=pk, then=Value(PK_MATCH_RANK)), default=rank, output_field=FloatField(),
+    ))
+
+
+def _full_text(model, tokens):
+    """Điều kiện lọc + biểu thức độ khớp full-text theo DB đang dùng"""
+    table = model._meta.db_table
+    column = f'"{table}"."search_text"'
+
+    if connection.vendor == 'postgresql':
+        ts_query = ' & '.join(f'{t}:*' for t in tokens)
+        vector = f"to_tsvector('simple', {column})"
+        return (
+            Q(RawSQL(f"{vector} @@ to_tsquery('simple', %s)", [ts_query], output_field=BooleanField())),
+            # ts_rank trả về float4: ép sang float8 để con trỏ phân trang (JSON, double) so sánh khớp tuyệt đối
+            RawSQL(f"ts_rank({vector}, to_tsquery('simple', %s))::float8", [ts_query], output_field=FloatField()),
+        )
+
+    if connection.vendor == 'sqlite' and _has_fts_table(model):
+        fts = fts_table(model)
+        fts_query = ' '.join(f'"{t}"*' for t in tokens)
+        return (
+            Q(RawSQL(f'"{table}"."id" IN (SELECT rowid FROM "{fts}" WHERE "{fts}" MATCH %s)', [fts_query], output_field=BooleanField())),
+            # rank của FTS5 là bm25 (âm, càng nhỏ càng khớp) -> đổi dấu
+            RawSQL(
+                f'(SELECT -rank FROM "{fts}" WHERE "{fts}" MATCH %s AND rowid = "{table}"."id")',
+                [fts_query], output_field=FloatField()
+            ),
+        )
+
+    # DB khác: vẫn tìm trên cột đã bỏ dấu, không xếp hạng
+    condition = Q()
+    for t in tokens:
+        condition &= Q(search_text__contains=t)
+    return condition, Value(0.0, output_field=FloatField())
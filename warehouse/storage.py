@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Lưu ảnh phiếu theo nội dung (content-addressed):
+# - Tên file = SHA-256 của nội dung, chia thư mục theo 2 cặp ký tự đầu: photos/ab/cd/abcd....webp
+#   (upload_to của field chỉ còn giữ phần đuôi file)
+# - Cùng 1 ảnh tải lên nhiều lần (phiếu sửa, phiếu làm lại) -> cùng 1 file, không ghi thêm byte nào
+# - Số dòng đang dùng mỗi file đếm trong bảng MediaBlob (blobs.py), hết người dùng mới xóa file
+BLOB_DIR = getattr(settings, 'MEDIA_BLOB_DIR', 'photos')
+
+
+def blob_name(digest, ext):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+def is_blob_name(name):
+    return bool(name) and name.startswith(f'{BLOB_DIR}/')
+
+
+def file_sha256(content):
+    sha = hashlib.sha256()
+    for chunk in content.chunks():
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage (cùng MEDIA_ROOT / MEDIA_URL) nhưng đặt tên file theo SHA-256 nội dung"""
+
+    def get_available_name(self, name, max_length=None):
+        # Tên thật do _save quyết định, không cần dò tên trống trên đĩa
+        return name
+
+    def _save(self, name, content):
+        name = blob_name(file_sha256(content), os.path.splitext(name)[1])
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # Đã có file cùng nội dung: chỉ "chạm" mtime để sweep_media (--min-age) không xóa nhầm
+            # trong lúc dòng ảnh mới chưa commit
+            try:
+                os.utime(full_path)
+                return name
+            except FileNotFoundError:
+                pass  # vừa bị xóa -> ghi lại bên dưới
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên (atomic): 2 luồng lưu cùng 1 ảnh không ghi đè dở dang lên nhau
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+
+photo_storage = ContentAddressedStorage()
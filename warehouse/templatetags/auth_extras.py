@@ -1,8 +1,10 @@
 from django import template
 
+from .. import roles
+
 register = template.Library()
 
 @register.filter(name='has_group')
 def has_group(user, group_name):
-    """Kiểm tra xem user có thuộc nhóm group_name không"""
-    return user.groups.filter(name=group_name).exists()
\ No newline at end of file
+    """Kiểm tra xem user có thuộc nhóm group_name không (nhóm đọc 1 lần mỗi request, xem roles.py)"""
+    return roles.has_group(user, group_name)
@@ -7,8 +7,12 @@ def param_replace(context, **kwargs):
     """
     Hàm này giúp thay thế hoặc thêm tham số vào URL hiện tại.
     Ví dụ: Đang ở ?page=1&q=abc -> Muốn đổi sort thì giữ nguyên q=abc
+    Truyền giá trị rỗng để bỏ hẳn tham số (ví dụ: after='' khi đổi sort)
     """
     d = context['request'].GET.copy()
     for k, v in kwargs.items():
-        d[k] = v
+        if v is None or v == '':
+            d.pop(k, None)
+        else:
+            d[k] = v
     return d.urlencode()
@@ -0,0 +1,18 @@
+from django import template
+
+from ..workflow import inbox_counts
+
+register = template.Library()
+
+@register.simple_tag(takes_context=True)
+def pending_badges(context):
+    """
+    Số phiếu đang chờ user hiện tại duyệt (dict: loan / purchase / export / total) cho badge trên menu.
+    Đọc bộ đếm trong cache (workflow.py), tính 1 lần mỗi request.
+    """
+    request = context.get('request')
+    if request is None or not request.user.is_authenticated:
+        return {}
+    if not hasattr(request, '_pending_badges'):
+        request._pending_badges = inbox_counts(request.user)
+    return request._pending_badges
@@ -1,3 +1,1084 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import os
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+import pandas as pd
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache, caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .employees import FIELDS, EmployeeDirectory, find_employee, get_directory
+from . import (
+    images, import_jobs, import_preview, importer, media, outbox, pagination, pdf_cache, pdf_jobs, recipients, roles,
+    uploads, workflow,
+)
+from .models import (
+    Employee, LoanSlip, LoanItem, LoanImage, PurchaseSlip, ExportSlip, ExportItem, ExportHistory, PdfJob, OutboxMessage,
+    MediaBlob, PhotoUpload, ImportJob,
+)
+from .pagination import keyset_paginate
+from .pdf import OfflineURLFetcher, asset_cache, slip_pdf
+from .search import search_slips
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'imports': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'imports-test'},
+}
+
+
+class KeysetPaginationTests(TestCase):
+    """Phân trang theo con trỏ: đi tới / lùi, cột sort trùng giá trị hoặc NULL, con trỏ hỏng"""
+
+    DEPTS = ['A', 'A', 'B', 'B', 'B', 'C', 'C']
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, dept in enumerate(cls.DEPTS):
+            LoanSlip.objects.create(
+                ma_nhan_vien=f'NV{i}', nguoi_muon=f'Người {i}', email='a@b.vn', chuc_vu='NV',
+                phong_ban=dept, ly_do='Test',
+                ngay_tra_du_kien=date(2025, 1, 1 + i % 2) if i % 3 else None,
+            )
+
+    def expected(self, sort):
+        """Thứ tự đúng tính bằng Python: (cột sort, id), NULL luôn ở cuối"""
+        name, desc = sort.lstrip('-'), sort.startswith('-')
+        slips = list(LoanSlip.objects.all())
+        present = sorted((s for s in slips if getattr(s, name) is not None),
+                         key=lambda s: (getattr(s, name), s.pk), reverse=desc)
+        nulls = sorted((s for s in slips if getattr(s, name) is None), key=lambda s: s.pk, reverse=desc)
+        return [s.pk for s in present + nulls]
+
+    def walk(self, sort, page_size=2):
+        """Đi hết các trang theo next rồi lùi lại theo prev -> (các trang đi tới, các trang đi lùi)"""
+        pages, cursor = [], None
+        while True:
+            page = keyset_paginate(LoanSlip.objects.all(), sort, after=cursor, page_size=page_size)
+            pages.append([s.pk for s in page])
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        back = [pages[-1]]
+        while page.has_previous:
+            page = keyset_paginate(LoanSlip.objects.all(), sort, before=page.prev_cursor, page_size=page_size)
+            back.insert(0, [s.pk for s in page])
+        return pages, back
+
+    def test_forward_and_backward_with_ties_and_nulls(self):
+        for sort in ('-id', 'phong_ban', '-phong_ban', 'ngay_tra_du_kien', '-ngay_tra_du_kien'):
+            with self.subTest(sort=sort):
+                forward, backward = self.walk(sort)
+                self.assertEqual(sum(forward, []), self.expected(sort))
+                self.assertEqual(backward, forward)
+
+    def test_bad_cursor_falls_back_to_first_page(self):
+        first = [s.pk for s in keyset_paginate(LoanSlip.objects.all(), 'phong_ban', page_size=2)]
+        other_sort = keyset_paginate(LoanSlip.objects.all(), '-id', page_size=2).next_cursor
+        bad_json = base64.urlsafe_b64encode(b'{"s":"phong_ban","v":"A"}').decode()
+        for cursor in ('!!!', 'bm90IGpzb24', bad_json, other_sort):
+            with self.subTest(cursor=cursor):
+                page = keyset_paginate(LoanSlip.objects.all(), 'phong_ban', after=cursor, page_size=2)
+                self.assertEqual([s.pk for s in page], first)
+                self.assertFalse(page.has_previous)
+
+    def test_count_capped(self):
+        page = keyset_paginate(LoanSlip.objects.all(), '-id')
+        self.assertEqual((page.count, page.count_display), (7, '7'))
+        with mock.patch.object(pagination, 'COUNT_LIMIT', 5):
+            page = keyset_paginate(LoanSlip.objects.all(), '-id')
+            self.assertTrue(page.count_limited)
+            self.assertEqual(page.count_display, '5+')
+
+
+class SlipListIndexTests(TestCase):
+    """Kiểm tra bằng EXPLAIN rằng truy vấn của các trang danh sách đi qua index"""
+
+    LIST_CASES = [
+        ('loan_list', LoanSlip, 'nguoi_muon'),
+        ('purchase_list', PurchaseSlip, 'nguoi_de_xuat'),
+        ('export_list', ExportSlip, 'nguoi_de_xuat'),
+    ]
+    QUERIES = [
+        {'status': 'dept_pending'},
+        {'status': 'dept_pending', 'date_from': '2025-01-01', 'date_to': '2025-12-31'},
+        {'date_from': '2025-01-01', 'date_to': '2025-12-31', 'sort': '-ngay_tao'},
+        {'sort': 'ngay_tao'},
+        {'sort': 'phong_ban'},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='x')
+        for _, model, name_field in cls.LIST_CASES:
+            model.objects.bulk_create([
+                model(**{
+                    'ma_nhan_vien': f'NV{i:03d}', name_field: f'Người {i}', 'email': 'a@b.vn',
+                    'chuc_vu': 'NV', 'phong_ban': f'P{i % 5}', 'ly_do': 'Test',
+                    'status': 'dept_pending' if i % 3 else 'draft',
+                })
+                for i in range(200)
+            ])
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return ' | '.join(str(row[-1]) for row in cursor.fetchall())
+
+    def assert_uses_index(self, plan, sort_only):
+        if connection.vendor == 'postgresql':
+            self.assertIn('Index', plan)
+            return
+        self.assertIn('USING', plan)
+        if sort_only:
+            # Chỉ sắp xếp (không lọc) thì phải đọc theo thứ tự index, không sort tạm
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_list_queries_use_index(self):
+        self.client.force_login(self.user)
+        for url_name, model, _ in self.LIST_CASES:
+            table = model._meta.db_table
+            for params in self.QUERIES:
+                with self.subTest(url=url_name, params=params):
+                    with CaptureQueriesContext(connection) as ctx:
+                        response = self.client.get(reverse(url_name), params)
+                    self.assertEqual(response.status_code, 200)
+                    page_queries = [
+                        q['sql'] for q in ctx.captured_queries
+                        if f'FROM "{table}"' in q['sql'] and 'ORDER BY' in q['sql']
+                    ]
+                    self.assertTrue(page_queries)
+                    for sql in page_queries:
+                        self.assert_uses_index(self.explain(sql), sort_only=list(params) == ['sort'])
+
+
+class SlipSearchTests(TestCase):
+    """Tìm kiếm không dấu và tra số phiếu theo khóa chính"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tester', password='x')
+        cls.loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='Nguyễn Văn Đạt', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kỹ thuật', ly_do='Test',
+        )
+        cls.other = LoanSlip.objects.create(
+            ma_nhan_vien='NV002', nguoi_muon='Trần Thị Bình', email='b@b.vn',
+            chuc_vu='NV', phong_ban='Kế toán', ly_do='Test',
+        )
+
+    def search(self, q):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('loan_list'), {'q': q})
+        return [loan.id for loan in response.context['loans']]
+
+    def test_accent_insensitive(self):
+        self.assertEqual(self.search('Nguyen dat'), [self.loan.id])
+        self.assertEqual(self.search('binh'), [self.other.id])
+
+    def test_slip_number_uses_pk(self):
+        self.assertEqual(self.search(f'#{self.other.id:04d}'), [self.other.id])
+
+    def test_bare_number_also_searches_text(self):
+        # Mã NV toàn chữ số trùng số của phiếu khác -> vẫn tìm ra, phiếu trùng số đứng đầu
+        third = LoanSlip.objects.create(
+            ma_nhan_vien=str(self.other.id), nguoi_muon='Lê Văn Cường', email='c@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+        )
+        self.assertEqual(self.search(str(self.other.id)), [self.other.id, third.id])
+
+    def test_rank_cursor_pages_through_ties(self):
+        # Nhiều phiếu cùng độ khớp (trùng) hoặc gần bằng nhau (tên dài ngắn khác nhau)
+        for i in range(7):
+            LoanSlip.objects.create(
+                ma_nhan_vien=f'NV1{i}', nguoi_muon='Phạm Văn Đạt' + ' Đạt' * (i % 3), email='c@b.vn',
+                chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+            )
+        queryset = search_slips(LoanSlip.objects.all(), 'dat')
+        expected = set(queryset.values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            page = keyset_paginate(queryset, '-search_rank', after=cursor, page_size=3)
+            seen += [slip.id for slip in page]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(len(seen), len(expected))
+        self.assertEqual(set(seen), expected)
+
+    def test_index_follows_save(self):
+        self.other.nguoi_muon = 'Nguyễn Thị Bình'
+        self.other.save()
+        self.assertCountEqual(self.search('nguyen'), [self.loan.id, self.other.id])
+        self.loan.delete()
+        self.assertEqual(self.search('nguyen'), [self.other.id])
+
+
+class EmployeeDirectoryTests(TestCase):
+    """Danh bạ gợi ý nhân viên trong bộ nhớ"""
+
+    ROWS = [
+        ('NV10', 'Nguyễn Văn Đạt', 'a@b.vn', 'NV', 'Kho'),
+        ('NV1', 'Trần Thị Nguyệt', 'b@b.vn', 'NV', 'Kho'),
+        ('NV100', 'Lê Minh', 'c@b.vn', 'NV', 'Kho'),
+    ]
+
+    def codes(self, query):
+        return [e['ma_nhan_vien'] for e in EmployeeDirectory(self.ROWS).search(query)]
+
+    def test_exact_code_first(self):
+        self.assertEqual(self.codes('nv10'), ['NV10', 'NV100'])
+
+    def test_accent_folded_name_tokens(self):
+        self.assertEqual(self.codes('dat nguyen'), ['NV10'])
+        self.assertEqual(self.codes('nguy'), ['NV10', 'NV1'])
+
+    def test_exact_lookup_reads_database(self):
+        get_directory()
+        # bulk_create không phát signal -> danh bạ trong bộ nhớ vẫn là bản cũ, tra mã vẫn phải thấy
+        Employee.objects.bulk_create([Employee(**dict(zip(FIELDS, row))) for row in self.ROWS])
+        self.assertEqual(find_employee('NV1')['ho_ten'], 'Trần Thị Nguyệt')
+        self.assertIsNone(find_employee('nv1'))
+        self.assertIsNone(find_employee('NV2'))
+
+
+class OfflinePdfFetcherTests(SimpleTestCase):
+    """url_fetcher của PDF: đọc từ đĩa qua cache, không bao giờ ra mạng"""
+
+    def setUp(self):
+        asset_cache.clear()
+        self.fetcher = OfflineURLFetcher()
+
+    def test_network_refused(self):
+        for url in ('https://fonts.googleapis.com/css2?family=Noto+Serif', 'http://example.com/a.png'):
+            with self.assertRaises(ValueError):
+                self.fetcher.fetch(url)
+
+    def test_asset_served_from_cache(self):
+        response = self.fetcher.fetch('asset:pdf/fonts.css')
+        self.assertIn(b'NotoSerif', response.read())
+        self.assertEqual(len(asset_cache._items), 1)
+        self.fetcher.fetch('asset:pdf/fonts.css')
+        self.assertEqual(len(asset_cache._items), 1)
+
+    def test_file_limited_to_media(self):
+        with tempfile.TemporaryDirectory() as media, tempfile.NamedTemporaryFile(suffix='.png') as outside:
+            path = os.path.join(media, 'chu ky.png')
+            with open(path, 'wb') as f:
+                f.write(b'png')
+            with override_settings(MEDIA_ROOT=media):
+                self.assertEqual(self.fetcher.fetch(f'file://{path}'.replace(' ', '%20')).read(), b'png')
+                with self.assertRaises(ValueError):
+                    self.fetcher.fetch(f'file://{outside.name}')
+
+
+class SlipPdfCacheTests(TestCase):
+    """Cache PDF trên đĩa: đọc lại file khi phiếu chưa đổi, render lại khi phiếu/vật tư đổi"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(pdf_cache, 'CACHE_DIR', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+        )
+
+    @mock.patch('warehouse.pdf.render_html_pdf', return_value=b'%PDF')
+    def test_render_once_until_changed(self, render):
+        self.assertEqual(slip_pdf(self.loan), b'%PDF')
+        slip_pdf(self.loan)
+        self.assertEqual(render.call_count, 1)
+
+        LoanItem.objects.create(loan=self.loan, ten_tai_san='Máy khoan', don_vi_tinh='Cái')
+        self.assertFalse(os.path.exists(os.path.join(pdf_cache.CACHE_DIR, 'loanslip', str(self.loan.pk))))
+        slip_pdf(self.loan)
+        self.assertEqual(render.call_count, 2)
+
+        self.loan.status = 'dept_pending'
+        self.loan.save()
+        slip_pdf(self.loan)
+        self.assertEqual(render.call_count, 3)
+
+    def test_lru_eviction(self):
+        for pk in (1, 2, 3):
+            pdf_cache.write_cached_pdf('loanslip', pk, 'v', b'x' * 10)
+            os.utime(pdf_cache.cache_path('loanslip', pk, 'v'), (pk, pk))
+        pdf_cache.read_cached_pdf('loanslip', 1, 'v')  # vừa dùng -> không bị xóa
+        pdf_cache.evict_pdf_cache(max_bytes=20)
+        self.assertIsNone(pdf_cache.read_cached_pdf('loanslip', 2, 'v'))
+        self.assertIsNotNone(pdf_cache.read_cached_pdf('loanslip', 1, 'v'))
+
+
+@mock.patch.object(pdf_jobs, 'RENDER_WORKERS', 0)
+@mock.patch('warehouse.pdf_jobs.render_html_pdf', return_value=b'%PDF')
+class PdfJobTests(TestCase):
+    """Tạo PDF qua hàng đợi: trả file ngay nếu kịp, quá ngân sách thời gian thì sang trang chờ"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(pdf_cache, 'CACHE_DIR', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('tester', password='x')
+        self.client.force_login(self.user)
+        self.loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+        )
+
+    def test_pdf_within_budget(self, render):
+        response = self.client.get(reverse('export_loan_pdf', args=[self.loan.pk]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response.content, b'%PDF')
+        self.assertEqual(PdfJob.objects.get().status, 'done')
+
+    def test_over_budget_falls_back_to_job(self, render):
+        with mock.patch('warehouse.views.wait_for_pdf', return_value=None):
+            response = self.client.get(reverse('export_loan_pdf', args=[self.loan.pk]))
+        job = PdfJob.objects.get()
+        self.assertRedirects(response, reverse('pdf_job_page', args=[job.pk]))
+        status = self.client.get(reverse('api_pdf_job', args=[job.pk])).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual(self.client.get(status['result_url']).content, b'%PDF')
+
+    def test_enqueue_api(self, render):
+        response = self.client.post(reverse('api_pdf_render', args=['loan', self.loan.pk]))
+        self.assertEqual(response.json()['status'], 'done')
+        self.assertEqual(self.client.post(reverse('api_pdf_render', args=['abc', 1])).status_code, 404)
+
+    def test_concurrent_submit_reuses_active_job(self, render):
+        atomic = pdf_jobs.transaction.atomic
+        competitor = []
+
+        def racing_atomic(*args, **kwargs):
+            # Request khác tạo (và commit) job ngay sau bước kiểm tra của request này
+            if not competitor:
+                competitor.append(None)
+                competitor[0] = PdfJob.objects.create(
+                    kind='loanslip', slip_id=self.loan.pk, version=pdf_jobs.slip_pdf_version(self.loan)
+                )
+            return atomic(*args, **kwargs)
+
+        with mock.patch.object(pdf_jobs.transaction, 'atomic', side_effect=racing_atomic):
+            job, future = pdf_jobs.submit_slip_pdf(self.loan)
+        self.assertEqual((job, future), (competitor[0], None))
+        self.assertEqual(PdfJob.objects.count(), 1)
+        render.assert_not_called()
+
+
+@mock.patch.object(outbox, 'SEND_ON_COMMIT', False)
+@mock.patch('warehouse.pdf.render_html_pdf', return_value=b'%PDF')
+class OutboxTests(TestCase):
+    """Email đi qua hàng đợi outbox: ghi cùng transaction, worker gửi và thử lại khi lỗi"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        patcher = mock.patch.object(pdf_cache, 'CACHE_DIR', os.path.join(tmp.name, 'pdf'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('tester', password='x')
+        boss = User.objects.create_user('boss', email='tp@b.vn')
+        boss.groups.add(Group.objects.create(name='TruongPhong'))
+        self.loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test', created_by=self.user,
+        )
+
+    def test_action_enqueues_and_worker_sends(self, render):
+        self.client.force_login(self.user)
+        self.client.get(reverse('loan_action', args=[self.loan.pk, 'send']))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.recipients), ('pending', ['tp@b.vn']))
+        render.assert_not_called()  # PDF chỉ được tạo khi worker gửi
+
+        with override_settings(OUTBOX_FILE_DIR=self.tmp):
+            self.assertEqual(outbox.process_outbox(workers=1, transport=outbox.FileTransport()), (1, 0))
+        self.assertEqual(OutboxMessage.objects.get().status, 'sent')
+        with open(os.path.join(self.tmp, f'{message.pk}-Phieu_Muon_{self.loan.pk}.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'%PDF')
+
+    @mock.patch.object(pdf_jobs, 'RENDER_WORKERS', 0)
+    def test_background_send_never_renders_pdf(self, render):
+        message = outbox.enqueue_email('Test', '<p>x</p>', ['a@b.vn'], slip=self.loan, attachment_name='a.pdf')
+        # Không có pool tạo PDF -> thread nền không tự tạo, trả tin về cho worker outbox
+        outbox._prepare_attachment(message.pk)
+        self.assertEqual(outbox.process_outbox(ids=[message.pk], workers=1, render=False), (0, 0))
+        render.assert_not_called()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('pending', 0))
+
+        # PDF đã có trong cache (pdf_jobs tạo xong) -> gửi ngay, đọc từ cache
+        slip_pdf(LoanSlip.objects.get(pk=self.loan.pk))
+        with self.assertLogs('warehouse.outbox', 'INFO') as logs:
+            sent = outbox.process_outbox(ids=[message.pk], workers=1, transport=outbox.ConsoleTransport(), render=False)
+        self.assertEqual(sent, (1, 0))
+        self.assertEqual(render.call_count, 1)
+        self.assertIn('a.pdf (4 bytes)', logs.output[0])
+
+    def test_retry_with_backoff(self, render):
+        class Broken(outbox.BaseTransport):
+            def send(self, message, attachments):
+                raise ConnectionError('timeout')
+
+        message = outbox.enqueue_email('Test', '<p>x</p>', ['a@b.vn'])
+        self.assertEqual(outbox.process_outbox(workers=1, transport=Broken()), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('pending', 1))
+        self.assertGreater(message.next_attempt_at, message.created_at)
+        # Chưa tới hạn thử lại -> không lấy ra
+        self.assertEqual(outbox.process_outbox(workers=1, transport=Broken()), (0, 0))
+
+        OutboxMessage.objects.update(attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=message.created_at)
+        outbox.process_outbox(workers=1, transport=Broken())
+        self.assertEqual(OutboxMessage.objects.get().status, 'failed')
+
+    def test_expired_claim_cannot_overwrite_new_claim(self, render):
+        outbox.enqueue_email('Test', '<p>x</p>', ['a@b.vn'])
+        [stale] = outbox.claim_messages()
+        # Worker đầu quá SENDING_TIMEOUT -> worker khác giành lại và gửi xong
+        OutboxMessage.objects.update(claimed_at=timezone.now() - timedelta(seconds=outbox.SENDING_TIMEOUT + 1))
+        [fresh] = outbox.claim_messages()
+        outbox._mark(fresh, 'id-2')
+        # Worker đầu báo lỗi muộn -> không được đưa tin đã gửi về hàng đợi
+        outbox._mark(stale, ConnectionError('timeout'))
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.provider_id, message.attempts), ('sent', 'id-2', 1))
+
+    def test_batch_pdfs_loaded_before_fan_out(self, render):
+        messages = [
+            outbox.enqueue_email('Test', '<p>x</p>', [f'{i}@b.vn'], slip=self.loan, attachment_name='a.pdf')
+            for i in range(3)
+        ]
+        pdfs = outbox.load_pdfs(messages)
+        self.assertEqual(render.call_count, 1)
+        # Thread gửi chỉ đọc dict đã tạo sẵn, không tự tạo / đọc PDF
+        with self.assertNumQueries(0):
+            for message in messages:
+                self.assertEqual(outbox._attachments(message, pdfs), [('a.pdf', b'%PDF')])
+
+    def test_resend_attachment_base64_shared(self, render):
+        transport = outbox.ResendTransport()
+        first = outbox.enqueue_email('A', '<p>x</p>', ['a@b.vn'])
+        second = outbox.enqueue_email('B', '<p>x</p>', ['b@b.vn'])
+        pdf, encoded = b'%PDF-1.7 ...', {}
+        params = [transport.params(m, [('P.pdf', pdf)], encoded) for m in (first, second)]
+        content = params[0]['attachments'][0]['content']
+        self.assertEqual(base64.b64decode(content), pdf)
+        # Cùng 1 PDF cho nhiều người nhận -> chỉ mã hóa 1 lần, dùng chung 1 chuỗi
+        self.assertIs(params[1]['attachments'][0]['content'], content)
+
+
+@mock.patch.object(outbox, 'SEND_ON_COMMIT', False)
+class WorkflowTests(TestCase):
+    """Duyệt phiếu theo bảng quy trình: 1 câu UPDATE có điều kiện, người bấm sau nhận xung đột"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(pdf_cache, 'CACHE_DIR', tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.creator = User.objects.create_user('nv', email='nv@b.vn')
+        self.boss = User.objects.create_user('tp', email='tp@b.vn')
+        self.boss.groups.add(Group.objects.create(name='TruongPhong'))
+        User.objects.create_user('tk', email='tk@b.vn').groups.add(Group.objects.create(name='ThuKho'))
+        self.slip = ExportSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_de_xuat='A', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test', created_by=self.creator, status='dept_pending',
+        )
+        self.client.force_login(self.boss)
+        cache.clear()
+
+    def test_second_approval_conflicts(self):
+        url = reverse('export_action', args=[self.slip.pk, 'dept_approve'])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['status'], 'warehouse_pending')
+        update = next(q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE "warehouse_exportslip"'))
+        self.assertNotIn('"ly_do"', update)  # chỉ ghi các cột thay đổi
+
+        # Người thứ 2 bấm cùng nút trên trang cũ -> 409, không ghi nhật ký / mail lần nữa
+        response = self.client.get(url, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual((response.status_code, response.json()['status']), (409, 'warehouse_pending'))
+        response = self.client.get(url, follow=True)
+        self.assertContains(response, 'đã được xử lý trước đó')
+        self.assertEqual(self.slip.history.count(), 1)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        self.slip.refresh_from_db()
+        self.assertEqual((self.slip.status, self.slip.user_truong_phong), ('warehouse_pending', self.boss))
+
+    def test_permission_per_step(self):
+        loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn', chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+            created_by=self.creator, status='director_pending',
+        )
+        # TP chỉ được từ chối khi phiếu đang chờ TP
+        response = self.client.get(reverse('loan_action', args=[loan.pk, 'reject']), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 403)
+        loan.refresh_from_db()
+        self.assertEqual(loan.status, 'director_pending')
+
+    def test_bulk_approve(self):
+        User.objects.create_user('tk2', email='tk2@b.vn').groups.add(Group.objects.get(name='ThuKho'))
+        slips = [self.slip] + [
+            ExportSlip.objects.create(
+                ma_nhan_vien='NV001', nguoi_de_xuat='A', email='a@b.vn', chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+                created_by=self.creator, status=status,
+            ) for status in ('dept_pending', 'dept_pending', 'director_pending')
+        ]
+        ids = [slip.pk for slip in slips]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse('bulk_slip_action', args=['export', 'dept_approve']), {'ids': ids},
+                HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        self.assertEqual(response.json(), {'done': ids[:3], 'skipped': ids[3:]})
+        self.assertLess(len(ctx.captured_queries), 15)  # không tăng theo số phiếu
+        self.assertEqual(ExportSlip.objects.filter(status='warehouse_pending', user_truong_phong=self.boss).count(), 3)
+        self.assertEqual(ExportHistory.objects.count(), 3)
+        # 1 mail tổng hợp cho cả nhóm Thủ kho, không đính kèm PDF
+        message = OutboxMessage.objects.get()
+        self.assertEqual(sorted(message.recipients), ['tk2@b.vn', 'tk@b.vn'])
+        self.assertEqual(message.attachment_slip_id, None)
+
+        # Trưởng phòng không có nút Giám đốc duyệt
+        response = self.client.post(reverse('bulk_slip_action', args=['export', 'director_approve']), {'ids': ids})
+        self.assertRedirects(response, reverse('export_list'), fetch_redirect_response=False)
+        self.assertEqual(ExportSlip.objects.filter(status='director_pending').count(), 1)
+
+    def test_inbox_counters(self):
+        self.assertEqual(workflow.inbox_counts(self.boss), {'total': 1, 'loan': 0, 'purchase': 0, 'export': 1})
+        # Bộ đếm đã nằm trong cache, nhóm đã giữ trên object user: badge không tốn query nào
+        with self.assertNumQueries(0):
+            workflow.inbox_counts(self.boss)
+
+        keeper = User.objects.get(username='tk')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('export_action', args=[self.slip.pk, 'dept_approve']))
+        with self.assertNumQueries(1):  # chỉ đọc nhóm của keeper
+            self.assertEqual(workflow.inbox_counts(self.boss)['total'], 0)
+            self.assertEqual(workflow.inbox_counts(keeper)['export'], 1)  # cộng / trừ khi duyệt, không đếm lại
+
+        self.client.force_login(keeper)
+        response = self.client.get(reverse('inbox'))
+        self.assertContains(response, f'Phiếu xuất #{self.slip.pk} - A')
+        with self.captureOnCommitCallbacks(execute=True):
+            ExportSlip.objects.create(
+                ma_nhan_vien='NV002', nguoi_de_xuat='B', email='b@b.vn', chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+                status='warehouse_pending',
+            )
+        self.assertEqual(workflow.inbox_counts(keeper)['export'], 2)  # tạo phiếu ngoài quy trình -> đếm lại
+
+        # Lần đếm lại chen giữa commit và decr -> bộ đếm âm; lần đọc sau bỏ đi và đếm lại
+        cache.delete(workflow._counter_key('export', 'dept_pending'))
+        workflow.pending_counts('export')
+        workflow._record_transition('export', {'dept_pending': 1}, 'director_pending')
+        self.assertEqual(cache.get(workflow._counter_key('export', 'dept_pending')), -1)
+        self.assertEqual(workflow.inbox_counts(self.boss)['export'], 0)
+        self.assertEqual(cache.get(workflow._counter_key('export', 'dept_pending')), 0)
+
+    def test_roles_loaded_once_per_request(self):
+        loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn', chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+            created_by=self.creator, status='dept_pending',
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('loan_detail', args=[loan.pk]))
+        self.assertContains(response, 'Trưởng phòng duyệt')
+        group_queries = [q for q in ctx.captured_queries if '"auth_group"' in q['sql']]
+        self.assertEqual(len(group_queries), 1)  # badge menu + 5 lần has_group dùng chung
+
+    @mock.patch.object(roles, 'ROLE_CACHE_TTL', 60)
+    def test_role_cache_invalidated_on_membership_change(self):
+        def fresh():
+            return User.objects.get(pk=self.boss.pk)
+        self.assertEqual(roles.group_names(fresh()), {'TruongPhong'})
+        with self.assertNumQueries(1):  # lấy user; nhóm đọc từ cache
+            self.assertEqual(roles.group_names(fresh()), {'TruongPhong'})
+        Group.objects.get(name='ThuKho').user_set.add(self.boss)
+        self.assertEqual(roles.group_names(fresh()), {'TruongPhong', 'ThuKho'})
+        self.boss.groups.remove(Group.objects.get(name='TruongPhong'))
+        self.assertEqual(roles.group_names(fresh()), {'ThuKho'})
+
+    def test_recipient_directory(self):
+        self.assertEqual(recipients.group_emails('ThuKho'), ['tk@b.vn'])
+        with self.assertNumQueries(0):
+            self.assertEqual(recipients.group_emails('ThuKho'), ['tk@b.vn'])
+        self.boss.groups.add(Group.objects.get(name='ThuKho'))
+        self.assertEqual(recipients.group_emails('ThuKho'), ['tp@b.vn', 'tk@b.vn'])
+        self.boss.email = 'boss@b.vn'
+        self.boss.save()
+        self.assertEqual(recipients.group_emails('ThuKho'), ['boss@b.vn', 'tk@b.vn'])
+        # Đăng nhập (chỉ lưu last_login) không làm mất danh bạ
+        self.client.force_login(self.creator)
+        with self.assertNumQueries(0):
+            recipients.group_emails('ThuKho')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExcelImportTests(TestCase):
+    """Import vật tư từ Excel: tìm cột 1 lần, chuẩn hóa theo cột, dòng lỗi bị bỏ qua + báo lại"""
+
+    def setUp(self):
+        self.loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+        )
+
+    def _excel(self, rows):
+        buffer = io.BytesIO()
+        pd.DataFrame(rows).to_excel(buffer, index=False)
+        buffer.seek(0)
+        return buffer
+
+    def test_import_loan_items(self):
+        excel = self._excel({
+            ' Tên tài sản ': ['Máy khoan', None, 'Thang nhôm', 'Kìm', 'X' * 201],
+            'ĐVT': [None, None, 'Chiếc', 'Cái', 'Cái'],
+            'Số lượng': [2, None, None, 'abc', 1],
+            'Tình trạng': ['Tốt', None, 'Trầy xước', 'Hư màn hình', None],
+        })
+        with CaptureQueriesContext(connection) as ctx:
+            result = importer.import_items(self.loan, LoanItem, excel)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([row for row, _ in result.errors], [5, 6])
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('INSERT')]), 1)
+
+        items = list(self.loan.items.order_by('id').values_list(
+            'ten_tai_san', 'don_vi_tinh', 'so_luong', 'tinh_trang', 'tinh_trang_khac'))
+        self.assertEqual(items, [
+            ('Máy khoan', 'Cái', 2, 'binh_thuong', ''),
+            ('Thang nhôm', 'Chiếc', 1, 'khac', 'Trầy xước'),
+        ])
+
+    def test_missing_name_column(self):
+        with self.assertRaises(ValueError):
+            importer.import_items(self.loan, LoanItem, self._excel({'ĐVT': ['Cái']}))
+
+    def test_stream_large_file_in_chunks(self):
+        excel = self._excel({
+            'Tên tài sản': [f'Tài sản {i}' for i in range(7)],
+            'Số lượng': [1, 2, 3, 'x', 5, 6, 7],
+        })
+        excel.name = 'items.xlsx'
+        with mock.patch.object(importer, 'STREAM_THRESHOLD', 0):
+            self.assertTrue(importer.should_stream(excel))
+        frames = list(importer.stream_xlsx_frames(excel, chunk_rows=3))
+        self.assertEqual([(len(df), start) for df, start in frames], [(3, 2), (3, 5), (1, 8)])
+
+        excel.seek(0)
+        result = importer.import_items(self.loan, LoanItem, excel, stream=True)
+        self.assertEqual((result.created, result.errors), (6, [(5, 'Số lượng không phải là số')]))
+        self.assertEqual(sum(self.loan.items.values_list('so_luong', flat=True)), 24)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+@mock.patch.object(import_jobs, 'RUN_ON_COMMIT', False)
+class ImportJobTests(TestCase):
+    """Import Excel chạy nền: job lưu tiến độ, file upload bị xóa khi xong"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user('tester', password='x')
+        self.client.force_login(self.user)
+        self.slip = ExportSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_de_xuat='A', email='a@b.vn',
+            chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+        )
+
+    def test_run_job_and_progress_api(self):
+        buffer = io.BytesIO()
+        pd.DataFrame({'Tên hàng': ['Ốc vít', '', 'Bulong'], 'SL': [10, None, 'nhiều']}).to_excel(buffer, index=False)
+        upload = SimpleUploadedFile('vat_tu.xlsx', buffer.getvalue())
+        job = import_jobs.enqueue_import(self.slip, upload, self.user)
+        path = job.file.path
+        self.assertEqual(self.client.get(reverse('api_import_job', args=[job.pk])).json()['status'], 'pending')
+
+        job = import_jobs.run_job(job.pk)
+        self.assertEqual(
+            (job.status, job.rows_parsed, job.rows_inserted, job.rows_rejected),
+            ('done', 3, 1, 1),
+        )
+        self.assertEqual(list(self.slip.items.values_list('ten_hang_hoa', 'so_luong')), [('Ốc vít', 10)])
+        self.assertFalse(os.path.exists(path))
+        # Đã chạy rồi -> không chạy lại
+        self.assertIsNone(import_jobs.run_job(job.pk))
+
+        data = self.client.get(reverse('api_import_job', args=[job.pk])).json()
+        self.assertEqual((data['status'], data['row_errors']), ('done', [[4, 'Số lượng không phải là số']]))
+
+    @mock.patch.object(importer, 'STREAM_CHUNK_ROWS', 1)
+    def test_failed_job_removes_its_rows(self):
+        ExportItem.objects.create(slip=self.slip, ten_hang_hoa='Nhập tay', don_vi_tinh='Cái')
+        job = import_jobs.enqueue_import(self.slip, self._upload({'Tên hàng': ['A', 'B', 'C']}))
+        # Lô đầu đã commit thì lỗi
+        with mock.patch.object(import_jobs, '_progress', side_effect=[None, RuntimeError('mất kết nối')]):
+            job = import_jobs.run_job(job.pk)
+        self.assertEqual((job.status, job.rows_inserted), ('failed', 0))
+        self.assertEqual(list(self.slip.items.values_list('ten_hang_hoa', flat=True)), ['Nhập tay'])
+
+    def test_dead_job_rows_removed_by_worker(self):
+        job = import_jobs.enqueue_import(self.slip, self._upload({'Tên hàng': ['A']}))
+        ImportJob.objects.filter(pk=job.pk).update(status='running', started_at=timezone.now() - timedelta(hours=2))
+        ExportItem.objects.create(slip=self.slip, ten_hang_hoa='A', don_vi_tinh='Cái', import_job_id=job.pk)
+        call_command('process_import_jobs', stdout=io.StringIO())
+        self.assertEqual(ImportJob.objects.get(pk=job.pk).status, 'failed')
+        self.assertFalse(self.slip.items.exists())
+
+    def _upload(self, rows, name='vat_tu.xlsx'):
+        buffer = io.BytesIO()
+        pd.DataFrame(rows).to_excel(buffer, index=False)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def test_preview_cached_then_committed_from_cache(self):
+        rows = {'Tên hàng': ['Ốc vít', 'Bulong'], 'Số lượng': [10, 'x']}
+        url = reverse('api_import_preview', args=['export'])
+        with mock.patch.object(import_preview, 'parse_chunks', wraps=import_preview.parse_chunks) as parse:
+            first = self.client.post(url, {'excel_file': self._upload(rows)}).json()
+            # Tải lại đúng file đó -> lấy từ cache, không đọc lại
+            second = self.client.post(url, {'excel_file': self._upload(rows, 'lan_2.xlsx')}).json()
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual((first['rows_valid'], first['rows_rejected']), (1, 1))
+
+        summary, _ = import_preview.cached_preview(ExportItem, first['token'])
+        job = import_jobs.enqueue_import(self.slip, preview=summary, user=self.user)
+        self.assertFalse(job.file)
+        job = import_jobs.run_job(job.pk)
+        self.assertEqual((job.status, job.rows_inserted, job.rows_rejected), ('done', 1, 1))
+        self.assertEqual(list(self.slip.items.values_list('ten_hang_hoa', 'so_luong')), [('Ốc vít', 10)])
+
+    @mock.patch.object(importer, 'STREAM_CHUNK_ROWS', 1)
+    def test_preview_chunk_evicted_never_imports_partially(self):
+        rows = {'Tên hàng': ['A', 'B', 'C']}
+        summary = import_preview.build_preview(ExportItem, self._upload(rows))
+        self.assertEqual(summary['chunks'], 3)
+        # Cache đầy xóa bớt 1 lô ở giữa
+        caches[importer.CACHE_ALIAS].delete(f"{import_preview._key(ExportItem, summary['token'])}:1")
+        self.assertIsNone(import_preview.preview_summary(ExportItem, summary['token']))
+
+        job = import_jobs.run_job(import_jobs.enqueue_import(self.slip, preview=summary).pk)
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(self.slip.items.exists())
+
+        # Lô bị xóa khi job đang ghi dở -> job lỗi, các dòng đã thêm bị xóa
+        summary = import_preview.build_preview(ExportItem, self._upload(rows))
+
+        def evict(result):
+            caches[importer.CACHE_ALIAS].delete(f"{import_preview._key(ExportItem, summary['token'])}:2")
+
+        with mock.patch.object(import_jobs, '_progress', side_effect=evict):
+            job = import_jobs.run_job(import_jobs.enqueue_import(self.slip, preview=summary).pk)
+        self.assertEqual(job.status, 'failed')
+        self.assertFalse(self.slip.items.exists())
+
+        # Có kèm file upload -> đọc lại file, nhập đủ
+        job = import_jobs.enqueue_import(self.slip, self._upload(rows), preview=summary)
+        job = import_jobs.run_job(job.pk)
+        self.assertEqual((job.status, job.rows_inserted), ('done', 3))
+        self.assertEqual(list(self.slip.items.order_by('pk').values_list('ten_hang_hoa', flat=True)), ['A', 'B', 'C'])
+
+    def test_header_mapping_remembered(self):
+        with mock.patch.object(importer, 'resolve_columns', wraps=importer.resolve_columns) as resolve:
+            for name in ('A', 'B'):
+                upload = self._upload({'Tên hàng': [name], 'ĐVT': ['Bộ']})
+                importer.import_items(self.slip, ExportItem, upload)
+        self.assertEqual(resolve.call_count, 1)
+        self.assertEqual(list(self.slip.items.values_list('don_vi_tinh', flat=True)), ['Bộ', 'Bộ'])
+
+
+class SlipListDownloadTests(TestCase):
+    """Tải danh sách theo bộ lọc của trang danh sách: CSV stream, XLSX write-only"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', password='x')
+        self.client.force_login(self.user)
+        self.loans = []
+        for i, status in enumerate(['draft', 'borrowing', 'borrowing']):
+            loan = LoanSlip.objects.create(
+                ma_nhan_vien=f'NV{i}', nguoi_muon=f'Người {i}', email='a@b.vn',
+                chuc_vu='NV', phong_ban='Kho', ly_do='=HYPERLINK("x")', status=status,
+            )
+            LoanItem.objects.create(loan=loan, ten_tai_san=f'Máy {i}a', don_vi_tinh='Cái', tinh_trang='hu_hong')
+            LoanItem.objects.create(loan=loan, ten_tai_san=f'Máy {i}b', don_vi_tinh='Cái')
+            self.loans.append(loan)
+
+    def test_csv_items_follow_list_filters(self):
+        url = reverse('download_slip_list', args=['loan'])
+        response = self.client.get(url, {'scope': 'items', 'format': 'csv', 'status': 'borrowing', 'sort': 'id'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['Số phiếu', 'Người mượn'])
+        rows = list(csv.reader(lines[1:]))
+        self.assertEqual([(int(r[0]), r[5]) for r in rows], [
+            (self.loans[1].pk, 'Máy 1a'), (self.loans[1].pk, 'Máy 1b'),
+            (self.loans[2].pk, 'Máy 2a'), (self.loans[2].pk, 'Máy 2b'),
+        ])
+        self.assertEqual((rows[0][4], rows[0][8]), ('Đang mượn (Đã xuất kho)', 'Hư hỏng'))
+
+    def test_xlsx_slip_list(self):
+        url = reverse('download_slip_list', args=['loan'])
+        response = self.client.get(url, {'format': 'xlsx', 'sort': '-id'})
+        sheet = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content))).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual([r[0] for r in rows[1:]], [loan.pk for loan in reversed(self.loans)])
+        # Ô bắt đầu bằng "=" không bị Excel hiểu là công thức
+        self.assertEqual(rows[1][6], '\'=HYPERLINK("x")')
+
+
+class SlipPhotoIngestTests(TestCase):
+    """Ảnh tải lên được xoay theo EXIF, bỏ metadata, thu nhỏ và có ảnh thu nhỏ cùng thư mục"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn', chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+        )
+
+    def _photo(self):
+        # Ảnh ngang 4000x1000, EXIF báo xoay 90 độ (orientation=6) như ảnh chụp dọc trên điện thoại
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'PhoneMaker'
+        buffer = io.BytesIO()
+        Image.new('RGB', (4000, 1000), 'red').save(buffer, 'JPEG', exif=exif, quality=95)
+        return SimpleUploadedFile('IMG_0001.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_is_processed(self):
+        photo = LoanImage.objects.create(loan=self.loan, image=self._photo(), image_type='borrow')
+        ext = images.EXTENSIONS[images.IMAGE_FORMAT]
+        self.assertTrue(photo.thumbnail.name.endswith(f'.{ext}'))
+        self.assertEqual(photo.thumb_url, photo.thumbnail.url)
+
+        with Image.open(photo.image.path) as img:
+            self.assertEqual(img.size, (images.IMAGE_MAX_EDGE // 4, images.IMAGE_MAX_EDGE))
+            self.assertEqual(len(img.getexif()), 0)
+        with Image.open(photo.thumbnail.path) as img:
+            self.assertLessEqual(max(img.size), max(images.THUMB_SIZE))
+
+    def test_unreadable_file_kept_as_is(self):
+        photo = LoanImage.objects.create(
+            loan=self.loan, image=SimpleUploadedFile('scan.jpg', b'not an image'), image_type='borrow',
+        )
+        self.assertFalse(photo.thumbnail)
+        self.assertEqual(photo.thumb_url, photo.image.url)
+
+    def test_save_photos_bulk(self):
+        uploads = [self._photo() for _ in range(3)] + [SimpleUploadedFile('scan.pdf', b'%PDF-1.4')]
+        with CaptureQueriesContext(connection) as queries:
+            photos = images.save_photos(LoanImage, uploads, loan=self.loan, image_type='return')
+        table = LoanImage._meta.db_table
+        self.assertEqual(len([q for q in queries if q['sql'].startswith(f'INSERT INTO "{table}"')]), 1)
+        self.assertEqual(self.loan.images.filter(image_type='return').count(), 4)
+        self.assertTrue(all(os.path.exists(p.image.path) for p in photos))
+        self.assertEqual(sum(bool(p.thumbnail) for p in photos), 3)
+        # 3 ảnh giống hệt nhau -> dùng chung 1 file
+        self.assertEqual(len({p.image.name for p in photos}), 2)
+        self.assertEqual(MediaBlob.objects.get(name=photos[0].image.name).refcount, 3)
+
+    def test_shared_file_deleted_with_last_row(self):
+        first = LoanImage.objects.create(loan=self.loan, image=self._photo(), image_type='borrow')
+        second = LoanImage.objects.create(loan=self.loan, image=self._photo(), image_type='return')
+        self.assertEqual((first.image.name, first.thumbnail.name), (second.image.name, second.thumbnail.name))
+        self.assertTrue(first.image.name.startswith('photos/'))
+        path = first.image.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_dedupe_media_command(self):
+        data = self._photo().read()
+        for name in ('loan_photos/2025/01/a.jpg', 'loan_photos/2025/02/b.jpg'):
+            os.makedirs(os.path.dirname(os.path.join(settings.MEDIA_ROOT, name)), exist_ok=True)
+            with open(os.path.join(settings.MEDIA_ROOT, name), 'wb') as f:
+                f.write(data)
+        # Dòng ảnh cũ tạo trước khi có kho lưu theo nội dung (không qua save())
+        LoanImage.objects.bulk_create([
+            LoanImage(loan=self.loan, image='loan_photos/2025/01/a.jpg', image_type='borrow'),
+            LoanImage(loan=self.loan, image='loan_photos/2025/02/b.jpg', image_type='borrow'),
+        ])
+        call_command('dedupe_media', stdout=io.StringIO())
+        names = set(LoanImage.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, name)))
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, 'loan_photos/2025/01/a.jpg')))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 2)
+
+    def test_deleting_slip_removes_files_and_sweep_cleans_orphans(self):
+        legacy = os.path.join(settings.MEDIA_ROOT, 'loan_photos/2025/01/old.jpg')
+        os.makedirs(os.path.dirname(legacy))
+        with open(legacy, 'wb') as f:
+            f.write(b'old')
+        LoanImage.objects.bulk_create([LoanImage(loan=self.loan, image='loan_photos/2025/01/old.jpg', image_type='borrow')])
+        photo = LoanImage.objects.create(loan=self.loan, image=self._photo(), image_type='borrow')
+        blob = photo.image.path
+        with self.captureOnCommitCallbacks(execute=True):
+            self.loan.delete()
+        self.assertFalse(os.path.exists(legacy))
+        self.assertFalse(os.path.exists(blob))
+
+        orphan = os.path.join(settings.MEDIA_ROOT, 'signatures', 'lost.png')
+        os.makedirs(os.path.dirname(orphan))
+        with open(orphan, 'wb') as f:
+            f.write(b'x')
+        out = io.StringIO()
+        call_command('sweep_media', '--dry-run', '--min-age=0', stdout=out)
+        self.assertIn('1 file mồ côi', out.getvalue())
+        self.assertTrue(os.path.exists(orphan))
+        call_command('sweep_media', '--min-age=0', '--rate=0', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(orphan))
+
+    def test_sweep_keeps_blob_reused_during_sweep(self):
+        photo = LoanImage.objects.create(loan=self.loan, image=self._photo(), image_type='borrow')
+        blob, name = photo.image.path, photo.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.delete()
+        # Blob mồ côi còn sót (như khi process chết trước lúc xóa file), đủ cũ để bị quét
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with open(blob, 'wb') as f:
+            f.write(b'old')
+        MediaBlob.objects.create(name=name, size=3)
+        os.utime(blob, (0, 0))
+
+        from warehouse.management.commands import sweep_media
+        real = sweep_media.referenced_files
+
+        def referenced_then_reuse():
+            names = real()
+            # Giữa lúc đọc DB và lúc xóa: phiếu khác tải lên đúng ảnh này -> dùng lại blob
+            LoanImage.objects.create(loan=self.loan, image=self._photo(), image_type='borrow')
+            return names
+
+        with mock.patch.object(sweep_media, 'referenced_files', referenced_then_reuse):
+            call_command('sweep_media', '--min-age=60', '--rate=0', stdout=io.StringIO())
+        self.assertTrue(os.path.exists(blob))
+        self.assertEqual(MediaBlob.objects.get(name=name).refcount, 1)
+
+
+class MediaServingTests(TestCase):
+    """/media/: bắt đăng nhập, ETag + 304, cache immutable cho ảnh phiếu, Range, X-Accel-Redirect"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=tmp.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(os.path.join(tmp.name, 'loan_photos', '2026', '01'))
+        with open(os.path.join(tmp.name, 'loan_photos', '2026', '01', 'a.jpg'), 'wb') as f:
+            f.write(bytes(range(256)) * 4)
+        self.url = '/media/loan_photos/2026/01/a.jpg'
+        self.client.force_login(User.objects.create_user('tester', password='x'))
+
+    def test_requires_login(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_etag_and_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        self.assertEqual(b''.join(self.client.get(self.url, HTTP_RANGE='bytes=-2').streaming_content), bytes([254, 255]))
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2000-').status_code, 416)
+        # If-Range không khớp ETag -> trả cả file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    @mock.patch.object(media, 'SENDFILE', 'nginx')
+    def test_nginx_offload(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/loan_photos/2026/01/a.jpg')
+        self.assertEqual(response.content, b'')
+
+
+class ChunkedUploadTests(TestCase):
+    """Tải ảnh theo đoạn: lệch offset -> 409 để tải tiếp, form trả hàng chỉ gửi upload_ids"""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        media_root = override_settings(MEDIA_ROOT=os.path.join(tmp.name, 'media'))
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        patcher = mock.patch.object(uploads, 'UPLOAD_DIR', os.path.join(tmp.name, 'upload_tmp'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('tester', password='x')
+        self.client.force_login(self.user)
+
+    def _chunk(self, upload_id, offset, data):
+        return self.client.post(reverse('api_upload_chunk', args=[upload_id]), data=data,
+                                content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_resume_and_attach_on_return(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), 'blue').save(buffer, 'JPEG')
+        data = buffer.getvalue()
+        state = self.client.post(reverse('api_upload_start'), {'file_name': 'tra.jpg', 'size': len(data)}).json()
+        upload_id = state['id']
+
+        self.assertEqual(self._chunk(upload_id, 0, data[:100]).json()['offset'], 100)
+        # Phản hồi đoạn trước bị mất, client gửi lại từ 0 -> server báo đang có 100 byte
+        conflict = self._chunk(upload_id, 0, data[:100])
+        self.assertEqual((conflict.status_code, conflict.json()['offset']), (409, 100))
+        self.assertEqual(self.client.post(reverse('api_upload_finish', args=[upload_id])).status_code, 409)
+        self._chunk(upload_id, 100, data[100:])
+        self.assertTrue(self.client.post(reverse('api_upload_finish', args=[upload_id])).json()['complete'])
+
+        loan = LoanSlip.objects.create(
+            ma_nhan_vien='NV001', nguoi_muon='A', email='a@b.vn', chuc_vu='NV', phong_ban='Kho', ly_do='Test',
+            status='borrowing',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('return_loan', args=[loan.pk]), {'upload_ids': [upload_id]})
+        self.assertEqual(response.status_code, 302)
+        photo = loan.images.get(image_type='return')
+        self.assertTrue(photo.thumbnail)
+        self.assertFalse(PhotoUpload.objects.exists())
+        self.assertEqual(os.listdir(uploads.UPLOAD_DIR), [])
@@ -0,0 +1,126 @@
+import fcntl
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PhotoUpload
+
+# Tải ảnh theo từng đoạn (chunk), mất mạng thì tải tiếp phần còn thiếu:
+#   1. POST api/uploads/                  (file_name, size)           -> id
+#   2. POST api/uploads/<id>/  header Upload-Offset, body = bytes đoạn -> offset mới
+#      lệch offset -> 409 kèm offset server đang có, client gửi tiếp từ đó; GET -> offset hiện tại
+#   3. POST api/uploads/<id>/finish/                                   -> đủ byte thì đánh dấu xong
+# File ghép dần trong CHUNKED_UPLOAD_DIR; form lưu phiếu chỉ gửi upload_ids, view gắn ảnh vào phiếu
+# rồi xóa file tạm. Upload bỏ dở quá CHUNKED_UPLOAD_TTL bị lệnh sweep_media dọn.
+UPLOAD_DIR = getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'upload_tmp'))
+CHUNK_SIZE = getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 1024 * 1024)  # < DATA_UPLOAD_MAX_MEMORY_SIZE
+MAX_SIZE = getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 30 * 1024 * 1024)
+UPLOAD_TTL = getattr(settings, 'CHUNKED_UPLOAD_TTL', 24 * 3600)
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        super().__init__(f'Server đang có {offset} byte')
+        self.offset = offset
+
+
+def part_path(upload):
+    return os.path.join(UPLOAD_DIR, f'{upload.pk}.part')
+
+
+def start_upload(user, file_name, size):
+    if not file_name or size <= 0:
+        raise UploadError('Thiếu tên file hoặc dung lượng')
+    if size > MAX_SIZE:
+        raise UploadError(f'File quá lớn (tối đa {MAX_SIZE // 1024 // 1024} MB)')
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload = PhotoUpload.objects.create(user=user, file_name=os.path.basename(file_name)[:255], size=size)
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def append_chunk(upload, offset, data):
+    """Ghi đoạn bắt đầu từ offset -> số byte đã nhận. Khóa file để 2 request gửi lại cùng đoạn không ghi chồng"""
+    if upload.status != 'uploading':
+        raise UploadError('Upload đã hoàn tất')
+    try:
+        f = open(part_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Upload đã hết hạn, vui lòng chọn lại ảnh')
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        received = f.seek(0, os.SEEK_END)
+        if offset != received:
+            raise OffsetMismatch(received)
+        if received + len(data) > upload.size:
+            raise UploadError('Nhận nhiều byte hơn dung lượng đã khai báo')
+        f.write(data)
+        received += len(data)
+    PhotoUpload.objects.filter(pk=upload.pk).update(received=received, updated_at=timezone.now())
+    upload.received = received
+    return received
+
+
+def finish_upload(upload):
+    try:
+        received = os.path.getsize(part_path(upload))
+    except FileNotFoundError:
+        raise UploadError('Upload đã hết hạn, vui lòng chọn lại ảnh')
+    if received != upload.size:
+        raise OffsetMismatch(received)
+    upload.received, upload.status = received, 'complete'
+    upload.save(update_fields=['received', 'status', 'updated_at'])
+    return upload
+
+
+def discard_uploads(uploads):
+    for upload in uploads:
+        try:
+            os.remove(part_path(upload))
+        except FileNotFoundError:
+            pass
+    PhotoUpload.objects.filter(pk__in=[upload.pk for upload in uploads]).delete()
+
+
+def purge_stale_uploads(ttl=UPLOAD_TTL):
+    """Xóa upload bỏ dở / tải xong nhưng không lưu phiếu quá ttl giây -> số upload đã xóa"""
+    stale = list(PhotoUpload.objects.filter(updated_at__lt=timezone.now() - timedelta(seconds=ttl)))
+    discard_uploads(stale)
+    return len(stale)
+
+
+@contextmanager
+def posted_photos(request, field):
+    """
+    Ảnh gửi kèm form: file multipart trong request.FILES[field] + các upload đã tải xong (POST upload_ids).
+    Lưu xong và commit mới xóa file tạm -> lỗi thì gửi lại form vẫn dùng được các upload đó.
+    """
+    ids = []
+    for value in request.POST.getlist('upload_ids'):
+        try:
+            ids.append(uuid.UUID(value))
+        except ValueError:
+            continue
+    uploads = [
+        upload for upload in PhotoUpload.objects.filter(pk__in=ids, user=request.user, status='complete')
+        if os.path.exists(part_path(upload))
+    ] if ids else []
+    files = [File(open(part_path(upload), 'rb'), name=upload.file_name) for upload in uploads]
+    try:
+        yield request.FILES.getlist(field) + files
+    finally:
+        for f in files:
+            f.close()
+    if uploads:
+        transaction.on_commit(partial(discard_uploads, uploads))
@@ -34,4 +34,18 @@ urlpatterns = [
     path('export/<int:pk>/edit/', views.edit_export, name='edit_export'),
     path('export/<int:pk>/action/<str:action>/', views.export_action, name='export_action'),
     path('export/<int:pk>/pdf/', views.export_export_pdf, name='export_export_pdf'),
+    path('bulk/<str:kind>/<str:action>/', views.bulk_slip_action, name='bulk_slip_action'),
+    path('inbox/', views.inbox_view, name='inbox'),
+
+    # Tạo PDF chạy nền
+    path('api/pdf/<str:kind>/<int:pk>/render/', views.api_pdf_render, name='api_pdf_render'),
+    path('api/pdf/jobs/<int:job_id>/', views.api_pdf_job, name='api_pdf_job'),
+    path('pdf/jobs/<int:job_id>/', views.pdf_job_page, name='pdf_job_page'),
+    path('pdf/jobs/<int:job_id>/file/', views.pdf_job_result, name='pdf_job_result'),
+    path('download/<str:kind>/', views.download_slip_list, name='download_slip_list'),
+    path('api/import/<str:kind>/preview/', views.api_import_preview, name='api_import_preview'),
+    path('api/import/jobs/<int:job_id>/', views.api_import_job, name='api_import_job'),
+    path('api/uploads/', views.api_upload_start, name='api_upload_start'),
+    path('api/uploads/<uuid:upload_id>/', views.api_upload_chunk, name='api_upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/finish/', views.api_upload_finish, name='api_upload_finish'),
 ]
@@ -1,24 +1,21 @@
-import os
-import resend
 from django.template.loader import render_to_string
 from django.core.mail import send_mail
 from django.core.mail import EmailMessage
 from django.conf import settings
-from weasyprint import HTML
-from django.contrib.auth.models import User, Group
 from django.urls import reverse # <--- Import thêm
+from django.utils.html import escape
+from .outbox import enqueue_email
+from .recipients import group_emails
 # --- HÀM MỚI: LẤY EMAIL CỦA MỘT NHÓM ---
-resend.api_key = os.environ.get('RESEND_API_KEY')
-
 def get_emails_by_group(group_name):
-    """Lấy danh sách email của nhóm"""
-    users = User.objects.filter(groups__name=group_name)
+    """Lấy danh sách email của nhóm (đọc từ danh bạ trong cache, xem recipients.py)"""
     # Lưu ý: Nếu dùng gói Free, chỉ gửi được về email chính chủ đã đăng ký Resend
-    return [u.email for u in users if u.email]
+    return group_emails(group_name)
 
 def send_loan_email(request, loan, subject, message, recipients):
     """
-    Gửi email bằng Resend API (Nhanh hơn SMTP)
+    Đưa email thông báo Phiếu Mượn (kèm PDF) vào hàng đợi outbox.
+    Việc tạo PDF và gọi Resend API do worker làm (xem outbox.py).
     """
     # 1. Tạo Link chi tiết
     relative_link = reverse('loan_detail', args=[loan.id])
@@ -34,51 +31,19 @@ def send_loan_email(request, loan, subject, message, recipients):
     <small>Đây là email tự động từ Hệ thống Quản lý Kho.</small>
     """
 
-    # 3. Tạo PDF (WeasyPrint)
-    html_string = render_to_string('warehouse/pdf/loan_template.html', {
-        'loan': loan,
-        'items': loan.items.all(),
-        'request': request
-    })
-    # Tạo file PDF dưới dạng bytes
-    pdf_bytes = HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-
-    # 4. Gửi qua RESEND API
+    # 3. Ghi vào outbox (PDF được tạo lúc gửi)
     if not recipients:
         print("⚠️ Không có người nhận email!")
         return False
-
-    params = {
-        "from": "system@sun-automation.id.vn", # Bắt buộc dùng mail này nếu chưa add domain
-        "to": recipients,
-        "subject": subject,
-        "html": html_content,
-        "attachments": [
-            {
-                "filename": f"Phieu_Muon_{loan.id}.pdf",
-                "content": list(pdf_bytes) # Resend API yêu cầu convert bytes sang list số nguyên
-            }
-        ]
-    }
-
-    try:
-        r = resend.Emails.send(params)
-        print(f"✅ Gửi mail thành công! ID: {r.get('id')}")
-        return True
-    except Exception as e:
-        # Chỉ in lỗi, không làm sập web
-        print(f"❌ Lỗi gửi mail API: {e}")
-        return False
+    enqueue_email(subject, html_content, recipients, slip=loan, attachment_name=f"Phieu_Muon_{loan.id}.pdf")
+    return True
 
 
 def send_purchase_email(request, slip, subject, message, recipients):
     """
-    Gửi email thông báo Phiếu Mua Hàng kèm PDF qua Resend API
+    Đưa email thông báo Phiếu Mua Hàng (kèm PDF) vào hàng đợi outbox
     (Cấu trúc giống hệt send_loan_email)
     """
-    # 0. Cấu hình API Key
-    resend.api_key = settings.RESEND_API_KEY
-
     # 1. Tạo Link chi tiết
     relative_link = reverse('purchase_detail', args=[slip.id])
     full_link = request.build_absolute_uri(relative_link)
@@ -92,54 +57,17 @@ def send_purchase_email(request, slip, subject, message, recipients):
     <small style="color: gray;">Đây là email tự động từ Hệ thống Quản lý Kho (Sun Automation).</small>
     """
 
-    # 3. Tạo PDF (WeasyPrint) 
-    # Lưu ý: Cần có file template 'warehouse/pdf/purchase_template.html'
-    try:
-        html_string = render_to_string('warehouse/pdf/purchase_template.html', {
-            'slip': slip,
-            'items': slip.items.all(),
-            'request': request
-        })
-        pdf_bytes = HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-        has_pdf = True
-    except Exception as e:
-        print(f"⚠️ Lỗi tạo PDF Purchase: {e}")
-        pdf_bytes = None
-        has_pdf = False
-
-    # 4. Gửi qua RESEND API
+    # 3. Ghi vào outbox
     if not recipients:
         print("⚠️ Không có người nhận email!")
         return False
-
-    params = {
-        "from": "system@sun-automation.id.vn", 
-        "to": recipients,
-        "subject": subject,
-        "html": html_content,
-        "attachments": []
-    }
-
-    # Đính kèm PDF nếu tạo thành công
-    if has_pdf:
-        params["attachments"].append({
-            "filename": f"Phieu_Mua_{slip.id}.pdf",
-            "content": list(pdf_bytes) 
-        })
-
-    try:
-        r = resend.Emails.send(params)
-        print(f"✅ Gửi mail Purchase thành công! ID: {r.get('id')}")
-        return True
-    except Exception as e:
-        print(f"❌ Lỗi gửi mail API: {e}")
-        return False
+    enqueue_email(subject, html_content, recipients, slip=slip, attachment_name=f"Phieu_Mua_{slip.id}.pdf")
+    return True
 
 def send_export_email(request, slip, subject, message, recipients):
     """
-    Gửi email thông báo Phiếu Xuất Kho kèm PDF
+    Đưa email thông báo Phiếu Xuất Kho (kèm PDF) vào hàng đợi outbox
     """
-    resend.api_key = settings.RESEND_API_KEY
     relative_link = reverse('export_detail', args=[slip.id])
     full_link = request.build_absolute_uri(relative_link)
 
@@ -150,28 +78,27 @@ def send_export_email(request, slip, subject, message, recipients):
     <hr><small>Hệ thống Quản lý Kho - Phiếu Xuất.</small>
     """
 
-    try:
-        html_string = render_to_string('warehouse/pdf/export_template.html', {
-            'slip': slip, 'items': slip.items.all(), 'request': request
-        })
-        pdf_bytes = HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf()
-        has_pdf = True
-    except Exception as e:
-        print(f"⚠️ Lỗi PDF Export: {e}")
-        pdf_bytes = None; has_pdf = False
-
     if not recipients: return False
+    enqueue_email(subject, html_content, recipients, slip=slip, attachment_name=f"Phieu_Xuat_{slip.id}.pdf")
+    return True
 
-    params = {
-        "from": "system@sun-automation.id.vn", "to": recipients,
-        "subject": subject, "html": html_content, "attachments": []
-    }
-    if has_pdf:
-        params["attachments"].append({"filename": f"Phieu_Xuat_{slip.id}.pdf", "content": list(pdf_bytes)})
 
-    try:
-        resend.Emails.send(params)
-        return True
-    except Exception as e:
-        print(f"❌ Lỗi gửi mail API: {e}")
-        return False
\ No newline at end of file
+def send_summary_email(request, kind, slips, subject, message, recipients):
+    """
+    Mail tổng hợp khi duyệt hàng loạt: 1 mail liệt kê link từng phiếu, không đính kèm PDF
+    (kind: 'loan' / 'purchase' / 'export')
+    """
+    formatted_message = message.replace("\n", "<br>")
+    links = "".join(
+        f'<li><a href="{request.build_absolute_uri(reverse(f"{kind}_detail", args=[slip.id]))}">{escape(str(slip))}</a>'
+        f' - {escape(slip.get_status_display())}</li>'
+        for slip in slips
+    )
+    html_content = f"""
+    <p>{formatted_message}</p>
+    <ul>{links}</ul>
+    <hr><small>Đây là email tự động từ Hệ thống Quản lý Kho.</small>
+    """
+    if not recipients: return False
+    enqueue_email(subject, html_content, recipients)
+    return True
@@ -1,27 +1,41 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed, Http404
+from django.views.decorators.http import require_POST
 from django.contrib import messages
 from django.template.loader import render_to_string
 from django.conf import settings
-from django.contrib.auth.models import User
 from django.core.mail import send_mail
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.db.models import Q 
+from django.utils.html import escape
+from django.utils.http import url_has_allowed_host_and_scheme
 from django.utils.safestring import mark_safe # <--- Để hiển thị HTML trong thông báo
 from django.urls import reverse               # <--- Để lấy đường dẫn URL
-import pandas as pd
-from weasyprint import HTML
 from .forms import UserUpdateForm, ProfileUpdateForm
 # Import Models và Forms
 from .models import LoanSlip, LoanImage, LoanItem, Employee, LoanHistory
 from .forms import LoanSlipForm, RegistrationForm, LoanItemFormSet, ReturnLoanForm
-from .utils import send_loan_email, get_emails_by_group, send_purchase_email
 from .models import PurchaseSlip, PurchaseItem, PurchaseHistory, PurchaseImage # Import
 from .forms import PurchaseSlipForm, PurchaseItemFormSet # Import
 from .models import ExportSlip, ExportItem, ExportImage, ExportHistory
 from .forms import ExportSlipForm, ExportItemFormSet
-from .utils import send_export_email # Import hàm mới
+from .pagination import keyset_paginate
+from .filters import filter_slip_list
+from .exports import EXPORTS, csv_response, xlsx_response
+from .employees import search_employees, find_employee
+from .models import PdfJob, ImportJob, PhotoUpload
+from .pdf import PDF_FILENAMES, slip_pdf_version
+from .pdf_cache import read_cached_pdf
+from .pdf_jobs import URL_KINDS, MODEL_URL_KINDS, submit_slip_pdf, wait_for_pdf, job_pdf
+from .import_jobs import SLIP_ITEM_MODELS, enqueue_import
+from .import_preview import build_preview, preview_summary
+from .images import save_photos
+from .uploads import (
+    CHUNK_SIZE as UPLOAD_CHUNK_SIZE, OffsetMismatch, UploadError, append_chunk, finish_upload, posted_photos, start_upload,
+)
+from .media import media_response
+from .workflow import WORKFLOWS, TransitionConflict, TransitionError, apply_bulk, apply_transition, bulk_actions, inbox
 # ============================================
 # CÁC VIEW HỆ THỐNG
 # ============================================
@@ -51,38 +65,48 @@ def home_redirect(request):
 def api_get_employee(request):
     query = request.GET.get('query')
     if query:
-        employees = Employee.objects.filter(
-            Q(ma_nhan_vien__icontains=query) | 
-            Q(ho_ten__icontains=query)
-        )[:10]
-        results = []
-        for emp in employees:
-            results.append({
-                'ma_nhan_vien': emp.ma_nhan_vien,
-                'ho_ten': emp.ho_ten,
-                'email': emp.email,
-                'chuc_vu': emp.chuc_vu,
-                'phong_ban': emp.phong_ban,
-            })
-        return JsonResponse({'results': results})
+        # Gợi ý có xếp hạng: trùng mã chính xác -> mã bắt đầu bằng -> tên (không dấu)
+        return JsonResponse({'results': search_employees(query)})
     
     # Logic tìm chính xác
     ma_nv = request.GET.get('ma_nv')
     if ma_nv:
-        try:
-            emp = Employee.objects.get(ma_nhan_vien=ma_nv)
-            return JsonResponse({
-                'found': True,
-                'ho_ten': emp.ho_ten,
-                'email': emp.email,
-                'chuc_vu': emp.chuc_vu,
-                'phong_ban': emp.phong_ban
-            })
-        except Employee.DoesNotExist:
+        emp = find_employee(ma_nv)
+        if emp is None:
             return JsonResponse({'found': False})
+        return JsonResponse({
+            'found': True,
+            'ho_ten': emp['ho_ten'],
+            'email': emp['email'],
+            'chuc_vu': emp['chuc_vu'],
+            'phong_ban': emp['phong_ban']
+        })
 
     return JsonResponse({'results': []})
 
+def import_excel_items(request, slip):
+    """
+    Đưa danh sách vật tư từ Excel vào hàng đợi import nền: ưu tiên bản đã xem trước (import_token),
+    không có thì dùng file upload. Thông báo có ô tiến độ (base.html tự hỏi trạng thái).
+    """
+    token = request.POST.get('import_token', '').strip()
+    excel_file = request.FILES.get('excel_file')
+    preview = None
+    if token:
+        preview = preview_summary(SLIP_ITEM_MODELS[slip._meta.model_name][1], token)
+        if preview is None and excel_file is None:
+            messages.warning(request, "Bản xem trước file Excel đã hết hạn, vui lòng chọn lại file để nhập danh sách.")
+            return None
+    if preview is None and excel_file is None:
+        return None
+    job = enqueue_import(slip, excel_file, request.user, preview=preview)
+    status_url = reverse('api_import_job', args=[job.id])
+    messages.info(request, mark_safe(
+        f'Đang nhập danh sách từ file <b>{escape(job.file_name)}</b>: '
+        f'<span data-import-job="{status_url}">đang chờ...</span>'
+    ))
+    return job
+
 # 1. TẠO PHIẾU XUẤT
 @login_required
 def create_export(request):
@@ -101,41 +125,7 @@ def create_export(request):
             )
 
             # --- XỬ LÝ IMPORT EXCEL ---
-            excel_file = request.FILES.get('excel_file')
-            if excel_file:
-                try:
-                    df = pd.read_excel(excel_file)
-                    df.columns = df.columns.str.strip().str.lower()
-                    
-                    def find_col(df, keywords):
-                        for col in df.columns:
-                            if all(k in col for k in keywords): return col
-                        return None
-
-                    for index, row in df.iterrows():
-                        # Tìm cột Tên (Bắt buộc)
-                        col_ten = find_col(df, ['tên']) 
-                        ten = row.get(col_ten)
-                        if pd.isna(ten) or str(ten).strip() == '': continue
-                        
-                        # Tìm cột ĐVT, SL, Ghi chú
-                        col_dvt = find_col(df, ['đơn', 'vị']) or find_col(df, ['dvt'])
-                        dvt = row.get(col_dvt) or 'Cái'
-
-                        col_sl = find_col(df, ['số', 'lượng']) or find_col(df, ['sl'])
-                        try:
-                            sl = int(row.get(col_sl)) if pd.notna(row.get(col_sl)) else 1
-                        except: sl = 1
-
-                        col_gc = find_col(df, ['ghi', 'chú'])
-                        ghi_chu = row.get(col_gc) or ''
-
-                        ExportItem.objects.create(
-                            slip=slip, ten_hang_hoa=ten, don_vi_tinh=dvt, 
-                            so_luong=sl, ghi_chu=ghi_chu
-                        )
-                except Exception as e:
-                    messages.warning(request, f"Lỗi đọc file Excel: {e}")
+            import_excel_items(request, slip)
 
             # --- LƯU FORMSET (Dữ liệu nhập tay) ---
             if item_formset.is_valid():
@@ -146,9 +136,8 @@ def create_export(request):
                 for obj in item_formset.deleted_objects: obj.delete()
             
             # --- LƯU ẢNH ---
-            files = request.FILES.getlist('photos')
-            for f in files:
-                ExportImage.objects.create(slip=slip, image=f)
+            with posted_photos(request, 'photos') as photos:
+                save_photos(ExportImage, photos, slip=slip)
 
             messages.success(request, f"Đã tạo phiếu xuất kho #{slip.id:04d} thành công!")
             return redirect('export_detail', pk=slip.id)
@@ -182,32 +171,7 @@ def edit_export(request, pk):
             ExportHistory.objects.create(slip=slip, user=request.user, action="Cập nhật phiếu")
 
             # Import Excel thêm (nếu có)
-            excel_file = request.FILES.get('excel_file')
-            if excel_file:
-                try:
-                    df = pd.read_excel(excel_file)
-                    df.columns = df.columns.str.strip().str.lower()
-                    def find_col(df, keywords):
-                        for col in df.columns:
-                            if all(k in col for k in keywords): return col
-                        return None
-                    
-                    for index, row in df.iterrows():
-                        col_ten = find_col(df, ['tên']) 
-                        ten = row.get(col_ten)
-                        if pd.isna(ten) or str(ten).strip() == '': continue
-                        
-                        col_dvt = find_col(df, ['đơn', 'vị']) or find_col(df, ['dvt'])
-                        dvt = row.get(col_dvt) or 'Cái'
-                        col_sl = find_col(df, ['số', 'lượng']) or find_col(df, ['sl'])
-                        try: sl = int(row.get(col_sl)) if pd.notna(row.get(col_sl)) else 1
-                        except: sl = 1
-                        col_gc = find_col(df, ['ghi', 'chú'])
-                        ghi_chu = row.get(col_gc) or ''
-
-                        ExportItem.objects.create(slip=slip, ten_hang_hoa=ten, don_vi_tinh=dvt, so_luong=sl, ghi_chu=ghi_chu)
-                except Exception as e:
-                    messages.warning(request, f"Lỗi Excel: {e}")
+            import_excel_items(request, slip)
 
             # Lưu Formset
             if item_formset.is_valid():
@@ -223,9 +187,8 @@ def edit_export(request, pk):
                 ExportImage.objects.filter(id__in=delete_ids, slip=slip).delete()
 
             # Thêm ảnh mới
-            files = request.FILES.getlist('photos')
-            for f in files:
-                ExportImage.objects.create(slip=slip, image=f)
+            with posted_photos(request, 'photos') as photos:
+                save_photos(ExportImage, photos, slip=slip)
 
             messages.success(request, "Cập nhật phiếu thành công!")
             return redirect('export_detail', pk=slip.id)
@@ -239,40 +202,22 @@ def edit_export(request, pk):
 # 2. DANH SÁCH XUẤT KHO (CÓ LỌC)
 @login_required
 def export_list(request):
-    slips = ExportSlip.objects.all().order_by('-id')
-
-    # --- BỘ LỌC ---
-    search_query = request.GET.get('q', '')
-    if search_query:
-        slips = slips.filter(
-            Q(id__icontains=search_query) | 
-            Q(nguoi_de_xuat__icontains=search_query) | 
-            Q(ma_nhan_vien__icontains=search_query)
-        )
-    
-    status = request.GET.get('status', '')
-    if status: slips = slips.filter(status=status)
-
-    dept = request.GET.get('dept', '')
-    if dept: slips = slips.filter(phong_ban__icontains=dept)
+    slips, sort_by, current = filter_slip_list(
+        ExportSlip.objects.all(), request.GET, ExportSlip.LIST_SORT_FIELDS
+    )
 
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
-    if date_from: slips = slips.filter(ngay_tao__date__gte=date_from)
-    if date_to: slips = slips.filter(ngay_tao__date__lte=date_to)
-
-    # --- SẮP XẾP ---
-    sort_by = request.GET.get('sort', '-id')
-    valid_sort = ['id', 'nguoi_de_xuat', 'phong_ban', 'ngay_tao', 'status']
-    if sort_by.lstrip('-') in valid_sort:
-        slips = slips.order_by(sort_by)
+    # --- PHÂN TRANG (CON TRỎ) ---
+    page = keyset_paginate(
+        slips, sort_by,
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
 
     context = {
-        'slips': slips,
+        'slips': page,
+        'page': page,
         'status_choices': ExportSlip.STATUS_CHOICES,
-        'current_search': search_query, 'current_status': status,
-        'current_dept': dept, 'current_sort': sort_by,
-        'current_date_from': date_from, 'current_date_to': date_to,
+        'bulk_actions': bulk_actions('export', request.user),
+        **current,
     }
     return render(request, 'warehouse/export_list.html', context)
 
@@ -282,123 +227,68 @@ def export_detail(request, pk):
     slip = get_object_or_404(ExportSlip, pk=pk)
     return render(request, 'warehouse/export_detail.html', {'slip': slip})
 
-# 5. XỬ LÝ DUYỆT (ACTION)
+def _slip_action(request, kind, pk, action):
+    """Thao tác duyệt phiếu: AJAX nhận JSON (409 nếu người khác đã xử lý trước), còn lại quay về trang chi tiết"""
+    slip = get_object_or_404(WORKFLOWS[kind]['model'], pk=pk)
+    wants_json = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+    try:
+        slip = apply_transition(request, kind, slip, action, note=request.POST.get('note', ''))
+    except TransitionConflict as e:
+        # Thua cuộc đua duyệt: không ghi nhật ký / xếp mail lần 2, chỉ báo trạng thái hiện tại
+        if wants_json:
+            return JsonResponse({'error': str(e), 'status': e.slip.status}, status=409)
+        messages.warning(request, str(e))
+    except TransitionError as e:
+        if wants_json:
+            return JsonResponse({'error': str(e)}, status=403)
+        messages.error(request, str(e))
+    else:
+        if wants_json:
+            return JsonResponse({'status': slip.status, 'status_display': slip.get_status_display()})
+        messages.success(request, f"Đã cập nhật trạng thái: {slip.get_status_display()}")
+    return redirect(f'{kind}_detail', pk=pk)
+
+@login_required
+@require_POST
+def bulk_slip_action(request, kind, action):
+    """Duyệt / từ chối hàng loạt các phiếu đã chọn ở trang danh sách (POST ids, note)"""
+    if kind not in WORKFLOWS:
+        raise Http404
+    ids = [int(pk) for pk in request.POST.getlist('ids') if pk.isdigit()]
+    wants_json = request.headers.get('x-requested-with') == 'XMLHttpRequest'
+    try:
+        slips, skipped = apply_bulk(request, kind, ids, action, note=request.POST.get('note', ''))
+    except TransitionError as e:
+        if wants_json:
+            return JsonResponse({'error': str(e)}, status=403)
+        messages.error(request, str(e))
+    else:
+        if wants_json:
+            return JsonResponse({'done': [slip.pk for slip in slips], 'skipped': skipped})
+        if slips:
+            messages.success(request, f"Đã cập nhật {len(slips)} phiếu.")
+        if skipped:
+            messages.warning(request, f"Bỏ qua {len(skipped)} phiếu (đã được xử lý hoặc không ở bước của bạn).")
+    next_url = request.POST.get('next')
+    if next_url and url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        return redirect(next_url)
+    return redirect(f'{kind}_list')
+
+@login_required
+def inbox_view(request):
+    """Hộp "Chờ tôi duyệt": phiếu mượn / mua / xuất đang ở bước user được duyệt"""
+    return render(request, 'warehouse/inbox.html', {'sections': inbox(request.user)})
+
+# 5. XỬ LÝ DUYỆT (ACTION) - bảng quy trình trong workflow.py
 @login_required
 def export_action(request, pk, action):
-    slip = get_object_or_404(ExportSlip, pk=pk)
-    user = request.user
-    note = request.POST.get('note', '')
-    
-    def check_perm(group): return user.groups.filter(name=group).exists() or user.is_superuser
-    
-    history_action = ""
-    mail_subject = ""
-    mail_message = ""
-    mail_recipients = []
-
-    # BƯỚC 1: Gửi duyệt (Nhân viên -> Trưởng phòng)
-    if action == 'send':
-        if slip.status not in ['draft', 'rejected']: return redirect('export_detail', pk=pk)
-        slip.status = 'dept_pending'
-        slip.ngay_gui = timezone.now()
-        history_action = "Gửi yêu cầu duyệt"
-        
-        mail_subject = f"[DUYỆT XUẤT] Phiếu #{slip.id:04d} chờ Trưởng phòng duyệt"
-        mail_message = f"Nhân viên {slip.nguoi_de_xuat} gửi yêu cầu xuất kho.\nLý do: {slip.ly_do}"
-        users = User.objects.filter(groups__name='TruongPhong')
-        mail_recipients = [u.email for u in users if u.email]
-
-    # BƯỚC 2: Trưởng phòng duyệt (TP -> Thủ kho)
-    elif action == 'dept_approve':
-        if not check_perm('TruongPhong'):
-            messages.error(request, "Cần quyền Trưởng phòng!")
-            return redirect('export_detail', pk=pk)
-        
-        slip.status = 'warehouse_pending'
-        slip.user_truong_phong = user
-        slip.ngay_truong_phong_duyet = timezone.now()
-        history_action = "Trưởng phòng đã duyệt"
-        
-        mail_subject = f"[DUYỆT XUẤT] Phiếu #{slip.id:04d} chờ Thủ kho kiểm tra"
-        mail_message = f"Trưởng phòng đã duyệt phiếu #{slip.id:04d}.\nMời Thủ kho kiểm tra hàng hóa."
-        users = User.objects.filter(groups__name='ThuKho')
-        mail_recipients = [u.email for u in users if u.email]
-
-    # BƯỚC 3: Thủ kho duyệt (TK -> Giám đốc)
-    elif action == 'warehouse_approve':
-        if not check_perm('ThuKho'):
-            messages.error(request, "Cần quyền Thủ kho!")
-            return redirect('export_detail', pk=pk)
-            
-        slip.status = 'director_pending'
-        slip.user_thu_kho = user
-        slip.ngay_thu_kho_duyet = timezone.now()
-        history_action = "Thủ kho đã duyệt (Đủ hàng)"
-        
-        mail_subject = f"[DUYỆT XUẤT] Phiếu #{slip.id:04d} chờ Giám đốc duyệt"
-        mail_message = f"Thủ kho xác nhận đủ hàng cho phiếu #{slip.id:04d}.\nMời Giám đốc phê duyệt."
-        users = User.objects.filter(groups__name='GiamDoc')
-        mail_recipients = [u.email for u in users if u.email]
-
-    # BƯỚC 4: Giám đốc duyệt (GĐ -> Hoàn tất)
-    elif action == 'director_approve':
-        if not check_perm('GiamDoc'):
-            messages.error(request, "Cần quyền Giám đốc!")
-            return redirect('export_detail', pk=pk)
-            
-        slip.status = 'completed'
-        slip.user_giam_doc = user
-        slip.ngay_giam_doc_duyet = timezone.now()
-        history_action = "Giám đốc đã duyệt (Hoàn tất)"
-        
-        mail_subject = f"[THÀNH CÔNG] Phiếu xuất #{slip.id:04d} đã được duyệt"
-        mail_message = f"Phiếu xuất kho của bạn đã được phê duyệt đầy đủ các cấp."
-        if slip.created_by and slip.created_by.email:
-            mail_recipients = [slip.created_by.email]
-
-    # TỪ CHỐI
-    elif action == 'reject':
-        # Cho phép TP, TK, GĐ từ chối
-        if not (check_perm('TruongPhong') or check_perm('ThuKho') or check_perm('GiamDoc')):
-            messages.error(request, "Bạn không có quyền từ chối!")
-            return redirect('export_detail', pk=pk)
-            
-        slip.status = 'rejected'
-        slip.ngay_tu_choi = timezone.now()
-        history_action = f"Từ chối bởi {user.last_name} {user.first_name}"
-        
-        mail_subject = f"[TỪ CHỐI] Phiếu xuất #{slip.id:04d} bị từ chối"
-        mail_message = f"Phiếu xuất kho đã bị từ chối.\nLý do: {note if note else 'Không có'}"
-        if slip.created_by and slip.created_by.email:
-            mail_recipients = [slip.created_by.email]
-
-    # LƯU & GHI LOG & GỬI MAIL
-    slip.save()
-    if history_action:
-        ExportHistory.objects.create(slip=slip, user=user, action=history_action, note=note)
-    
-    if mail_recipients:
-        try:
-            send_export_email(request, slip, mail_subject, mail_message, mail_recipients)
-        except Exception as e:
-            print(f"Lỗi gửi mail export: {e}")
-    
-    messages.success(request, f"Đã cập nhật trạng thái: {slip.get_status_display()}")
-    return redirect('export_detail', pk=pk)
+    return _slip_action(request, 'export', pk, action)
 
 # 6. XUẤT PDF
 def export_export_pdf(request, pk):
     slip = get_object_or_404(ExportSlip, pk=pk)
     try:
-        html_string = render_to_string('warehouse/pdf/export_template.html', {
-            'slip': slip, 
-            'items': slip.items.all(), 
-            'request': request
-        })
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'inline; filename=phieu_xuat_{pk}.pdf'
-        HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(response)
-        return response
+        return _slip_pdf_response(request, slip)
     except Exception as e:
         messages.error(request, f"Lỗi tạo PDF: {e}")
         return redirect('export_detail', pk=pk)
@@ -425,71 +315,7 @@ def create_loan(request):
             # ==========================================
             # 1. XỬ LÝ IMPORT EXCEL (GỌN NHẸ - KHÔNG CẦN NGÀY THÁNG)
             # ==========================================
-            excel_file = request.FILES.get('excel_file')
-            if excel_file:
-                try:
-                    df = pd.read_excel(excel_file)
-                    df.columns = df.columns.str.strip().str.lower()
-                    
-                    # Hàm tìm tên cột linh hoạt
-                    def find_column(df, keywords):
-                        for col in df.columns:
-                            if all(key in col for key in keywords): return col
-                        return None
-
-                    for index, row in df.iterrows():
-                        # 1. Tên tài sản
-                        col_ten = find_column(df, ['tên']) 
-                        ten = row.get(col_ten) if col_ten else None
-                        if pd.isna(ten) or str(ten).strip() == '': continue
-
-                        # 2. ĐVT & SL
-                        col_dvt = find_column(df, ['đơn', 'vị']) or find_column(df, ['dvt'])
-                        dvt = row.get(col_dvt) if col_dvt else 'Cái'
-
-                        col_sl = find_column(df, ['số', 'lượng']) or find_column(df, ['sl'])
-                        sl = row.get(col_sl) if col_sl else 1
-                        try: sl = int(sl)
-                        except: sl = 1
-
-                        # --- ĐÃ XÓA BỎ ĐOẠN XỬ LÝ NGÀY THÁNG Ở ĐÂY ---
-
-                        # 3. Tình trạng
-                        col_tt = find_column(df, ['tình', 'trạng'])
-                        raw_status = row.get(col_tt) if col_tt else None
-                        
-                        db_status = 'binh_thuong'
-                        db_status_other = ''
-                        if pd.notna(raw_status):
-                            txt = str(raw_status).lower()
-                            # Ưu tiên Bình thường
-                            if any(k in txt for k in ['bình thường', 'tốt', 'mới', 'ok']):
-                                db_status = 'binh_thuong'
-                            # Check Hư hỏng
-                            elif any(k in txt for k in ['hư', 'hỏng', 'lỗi', 'vỡ']):
-                                db_status = 'hu_hong'
-                            # Còn lại là Khác
-                            else:
-                                db_status = 'khac'; db_status_other = str(raw_status).strip()
-
-                        # 4. Ghi chú
-                        col_gc = find_column(df, ['ghi', 'chú'])
-                        ghi_chu = row.get(col_gc) if col_gc else ''
-
-                        # TẠO DÒNG DỮ LIỆU (KHÔNG TRUYỀN NGÀY VÀO ITEM NỮA)
-                        LoanItem.objects.create(
-                            loan=loan,
-                            ten_tai_san=ten,
-                            don_vi_tinh=dvt,
-                            so_luong=sl,
-                            # ngay_muon=... (ĐÃ XÓA)
-                            # ngay_tra=...  (ĐÃ XÓA)
-                            tinh_trang=db_status,
-                            tinh_trang_khac=db_status_other,
-                            ghi_chu=ghi_chu
-                        )
-                except Exception as e:
-                    messages.warning(request, f"Lỗi Excel: {e}")
+            import_excel_items(request, loan)
 
             
             # --- 3. XỬ LÝ FORMSET ---
@@ -502,9 +328,8 @@ def create_loan(request):
                     obj.delete()
 
             # --- 4. XỬ LÝ ẢNH ---
-            files = request.FILES.getlist('photos')
-            for f in files:
-                LoanImage.objects.create(loan=loan, image=f, image_type='borrow')
+            with posted_photos(request, 'photos') as photos:
+                save_photos(LoanImage, photos, loan=loan, image_type='borrow')
             detail_url = reverse('loan_detail', args=[loan.id])
             
             # Tạo nội dung HTML cho thông báo
@@ -552,71 +377,7 @@ def edit_loan(request, pk):
             # ==========================================
             # 1. XỬ LÝ IMPORT EXCEL (GỌN NHẸ - KHÔNG CẦN NGÀY THÁNG)
             # ==========================================
-            excel_file = request.FILES.get('excel_file')
-            if excel_file:
-                try:
-                    df = pd.read_excel(excel_file)
-                    df.columns = df.columns.str.strip().str.lower()
-                    
-                    # Hàm tìm tên cột linh hoạt
-                    def find_column(df, keywords):
-                        for col in df.columns:
-                            if all(key in col for key in keywords): return col
-                        return None
-
-                    for index, row in df.iterrows():
-                        # 1. Tên tài sản
-                        col_ten = find_column(df, ['tên']) 
-                        ten = row.get(col_ten) if col_ten else None
-                        if pd.isna(ten) or str(ten).strip() == '': continue
-
-                        # 2. ĐVT & SL
-                        col_dvt = find_column(df, ['đơn', 'vị']) or find_column(df, ['dvt'])
-                        dvt = row.get(col_dvt) if col_dvt else 'Cái'
-
-                        col_sl = find_column(df, ['số', 'lượng']) or find_column(df, ['sl'])
-                        sl = row.get(col_sl) if col_sl else 1
-                        try: sl = int(sl)
-                        except: sl = 1
-
-                        # --- ĐÃ XÓA BỎ ĐOẠN XỬ LÝ NGÀY THÁNG Ở ĐÂY ---
-
-                        # 3. Tình trạng
-                        col_tt = find_column(df, ['tình', 'trạng'])
-                        raw_status = row.get(col_tt) if col_tt else None
-                        
-                        db_status = 'binh_thuong'
-                        db_status_other = ''
-                        if pd.notna(raw_status):
-                            txt = str(raw_status).lower()
-                            # Ưu tiên Bình thường
-                            if any(k in txt for k in ['bình thường', 'tốt', 'mới', 'ok']):
-                                db_status = 'binh_thuong'
-                            # Check Hư hỏng
-                            elif any(k in txt for k in ['hư', 'hỏng', 'lỗi', 'vỡ']):
-                                db_status = 'hu_hong'
-                            # Còn lại là Khác
-                            else:
-                                db_status = 'khac'; db_status_other = str(raw_status).strip()
-
-                        # 4. Ghi chú
-                        col_gc = find_column(df, ['ghi', 'chú'])
-                        ghi_chu = row.get(col_gc) if col_gc else ''
-
-                        # TẠO DÒNG DỮ LIỆU (KHÔNG TRUYỀN NGÀY VÀO ITEM NỮA)
-                        LoanItem.objects.create(
-                            loan=loan,
-                            ten_tai_san=ten,
-                            don_vi_tinh=dvt,
-                            so_luong=sl,
-                            # ngay_muon=... (ĐÃ XÓA)
-                            # ngay_tra=...  (ĐÃ XÓA)
-                            tinh_trang=db_status,
-                            tinh_trang_khac=db_status_other,
-                            ghi_chu=ghi_chu
-                        )
-                except Exception as e:
-                    messages.warning(request, f"Lỗi Excel: {e}")
+            import_excel_items(request, loan)
             
             # Xử lý Formset
             if item_formset.is_valid():
@@ -633,9 +394,8 @@ def edit_loan(request, pk):
                 LoanImage.objects.filter(id__in=delete_ids, loan=loan).delete()
             
             # Thêm ảnh mới
-            files = request.FILES.getlist('photos')
-            for f in files:
-                LoanImage.objects.create(loan=loan, image=f, image_type='borrow')
+            with posted_photos(request, 'photos') as photos:
+                save_photos(LoanImage, photos, loan=loan, image_type='borrow')
 
             messages.success(request, "Đã cập nhật phiếu thành công!")
             return redirect('loan_detail', pk=loan.pk)
@@ -654,60 +414,23 @@ def edit_loan(request, pk):
 
 @login_required
 def loan_list(request):
-    # 1. Lấy danh sách gốc (Sắp xếp mới nhất trước)
-    loans = LoanSlip.objects.all().order_by('-id')
+    # Bộ lọc + sắp xếp dùng chung với file tải xuống (filters.filter_slip_list)
+    loans, sort_by, current = filter_slip_list(
+        LoanSlip.objects.all(), request.GET, LoanSlip.LIST_SORT_FIELDS
+    )
+
+    # Phân trang theo con trỏ (sort + id)
+    page = keyset_paginate(
+        loans, sort_by,
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
 
-    # 2. --- XỬ LÝ BỘ LỌC ---
-    
-    # A. Tìm kiếm từ khóa
-    search_query = request.GET.get('q', '')
-    if search_query:
-        loans = loans.filter(
-            Q(id__icontains=search_query) |
-            Q(nguoi_muon__icontains=search_query) |
-            Q(ma_nhan_vien__icontains=search_query)
-        )
-
-    # B. Lọc theo Trạng thái
-    status_filter = request.GET.get('status', '')
-    if status_filter:
-        loans = loans.filter(status=status_filter)
-
-    # C. Lọc theo Phòng ban
-    dept_filter = request.GET.get('dept', '')
-    if dept_filter:
-        loans = loans.filter(phong_ban__icontains=dept_filter)
-
-    # D. LỌC THEO NGÀY TẠO (CẬP NHẬT MỚI)
-    date_from = request.GET.get('date_from') # Từ ngày
-    date_to = request.GET.get('date_to')     # Đến ngày
-
-    if date_from:
-        # __date__gte: Lớn hơn hoặc bằng ngày này
-        loans = loans.filter(ngay_tao__date__gte=date_from)
-    
-    if date_to:
-        # __date__lte: Nhỏ hơn hoặc bằng ngày này
-        loans = loans.filter(ngay_tao__date__lte=date_to)
-
-    # 3. Xử lý Sắp xếp (Giữ nguyên code cũ)
-    sort_by = request.GET.get('sort', '-id')
-    valid_sort_fields = ['id', 'nguoi_muon', 'phong_ban', 'ngay_tao', 'ngay_tra_du_kien', 'status']
-    clean_sort = sort_by.lstrip('-')
-    if clean_sort in valid_sort_fields:
-        loans = loans.order_by(sort_by)
-
-    # 4. Context
     context = {
-        'loans': loans,
+        'loans': page,
+        'page': page,
         'status_choices': LoanSlip.STATUS_CHOICES,
-        # Trả lại giá trị đã nhập để hiển thị trên ô input
-        'current_status': status_filter,
-        'current_search': search_query,
-        'current_dept': dept_filter,
-        'current_date_from': date_from,
-        'current_date_to': date_to,
-        'current_sort': sort_by
+        'bulk_actions': bulk_actions('loan', request.user),
+        **current,  # trả lại giá trị đã nhập để hiển thị trên ô input
     }
     return render(request, 'warehouse/loan_list.html', context)
 
@@ -716,144 +439,10 @@ def loan_detail(request, pk):
     loan = get_object_or_404(LoanSlip, pk=pk)
     return render(request, 'warehouse/loan_detail.html', {'loan': loan})
 
-# --- HÀM DUYỆT ĐƠN (SỬA LỖI LOGIC) ---
+# --- HÀM DUYỆT ĐƠN (bảng quy trình trong workflow.py) ---
 @login_required
 def loan_action(request, pk, action):
-    loan = get_object_or_404(LoanSlip, pk=pk)
-    user = request.user
-    user_email = [loan.email]
-    
-    # Lấy email nhóm
-    giam_doc_emails = get_emails_by_group('GiamDoc')
-    thu_kho_emails = get_emails_by_group('ThuKho')
-    truong_phong_emails = get_emails_by_group('TruongPhong')
-    
-    recipients = []
-    msg = ""
-    history_action = ""
-
-    # Hàm check quyền
-    def check_perm(group_name):
-        return user.groups.filter(name=group_name).exists() or user.is_superuser
-
-    # 1. Gửi duyệt
-    if action == 'send':
-        if user != loan.created_by and not user.is_superuser:
-            messages.error(request, "Không có quyền gửi!")
-            return redirect('loan_detail', pk=pk)
-        
-        loan.status = 'dept_pending'
-        loan.ngay_gui = timezone.now()
-        history_action = "Gửi duyệt"
-        recipients = truong_phong_emails
-        msg = "Vui lòng duyệt phiếu."
-
-    # 2. TP Duyệt
-    elif action == 'dept_approve':
-        if not check_perm('TruongPhong'):
-            messages.error(request, "Cần quyền Trưởng phòng!")
-            return redirect('loan_detail', pk=pk)
-            
-        loan.status = 'director_pending'
-        loan.user_truong_phong = user
-        loan.ngay_truong_phong_duyet = timezone.now()
-        history_action = "Trưởng phòng Duyệt"
-        recipients = giam_doc_emails
-        msg = "Trưởng phòng đã duyệt. Xin Giám đốc phê duyệt."
-
-    # 3. GĐ Duyệt
-    elif action == 'director_approve':
-        if not check_perm('GiamDoc'):
-            messages.error(request, "Cần quyền Giám đốc!")
-            return redirect('loan_detail', pk=pk)
-            
-        loan.status = 'warehouse_pending'
-        loan.user_giam_doc = user
-        loan.ngay_giam_doc_duyet = timezone.now()
-        history_action = "Giám đốc Duyệt"
-        recipients = thu_kho_emails
-        msg = "Giám đốc đã duyệt. Chuẩn bị xuất kho."
-
-    # 4. Kho xuất
-    elif action == 'warehouse_export':
-        if not check_perm('ThuKho'):
-            messages.error(request, "Cần quyền Thủ kho!")
-            return redirect('loan_detail', pk=pk)
-            
-        loan.status = 'borrowing'
-        loan.user_thu_kho_xuat = user
-        loan.ngay_kho_xac_nhan_muon = timezone.now()
-        history_action = "Kho Xuất hàng"
-        recipients = user_email
-        msg = "Đã xuất kho. Bạn đã nhận bàn giao."
-
-    # 5. Trả hàng (Fallback)
-    elif action == 'user_return':
-        # Lưu ý: Thường dùng view return_loan, đây là dự phòng
-        if user != loan.created_by and not check_perm('ThuKho'):
-             messages.error(request, "Không có quyền trả!")
-             return redirect('loan_detail', pk=pk)
-
-        loan.status = 'returning'
-        loan.ngay_tra_thuc_te = timezone.now()
-        loan.user_nguoi_tra = user
-        history_action = f"Yêu cầu Trả hàng ({user.username})"
-        recipients = thu_kho_emails
-        msg = "Người dùng báo trả hàng."
-
-    # 6. Kho nhận lại
-    elif action == 'warehouse_confirm':
-        if not check_perm('ThuKho'):
-            messages.error(request, "Cần quyền Thủ kho!")
-            return redirect('loan_detail', pk=pk)
-            
-        loan.status = 'returned'
-        loan.user_thu_kho_nhap = user
-        loan.ngay_kho_xac_nhan_tra = timezone.now()
-        
-        # Bổ sung nếu bước trước chưa lưu ngày trả
-        if not loan.ngay_tra_thuc_te:
-            loan.ngay_tra_thuc_te = timezone.now()
-            
-        history_action = "Kho xác nhận Đã nhận"
-        recipients = user_email
-        msg = "Đã hoàn tất trả hàng."
-
-    # 7. Từ chối
-    elif action == 'reject':
-        # Check quyền từ chối tùy bước (TP chỉ từ chối khi đang chờ TP...)
-        can_reject = False
-        if loan.status == 'dept_pending' and check_perm('TruongPhong'): can_reject = True
-        elif loan.status == 'director_pending' and check_perm('GiamDoc'): can_reject = True
-        
-        if not can_reject and not user.is_superuser:
-             messages.error(request, "Không có quyền từ chối lúc này!")
-             return redirect('loan_detail', pk=pk)
-
-        loan.status = 'rejected'
-        loan.ngay_tu_choi = timezone.now()
-        history_action = f"Từ chối"
-        recipients = user_email
-        msg = "Phiếu bị từ chối."
-
-    loan.save()
-    
-    # Ghi nhật ký
-    if history_action:
-        LoanHistory.objects.create(
-            loan=loan, user=user, action=history_action,
-            note=f"Trạng thái: {loan.get_status_display()}"
-        )
-    
-    # Gửi mail
-    if recipients:
-        try:
-            send_loan_email(request, loan, f"[Thông báo] Phiếu #{loan.id}", msg, recipients)
-        except Exception as e:
-            print(f"Lỗi gửi mail: {e}")
-        
-    messages.success(request, f"Đã cập nhật trạng thái: {loan.get_status_display()}")
-    return redirect('loan_detail', pk=pk)
+    return _slip_action(request, 'loan', pk, action)
 
 @login_required
 def return_loan(request, pk):
@@ -865,9 +454,8 @@ def return_loan(request, pk):
     if request.method == 'POST':
         form = ReturnLoanForm(request.POST, request.FILES)
         if form.is_valid():
-            files = request.FILES.getlist('return_images')
-            for f in files:
-                LoanImage.objects.create(loan=loan, image=f, image_type='return')
+            with posted_photos(request, 'return_images') as photos:
+                save_photos(LoanImage, photos, loan=loan, image_type='return')
             
             loan.status = 'returning'
             loan.ngay_tra_thuc_te = timezone.now()
@@ -894,15 +482,7 @@ def return_loan(request, pk):
 
 def export_loan_pdf(request, pk):
     loan = get_object_or_404(LoanSlip, pk=pk)
-    html_string = render_to_string('warehouse/pdf/loan_template.html', {
-        'loan': loan,
-        'items': loan.items.all(),
-        'request': request
-    })
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename=phieu_{pk}.pdf'
-    HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(response)
-    return response
+    return _slip_pdf_response(request, loan)
 
 @login_required
 def profile(request):
@@ -945,45 +525,7 @@ def create_purchase(request):
             )
 
             # 2. XỬ LÝ IMPORT EXCEL
-            excel_file = request.FILES.get('excel_file')
-            if excel_file:
-                try:
-                    df = pd.read_excel(excel_file)
-                    df.columns = df.columns.str.strip().str.lower()
-                    
-                    # Hàm tìm cột
-                    def find_col(df, keywords):
-                        for col in df.columns:
-                            if all(key in col for key in keywords): return col
-                        return None
-
-                    for index, row in df.iterrows():
-                        # Tìm tên hàng
-                        col_ten = find_col(df, ['tên']) 
-                        ten = row.get(col_ten) if col_ten else None
-                        if pd.isna(ten) or str(ten).strip() == '': continue
-
-                        # ĐVT & SL
-                        col_dvt = find_col(df, ['đơn', 'vị', 'tính']) or find_col(df, ['dvt'])
-                        dvt = row.get(col_dvt) if col_dvt else 'Cái'
-
-                        col_sl = find_col(df, ['số', 'lượng']) or find_col(df, ['sl'])
-                        sl = row.get(col_sl) if col_sl else 1
-                        try: sl = int(sl)
-                        except: sl = 1
-
-                        col_gc = find_col(df, ['ghi', 'chú'])
-                        ghi_chu = row.get(col_gc) if col_gc else ''
-
-                        PurchaseItem.objects.create(
-                            slip=slip,
-                            ten_hang_hoa=ten,
-                            don_vi_tinh=dvt,
-                            so_luong=sl,
-                            ghi_chu=ghi_chu
-                        )
-                except Exception as e:
-                    messages.warning(request, f"Lỗi Excel: {e}")
+            import_excel_items(request, slip)
 
             # 3. LƯU FORMSET
             if item_formset.is_valid():
@@ -994,9 +536,8 @@ def create_purchase(request):
                 for obj in item_formset.deleted_objects: obj.delete()
 
             # 4. LƯU ẢNH
-            files = request.FILES.getlist('photos')
-            for f in files:
-                PurchaseImage.objects.create(slip=slip, image=f)
+            with posted_photos(request, 'photos') as photos:
+                save_photos(PurchaseImage, photos, slip=slip)
 
             detail_url = reverse('purchase_detail', args=[slip.id])
             
@@ -1048,40 +589,7 @@ def edit_purchase(request, pk):
             )
 
             # 3. XỬ LÝ IMPORT EXCEL
-            excel_file = request.FILES.get('excel_file')
-            if excel_file:
-                try:
-                    df = pd.read_excel(excel_file)
-                    df.columns = df.columns.str.strip().str.lower()
-                    
-                    def find_col(df, keys):
-                        for c in df.columns:
-                            if all(k in c for k in keys): return c
-                        return None
-
-                    for index, row in df.iterrows():
-                        # Tên hàng
-                        col_ten = find_col(df, ['tên']) 
-                        ten = row.get(col_ten)
-                        if pd.isna(ten) or str(ten).strip() == '': continue
-
-                        # ĐVT & SL
-                        col_dvt = find_col(df, ['đơn', 'vị', 'tính']) or find_col(df, ['dvt'])
-                        dvt = row.get(col_dvt) or 'Cái'
-
-                        col_sl = find_col(df, ['số', 'lượng']) or find_col(df, ['sl'])
-                        sl = row.get(col_sl) or 1
-                        try: sl = int(sl)
-                        except: sl = 1
-
-                        col_gc = find_col(df, ['ghi', 'chú'])
-                        ghi_chu = row.get(col_gc) or ''
-
-                        PurchaseItem.objects.create(
-                            slip=slip, ten_hang_hoa=ten, don_vi_tinh=dvt, so_luong=sl, ghi_chu=ghi_chu
-                        )
-                except Exception as e:
-                    messages.warning(request, f"Lỗi Excel: {e}")
+            import_excel_items(request, slip)
 
             # 4. Xử lý Formset (Lưu sửa / Xóa dòng)
             if item_formset.is_valid():
@@ -1098,9 +606,8 @@ def edit_purchase(request, pk):
                 PurchaseImage.objects.filter(id__in=delete_ids, slip=slip).delete()
 
             # 6. Thêm ảnh mới
-            files = request.FILES.getlist('photos')
-            for f in files:
-                PurchaseImage.objects.create(slip=slip, image=f)
+            with posted_photos(request, 'photos') as photos:
+                save_photos(PurchaseImage, photos, slip=slip)
 
             messages.success(request, "Đã cập nhật phiếu mua hàng thành công!")
             return redirect('purchase_detail', pk=slip.id)
@@ -1117,145 +624,208 @@ def edit_purchase(request, pk):
 
 @login_required
 def purchase_action(request, pk, action):
-    slip = get_object_or_404(PurchaseSlip, pk=pk)
-    user = request.user
-    note = request.POST.get('note', '') 
-    
-    def check_perm(group_name): 
-        return user.groups.filter(name=group_name).exists() or user.is_superuser
-
-    history_action = ""
-    mail_subject = ""
-    mail_message = ""
-    mail_recipients = []
-
-    # --- 1. GỬI DUYỆT ---
-    if action == 'send':
-        if slip.status not in ['draft', 'rejected']:
-            messages.error(request, "Trạng thái không hợp lệ.")
-            return redirect('purchase_detail', pk=pk)
-            
-        slip.status = 'dept_pending'
-        slip.ngay_gui = timezone.now()
-        history_action = "Gửi yêu cầu duyệt"
-        
-        mail_subject = f"[DUYỆT MUA] Phiếu #{slip.id:04d} chờ Trưởng phòng duyệt"
-        mail_message = f"Chào Trưởng phòng,\nNhân viên {slip.nguoi_de_xuat} vừa gửi yêu cầu mua hàng.\nLý do: {slip.ly_do}"
-        
-        users = User.objects.filter(groups__name='TruongPhong')
-        mail_recipients = [u.email for u in users if u.email]
-
-    # --- 2. TRƯỞNG PHÒNG DUYỆT ---
-    elif action == 'dept_approve':
-        if not check_perm('TruongPhong'):
-            messages.error(request, "Bạn không có quyền Trưởng phòng!")
-            return redirect('purchase_detail', pk=pk)
-            
-        slip.status = 'director_pending'
-        slip.user_phu_trach = user
-        slip.ngay_phu_trach_duyet = timezone.now()
-        history_action = "Trưởng phòng đã duyệt"
-        
-        mail_subject = f"[DUYỆT MUA] Phiếu #{slip.id:04d} chờ Giám đốc duyệt"
-        mail_message = f"Chào Giám đốc,\nTrưởng phòng {user.last_name} {user.first_name} đã duyệt phiếu mua hàng #{slip.id:04d}.\nXin vui lòng phê duyệt cuối."
-        
-        users = User.objects.filter(groups__name='GiamDoc')
-        mail_recipients = [u.email for u in users if u.email]
-
-    # --- 3. GIÁM ĐỐC DUYỆT ---
-    elif action == 'director_approve':
-        if not check_perm('GiamDoc'):
-            messages.error(request, "Bạn không có quyền Giám đốc!")
-            return redirect('purchase_detail', pk=pk)
-            
-        slip.status = 'approved'
-        slip.user_giam_doc = user
-        slip.ngay_giam_doc_duyet = timezone.now()
-        history_action = "Giám đốc đã duyệt (Hoàn tất)"
-        
-        mail_subject = f"[THÀNH CÔNG] Phiếu mua #{slip.id:04d} đã được duyệt"
-        mail_message = f"Xin chúc mừng {slip.nguoi_de_xuat},\nYêu cầu mua hàng của bạn đã được Ban Giám Đốc phê duyệt."
-        
-        if slip.created_by and slip.created_by.email:
-            mail_recipients = [slip.created_by.email]
-
-    # --- 4. TỪ CHỐI ---
-    elif action == 'reject':
-        if not (check_perm('TruongPhong') or check_perm('GiamDoc')):
-            messages.error(request, "Bạn không có quyền từ chối!")
-            return redirect('purchase_detail', pk=pk)
-            
-        slip.status = 'rejected'
-        slip.ngay_tu_choi = timezone.now()
-        history_action = f"Đã từ chối bởi {user.last_name} {user.first_name}"
-        
-        mail_subject = f"[TỪ CHỐI] Phiếu mua #{slip.id:04d} bị từ chối"
-        mail_message = f"Chào {slip.nguoi_de_xuat},\nRất tiếc, phiếu #{slip.id:04d} đã bị từ chối.\nLý do/Ghi chú: {note if note else 'Không có'}"
-        
-        if slip.created_by and slip.created_by.email:
-            mail_recipients = [slip.created_by.email]
-
-    # === LƯU & LOG & GỬI MAIL ===
-    slip.save()
-    
-    if history_action:
-        PurchaseHistory.objects.create(slip=slip, user=user, action=history_action, note=note)
-
-    if mail_recipients:
-        # Gọi hàm từ utils.py
-        send_purchase_email(request, slip, mail_subject, mail_message, mail_recipients)
-
-    messages.success(request, f"Đã cập nhật trạng thái: {slip.get_status_display()}")
-    return redirect('purchase_detail', pk=pk)
+    return _slip_action(request, 'purchase', pk, action)
 
 # 1. DANH SÁCH MUA HÀNG (CÓ LỌC)
 @login_required
 def purchase_list(request):
-    slips = PurchaseSlip.objects.all().order_by('-id')
-
-    # --- BỘ LỌC ---
-    search_query = request.GET.get('q', '')
-    if search_query:
-        slips = slips.filter(
-            Q(id__icontains=search_query) | 
-            Q(nguoi_de_xuat__icontains=search_query) | 
-            Q(ma_nhan_vien__icontains=search_query) |
-            Q(nha_cung_cap__icontains=search_query)
-        )
-    
-    status = request.GET.get('status', '')
-    if status: slips = slips.filter(status=status)
+    slips, sort_by, current = filter_slip_list(
+        PurchaseSlip.objects.all(), request.GET, PurchaseSlip.LIST_SORT_FIELDS
+    )
 
-    dept = request.GET.get('dept', '')
-    if dept: slips = slips.filter(phong_ban__icontains=dept)
-
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
-    if date_from: slips = slips.filter(ngay_tao__date__gte=date_from)
-    if date_to: slips = slips.filter(ngay_tao__date__lte=date_to)
-
-    # --- SẮP XẾP ---
-    sort_by = request.GET.get('sort', '-id')
-    valid_sort = ['id', 'nguoi_de_xuat', 'phong_ban', 'ngay_tao', 'status', 'nha_cung_cap']
-    if sort_by.lstrip('-') in valid_sort:
-        slips = slips.order_by(sort_by)
+    # --- PHÂN TRANG (CON TRỎ) ---
+    page = keyset_paginate(
+        slips, sort_by,
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
 
     context = {
-        'slips': slips,
+        'slips': page,
+        'page': page,
         'status_choices': PurchaseSlip.STATUS_CHOICES,
-        'current_search': search_query, 'current_status': status,
-        'current_dept': dept, 'current_sort': sort_by,
-        'current_date_from': date_from, 'current_date_to': date_to,
+        'bulk_actions': bulk_actions('purchase', request.user),
+        **current,
     }
     return render(request, 'warehouse/purchase_list.html', context)
     
 # 3. XUẤT PDF
 def export_purchase_pdf(request, pk):
     slip = get_object_or_404(PurchaseSlip, pk=pk)
-    html_string = render_to_string('warehouse/pdf/purchase_template.html', {
-        'slip': slip, 'items': slip.items.all(), 'request': request
-    })
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename=phieu_mua_{pk}.pdf'
-    HTML(string=html_string, base_url=request.build_absolute_uri()).write_pdf(response)
+    return _slip_pdf_response(request, slip)
+
+
+# ============================================
+# TẠO PDF CHẠY NỀN (xem pdf_jobs.py)
+# ============================================
+
+def _pdf_file_response(data, kind, pk):
+    response = HttpResponse(data, content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename={PDF_FILENAMES[kind].format(pk=pk)}'
     return response
+
+def _slip_pdf_response(request, slip):
+    """Trả PDF ngay nếu có sẵn / tạo kịp trong PDF_RENDER_BUDGET, quá hạn thì chuyển sang trang chờ"""
+    kind = slip._meta.model_name
+    version = slip_pdf_version(slip)
+    data = read_cached_pdf(kind, slip.pk, version)
+    if data is None:
+        job, future = submit_slip_pdf(slip, request, request.user, version)
+        data = job_pdf(job) if future is None else wait_for_pdf(future)
+        if data is None:
+            return redirect('pdf_job_page', job_id=job.pk)
+    return _pdf_file_response(data, kind, slip.pk)
+
+def _pdf_job_json(job):
+    data = {
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'error': job.error,
+        'status_url': reverse('api_pdf_job', args=[job.id]),
+    }
+    if job.status == 'done':
+        data['result_url'] = reverse('pdf_job_result', args=[job.id])
+    return data
+
+@login_required
+@require_POST
+def api_pdf_render(request, kind, pk):
+    """Đưa việc tạo PDF của phiếu vào hàng đợi, trả về job để theo dõi"""
+    model = URL_KINDS.get(kind)
+    if model is None:
+        raise Http404
+    slip = get_object_or_404(model, pk=pk)
+    job, _ = submit_slip_pdf(slip, request, request.user)
+    job.refresh_from_db()
+    return JsonResponse(_pdf_job_json(job), status=202 if job.status in ('pending', 'running') else 200)
+
+@login_required
+def api_pdf_job(request, job_id):
+    job = get_object_or_404(PdfJob, pk=job_id)
+    return JsonResponse(_pdf_job_json(job))
+
+@login_required
+def pdf_job_page(request, job_id):
+    """Trang chờ khi PDF tạo lâu hơn ngân sách thời gian, tự chuyển sang file khi xong"""
+    job = get_object_or_404(PdfJob, pk=job_id)
+    return render(request, 'warehouse/pdf_pending.html', {'job': job, 'job_json': _pdf_job_json(job)})
+
+@login_required
+def pdf_job_result(request, job_id):
+    job = get_object_or_404(PdfJob, pk=job_id)
+    data = job_pdf(job)
+    if data is None:
+        if job.status == 'done':
+            # File đã bị xóa khỏi cache (phiếu vừa sửa) -> tạo lại bản mới
+            return redirect(f'export_{MODEL_URL_KINDS[job.kind]}_pdf', pk=job.slip_id)
+        return redirect('pdf_job_page', job_id=job.pk)
+    return _pdf_file_response(data, job.kind, job.slip_id)
+
+@login_required
+@require_POST
+def api_import_preview(request, kind):
+    """Đọc thử file Excel (kết quả được cache theo nội dung file) -> token để lưu phiếu không phải upload lại"""
+    model = URL_KINDS.get(kind)
+    excel_file = request.FILES.get('excel_file')
+    if model is None or excel_file is None:
+        raise Http404
+    try:
+        summary = build_preview(SLIP_ITEM_MODELS[model._meta.model_name][1], excel_file)
+    except Exception as e:
+        return JsonResponse({'error': f"Lỗi đọc file Excel: {e}"}, status=400)
+    return JsonResponse({key: value for key, value in summary.items() if key != 'chunks'})
+
+@login_required
+def api_import_job(request, job_id):
+    """Tiến độ import Excel chạy nền (trang tạo/sửa phiếu hỏi định kỳ)"""
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'file_name': job.file_name,
+        'rows_parsed': job.rows_parsed,
+        'rows_inserted': job.rows_inserted,
+        'rows_rejected': job.rows_rejected,
+        'row_errors': job.row_errors,
+        'error': job.error,
+    })
+
+
+# ============================================
+# TẢI ẢNH THEO TỪNG ĐOẠN (TIẾP TỤC ĐƯỢC KHI MẤT MẠNG)
+# ============================================
+
+def _upload_state(upload):
+    return {
+        'id': str(upload.pk), 'offset': upload.received, 'size': upload.size,
+        'complete': upload.status == 'complete', 'chunk_size': UPLOAD_CHUNK_SIZE,
+    }
+
+@login_required
+@require_POST
+def api_upload_start(request):
+    """Bắt đầu tải 1 ảnh: file_name, size -> id upload"""
+    try:
+        upload = start_upload(request.user, request.POST.get('file_name', ''), int(request.POST.get('size') or 0))
+    except (UploadError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_state(upload), status=201)
+
+@login_required
+def api_upload_chunk(request, upload_id):
+    """GET: đã nhận bao nhiêu byte. POST (header Upload-Offset, body = bytes): ghi tiếp 1 đoạn"""
+    upload = get_object_or_404(PhotoUpload, pk=upload_id, user=request.user)
+    if request.method == 'GET':
+        return JsonResponse(_upload_state(upload))
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+    try:
+        append_chunk(upload, int(request.headers.get('Upload-Offset', -1)), request.body)
+    except OffsetMismatch as e:
+        upload.received = e.offset
+        return JsonResponse(dict(_upload_state(upload), error=str(e)), status=409)
+    except (UploadError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_state(upload))
+
+@login_required
+@require_POST
+def api_upload_finish(request, upload_id):
+    """Đủ byte -> đánh dấu xong, form lưu phiếu gửi id này trong upload_ids"""
+    upload = get_object_or_404(PhotoUpload, pk=upload_id, user=request.user)
+    try:
+        finish_upload(upload)
+    except OffsetMismatch as e:
+        upload.received = e.offset
+        return JsonResponse(dict(_upload_state(upload), error=str(e)), status=409)
+    except UploadError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_upload_state(upload))
+
+
+# ============================================
+# TẢI DANH SÁCH PHIẾU / VẬT TƯ (CSV, XLSX)
+# ============================================
+
+@login_required
+def download_slip_list(request, kind):
+    """Tải danh sách đang lọc trên trang danh sách: ?scope=slips|items&format=csv|xlsx + các tham số lọc"""
+    spec = EXPORTS.get(kind)
+    if spec is None:
+        raise Http404
+    model = spec['slip_model']
+    slips, sort_by, _ = filter_slip_list(model.objects.all(), request.GET, model.LIST_SORT_FIELDS)
+    scope = 'items' if request.GET.get('scope') == 'items' else 'slips'
+    if request.GET.get('format') == 'xlsx':
+        return xlsx_response(kind, scope, slips, sort_by)
+    return csv_response(kind, scope, slips, sort_by)
+
+# ============================================
+# FILE MEDIA (ẢNH PHIẾU, CHỮ KÝ) - CHỈ NGƯỜI ĐÃ ĐĂNG NHẬP
+# ============================================
+
+@login_required
+def serve_media(request, path):
+    """Thay django.views.static.serve: ETag/304, cache dài cho ảnh phiếu, Range, sendfile qua proxy"""
+    return media_response(request, path)
@@ -0,0 +1,469 @@
+from collections import Counter
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import LoanSlip, LoanHistory, PurchaseSlip, PurchaseHistory, ExportSlip, ExportHistory
+from .pdf_cache import invalidate_slip_pdf
+from .roles import group_names
+from .utils import get_emails_by_group, send_loan_email, send_purchase_email, send_export_email, send_summary_email
+
+# Quy trình duyệt phiếu khai báo bằng bảng (thay cho chuỗi if/elif trong từng view):
+# - Mỗi thao tác: trạng thái được phép đi từ ('from'), trạng thái mới ('to'), nhóm được làm ('groups',
+#   hoặc dict trạng thái -> nhóm khi quyền phụ thuộc bước), cột người duyệt / cột ngày, nội dung nhật ký và mail.
+# - Đổi trạng thái bằng 1 câu UPDATE ... WHERE id = ? AND status IN (...) chỉ ghi các cột thay đổi:
+#   2 người bấm cùng lúc thì chỉ 1 người cập nhật được dòng, người còn lại nhận TransitionConflict
+#   -> không ghi nhật ký / xếp mail 2 lần.
+# - Thao tác có 'bulk' (nhãn nút) làm được hàng loạt từ trang danh sách (apply_bulk): UPDATE theo tập,
+#   nhật ký bằng 1 bulk_create, mỗi người nhận 1 mail tổng hợp thay vì 1 mail / phiếu.
+# - Hộp "Chờ tôi duyệt": trạng thái chờ = 'from' của các bước duyệt; số phiếu mỗi trạng thái giữ trong cache,
+#   mỗi lần chuyển trạng thái thì incr / decr sau khi commit -> badge trên menu không tốn query đếm.
+# - Chuỗi nhật ký / mail dùng str.format với slip, user, note, reason (= note hoặc 'Không có').
+CREATOR = 'creator'  # trong 'groups': người tạo phiếu cũng được làm
+BULK_LIMIT = getattr(settings, 'WORKFLOW_BULK_LIMIT', 500)  # số phiếu tối đa mỗi lần duyệt hàng loạt
+# Bộ đếm nằm trong cache 'default': LocMemCache thì mỗi worker giữ bản riêng, TTL ngắn để các worker
+# không lệch lâu; dùng cache chung (Redis / Memcached) thì số luôn khớp
+COUNTER_TTL = getattr(settings, 'INBOX_COUNTER_TTL', 300)
+INBOX_LIMIT = getattr(settings, 'INBOX_LIMIT', 200)  # số phiếu tối đa mỗi loại trên trang "Chờ tôi duyệt"
+
+WORKFLOWS = {
+    'loan': {
+        'model': LoanSlip,
+        'history_model': LoanHistory,
+        'history_fk': 'loan',
+        'history_note': 'Trạng thái: {status}',
+        'send_email': send_loan_email,
+        'label': 'phiếu mượn',
+        'subject': '[Thông báo] Phiếu #{slip.id}',
+        'transitions': {
+            'send': {
+                'from': ('draft', 'rejected'), 'to': 'dept_pending', 'groups': (CREATOR,),
+                'error': 'Không có quyền gửi!', 'stamps': ('ngay_gui',),
+                'history': 'Gửi duyệt', 'notify': 'group:TruongPhong', 'message': 'Vui lòng duyệt phiếu.',
+            },
+            'dept_approve': {
+                'from': ('dept_pending',), 'to': 'director_pending', 'groups': ('TruongPhong',),
+                'bulk': 'Trưởng phòng duyệt',  # nút duyệt hàng loạt ở trang danh sách
+                'error': 'Cần quyền Trưởng phòng!',
+                'approver': 'user_truong_phong', 'stamps': ('ngay_truong_phong_duyet',),
+                'history': 'Trưởng phòng Duyệt', 'notify': 'group:GiamDoc',
+                'message': 'Trưởng phòng đã duyệt. Xin Giám đốc phê duyệt.',
+            },
+            'director_approve': {
+                'from': ('director_pending',), 'to': 'warehouse_pending', 'groups': ('GiamDoc',),
+                'bulk': 'Giám đốc duyệt',
+                'error': 'Cần quyền Giám đốc!',
+                'approver': 'user_giam_doc', 'stamps': ('ngay_giam_doc_duyet',),
+                'history': 'Giám đốc Duyệt', 'notify': 'group:ThuKho',
+                'message': 'Giám đốc đã duyệt. Chuẩn bị xuất kho.',
+            },
+            'warehouse_export': {
+                'from': ('warehouse_pending',), 'to': 'borrowing', 'groups': ('ThuKho',),
+                'bulk': 'Xuất kho',
+                'error': 'Cần quyền Thủ kho!',
+                'approver': 'user_thu_kho_xuat', 'stamps': ('ngay_kho_xac_nhan_muon',),
+                'history': 'Kho Xuất hàng', 'notify': 'email', 'message': 'Đã xuất kho. Bạn đã nhận bàn giao.',
+            },
+            # Thường dùng view return_loan (kèm ảnh), đây là dự phòng
+            'user_return': {
+                'from': ('borrowing',), 'to': 'returning', 'groups': (CREATOR, 'ThuKho'),
+                'error': 'Không có quyền trả!',
+                'approver': 'user_nguoi_tra', 'stamps': ('ngay_tra_thuc_te',),
+                'history': 'Yêu cầu Trả hàng ({user.username})', 'notify': 'group:ThuKho',
+                'message': 'Người dùng báo trả hàng.',
+            },
+            'warehouse_confirm': {
+                'from': ('returning',), 'to': 'returned', 'groups': ('ThuKho',),
+                'bulk': 'Xác nhận đã nhận',
+                'error': 'Cần quyền Thủ kho!',
+                'approver': 'user_thu_kho_nhap', 'stamps': ('ngay_kho_xac_nhan_tra',),
+                'stamps_if_empty': ('ngay_tra_thuc_te',),  # bước trả hàng trước chưa lưu ngày trả
+                'history': 'Kho xác nhận Đã nhận', 'notify': 'email', 'message': 'Đã hoàn tất trả hàng.',
+            },
+            # TP chỉ từ chối khi đang chờ TP, GĐ chỉ khi đang chờ GĐ
+            'reject': {
+                'from': ('dept_pending', 'director_pending'), 'to': 'rejected',
+                'bulk': 'Từ chối',
+                'groups': {'dept_pending': ('TruongPhong',), 'director_pending': ('GiamDoc',)},
+                'error': 'Không có quyền từ chối lúc này!', 'stamps': ('ngay_tu_choi',),
+                'history': 'Từ chối', 'notify': 'email', 'message': 'Phiếu bị từ chối.',
+            },
+        },
+    },
+    'purchase': {
+        'model': PurchaseSlip,
+        'history_model': PurchaseHistory,
+        'history_fk': 'slip',
+        'history_note': '{note}',
+        'send_email': send_purchase_email,
+        'label': 'phiếu mua',
+        'transitions': {
+            'send': {
+                'from': ('draft', 'rejected'), 'to': 'dept_pending', 'stamps': ('ngay_gui',),
+                'history': 'Gửi yêu cầu duyệt', 'notify': 'group:TruongPhong',
+                'subject': '[DUYỆT MUA] Phiếu #{slip.id:04d} chờ Trưởng phòng duyệt',
+                'message': 'Chào Trưởng phòng,\nNhân viên {slip.nguoi_de_xuat} vừa gửi yêu cầu mua hàng.\n'
+                           'Lý do: {slip.ly_do}',
+            },
+            'dept_approve': {
+                'from': ('dept_pending',), 'to': 'director_pending', 'groups': ('TruongPhong',),
+                'bulk': 'Trưởng phòng duyệt',
+                'error': 'Bạn không có quyền Trưởng phòng!',
+                'approver': 'user_phu_trach', 'stamps': ('ngay_phu_trach_duyet',),
+                'history': 'Trưởng phòng đã duyệt', 'notify': 'group:GiamDoc',
+                'subject': '[DUYỆT MUA] Phiếu #{slip.id:04d} chờ Giám đốc duyệt',
+                'message': 'Chào Giám đốc,\nTrưởng phòng {user.last_name} {user.first_name} đã duyệt phiếu mua hàng '
+                           '#{slip.id:04d}.\nXin vui lòng phê duyệt cuối.',
+            },
+            'director_approve': {
+                'from': ('director_pending',), 'to': 'approved', 'groups': ('GiamDoc',),
+                'bulk': 'Giám đốc duyệt',
+                'error': 'Bạn không có quyền Giám đốc!',
+                'approver': 'user_giam_doc', 'stamps': ('ngay_giam_doc_duyet',),
+                'history': 'Giám đốc đã duyệt (Hoàn tất)', 'notify': CREATOR,
+                'subject': '[THÀNH CÔNG] Phiếu mua #{slip.id:04d} đã được duyệt',
+                'message': 'Xin chúc mừng {slip.nguoi_de_xuat},\n'
+                           'Yêu cầu mua hàng của bạn đã được Ban Giám Đốc phê duyệt.',
+            },
+            'reject': {
+                'from': ('dept_pending', 'director_pending'), 'to': 'rejected', 'groups': ('TruongPhong', 'GiamDoc'),
+                'bulk': 'Từ chối',
+                'error': 'Bạn không có quyền từ chối!', 'stamps': ('ngay_tu_choi',),
+                'history': 'Đã từ chối bởi {user.last_name} {user.first_name}', 'notify': CREATOR,
+                'subject': '[TỪ CHỐI] Phiếu mua #{slip.id:04d} bị từ chối',
+                'message': 'Chào {slip.nguoi_de_xuat},\nRất tiếc, phiếu #{slip.id:04d} đã bị từ chối.\n'
+                           'Lý do/Ghi chú: {reason}',
+            },
+        },
+    },
+    'export': {
+        'model': ExportSlip,
+        'history_model': ExportHistory,
+        'history_fk': 'slip',
+        'history_note': '{note}',
+        'send_email': send_export_email,
+        'label': 'phiếu xuất',
+        'transitions': {
+            'send': {
+                'from': ('draft', 'rejected'), 'to': 'dept_pending', 'stamps': ('ngay_gui',),
+                'history': 'Gửi yêu cầu duyệt', 'notify': 'group:TruongPhong',
+                'subject': '[DUYỆT XUẤT] Phiếu #{slip.id:04d} chờ Trưởng phòng duyệt',
+                'message': 'Nhân viên {slip.nguoi_de_xuat} gửi yêu cầu xuất kho.\nLý do: {slip.ly_do}',
+            },
+            'dept_approve': {
+                'from': ('dept_pending',), 'to': 'warehouse_pending', 'groups': ('TruongPhong',),
+                'bulk': 'Trưởng phòng duyệt',
+                'error': 'Cần quyền Trưởng phòng!',
+                'approver': 'user_truong_phong', 'stamps': ('ngay_truong_phong_duyet',),
+                'history': 'Trưởng phòng đã duyệt', 'notify': 'group:ThuKho',
+                'subject': '[DUYỆT XUẤT] Phiếu #{slip.id:04d} chờ Thủ kho kiểm tra',
+                'message': 'Trưởng phòng đã duyệt phiếu #{slip.id:04d}.\nMời Thủ kho kiểm tra hàng hóa.',
+            },
+            'warehouse_approve': {
+                'from': ('warehouse_pending',), 'to': 'director_pending', 'groups': ('ThuKho',),
+                'bulk': 'Thủ kho duyệt (đủ hàng)',
+                'error': 'Cần quyền Thủ kho!',
+                'approver': 'user_thu_kho', 'stamps': ('ngay_thu_kho_duyet',),
+                'history': 'Thủ kho đã duyệt (Đủ hàng)', 'notify': 'group:GiamDoc',
+                'subject': '[DUYỆT XUẤT] Phiếu #{slip.id:04d} chờ Giám đốc duyệt',
+                'message': 'Thủ kho xác nhận đủ hàng cho phiếu #{slip.id:04d}.\nMời Giám đốc phê duyệt.',
+            },
+            'director_approve': {
+                'from': ('director_pending',), 'to': 'completed', 'groups': ('GiamDoc',),
+                'bulk': 'Giám đốc duyệt',
+                'error': 'Cần quyền Giám đốc!',
+                'approver': 'user_giam_doc', 'stamps': ('ngay_giam_doc_duyet',),
+                'history': 'Giám đốc đã duyệt (Hoàn tất)', 'notify': CREATOR,
+                'subject': '[THÀNH CÔNG] Phiếu xuất #{slip.id:04d} đã được duyệt',
+                'message': 'Phiếu xuất kho của bạn đã được phê duyệt đầy đủ các cấp.',
+            },
+            'reject': {
+                'from': ('dept_pending', 'warehouse_pending', 'director_pending'), 'to': 'rejected',
+                'bulk': 'Từ chối',
+                'groups': ('TruongPhong', 'ThuKho', 'GiamDoc'),
+                'error': 'Bạn không có quyền từ chối!', 'stamps': ('ngay_tu_choi',),
+                'history': 'Từ chối bởi {user.last_name} {user.first_name}', 'notify': CREATOR,
+                'subject': '[TỪ CHỐI] Phiếu xuất #{slip.id:04d} bị từ chối',
+                'message': 'Phiếu xuất kho đã bị từ chối.\nLý do: {reason}',
+            },
+        },
+    },
+}
+
+MODEL_KINDS = {workflow['model']: kind for kind, workflow in WORKFLOWS.items()}
+
+
+class TransitionError(Exception):
+    pass
+
+
+class TransitionConflict(TransitionError):
+    """Phiếu không còn ở trạng thái cho phép (người khác vừa duyệt / từ chối trước)"""
+
+    def __init__(self, slip):
+        super().__init__(f'Phiếu đã được xử lý trước đó (trạng thái hiện tại: {slip.get_status_display()}). '
+                         'Vui lòng tải lại trang.')
+        self.slip = slip
+
+
+def _state_access(transition, user):
+    """Trạng thái -> 'all' (mọi phiếu) / 'own' (chỉ phiếu mình tạo) / None"""
+    groups = transition.get('groups')
+    if groups is None or user.is_superuser:
+        return {state: 'all' for state in transition['from']}
+    user_groups = group_names(user)
+    access = {}
+    for state in transition['from']:
+        allowed = groups.get(state, ()) if isinstance(groups, dict) else groups
+        if any(group in user_groups for group in allowed if group != CREATOR):
+            access[state] = 'all'
+        elif CREATOR in allowed:
+            access[state] = 'own'
+        else:
+            access[state] = None
+    return access
+
+
+def allowed_states(kind, action, user, slip):
+    """Các trạng thái mà user được làm thao tác này trên phiếu (rỗng = không có quyền)"""
+    access = _state_access(WORKFLOWS[kind]['transitions'][action], user)
+    return tuple(state for state, scope in access.items()
+                 if scope == 'all' or (scope == 'own' and slip.created_by_id == user.pk))
+
+
+def bulk_actions(kind, user):
+    """Các thao tác duyệt hàng loạt user được làm ở loại phiếu này -> [(action, nhãn nút)]"""
+    result = []
+    for action, transition in WORKFLOWS[kind]['transitions'].items():
+        if transition.get('bulk') and 'all' in _state_access(transition, user).values():
+            result.append((action, transition['bulk']))
+    return result
+
+
+def _inbox_transitions(kind):
+    # Bước chờ duyệt = thao tác duyệt hàng loạt được, trừ từ chối
+    return [t for t in WORKFLOWS[kind]['transitions'].values() if t.get('bulk') and t['to'] != 'rejected']
+
+
+def pending_states(kind):
+    """Mọi trạng thái "đang chờ ai đó duyệt" của loại phiếu"""
+    return list(dict.fromkeys(state for t in _inbox_transitions(kind) for state in t['from']))
+
+
+def inbox_states(kind, user):
+    """Các trạng thái đang chờ chính user này duyệt (theo nhóm của user)"""
+    states = []
+    for transition in _inbox_transitions(kind):
+        states += [state for state, scope in _state_access(transition, user).items() if scope == 'all']
+    return list(dict.fromkeys(states))
+
+
+def _counter_key(kind, state):
+    return f'inbox:{kind}:{state}'
+
+
+def pending_counts(kind):
+    """Số phiếu theo từng trạng thái chờ duyệt; đọc từ cache, thiếu thì đếm lại bằng 1 câu GROUP BY"""
+    states = pending_states(kind)
+    keys = {_counter_key(kind, state): state for state in states}
+    cached = cache.get_many(keys)
+    # Số âm: lần đếm lại chen giữa commit và decr của _record_transition -> bỏ, đếm lại
+    negative = [key for key, count in cached.items() if count < 0]
+    if negative:
+        cache.delete_many(negative)
+    elif len(cached) == len(keys):
+        return {keys[key]: max(0, count) for key, count in cached.items()}
+    counts = dict.fromkeys(states, 0)
+    rows = WORKFLOWS[kind]['model'].objects.filter(status__in=states).values_list('status').annotate(n=Count('id'))
+    counts.update(rows)
+    cache.set_many({_counter_key(kind, state): count for state, count in counts.items()}, COUNTER_TTL)
+    return counts
+
+
+def inbox_counts(user):
+    """Số phiếu chờ user duyệt theo loại phiếu + 'total' (badge trên thanh menu)"""
+    result = {'total': 0}
+    for kind in WORKFLOWS:
+        states = inbox_states(kind, user)
+        counts = pending_counts(kind) if states else {}
+        result[kind] = sum(counts[state] for state in states)
+        result['total'] += result[kind]
+    return result
+
+
+def inbox(user, limit=INBOX_LIMIT):
+    """Phiếu đang chờ user duyệt, gộp mọi loại phiếu -> [{kind, label, count, slips}] (cũ nhất trước)"""
+    sections = []
+    for kind, workflow in WORKFLOWS.items():
+        states = inbox_states(kind, user)
+        if not states:
+            continue
+        counts = pending_counts(kind)
+        # Index (status, id) của từng loại phiếu
+        slips = workflow['model'].objects.filter(status__in=states).order_by('id')[:limit]
+        sections.append({
+            'kind': kind, 'label': workflow['label'],
+            'count': sum(counts[state] for state in states), 'slips': list(slips),
+        })
+    return sections
+
+
+def _record_transition(kind, moved, to_state):
+    """Sau khi commit: bớt bộ đếm của trạng thái cũ, cộng vào trạng thái mới (không cần đếm lại)"""
+    tracked = set(pending_states(kind))
+    for state, n in moved.items():
+        if state in tracked:
+            try:
+                cache.decr(_counter_key(kind, state), n)
+            except ValueError:
+                pass  # chưa có trong cache -> lần đọc sau tự đếm
+    if to_state in tracked:
+        try:
+            cache.incr(_counter_key(kind, to_state), sum(moved.values()))
+        except ValueError:
+            pass
+
+
+def invalidate_pending_counts(kind):
+    """Phiếu được tạo / sửa / xóa ngoài quy trình duyệt (xem signal trong models.py) -> sau khi commit, lần đọc sau đếm lại"""
+    keys = [_counter_key(kind, state) for state in pending_states(kind)]
+    transaction.on_commit(partial(cache.delete_many, keys))
+
+
+def _recipients(target, slip):
+    if target.startswith('group:'):
+        return get_emails_by_group(target[len('group:'):])
+    if target == CREATOR:
+        return [slip.created_by.email] if slip.created_by and slip.created_by.email else []
+    return [slip.email] if slip.email else []
+
+
+def _changes(transition, user):
+    """Các cột đổi khi làm thao tác (dùng cho .update())"""
+    now = timezone.now()
+    changes = {'status': transition['to']}
+    changes.update({field: now for field in transition.get('stamps', ())})
+    changes.update({field: Coalesce(field, Value(now)) for field in transition.get('stamps_if_empty', ())})
+    if transition.get('approver'):
+        changes[transition['approver']] = user
+    return changes
+
+
+def _history(workflow, transition, slip, user, note):
+    context = {'slip': slip, 'user': user, 'note': note, 'reason': note or 'Không có',
+               'status': slip.get_status_display()}
+    return workflow['history_model'](**{
+        workflow['history_fk']: slip, 'user': user,
+        'action': transition['history'].format(**context),
+        'note': workflow['history_note'].format(**context),
+    }), context
+
+
+def _get_transition(workflow, action):
+    transition = workflow['transitions'].get(action)
+    if transition is None:
+        raise TransitionError('Thao tác không hợp lệ.')
+    return transition
+
+
+def apply_transition(request, kind, slip, action, note=''):
+    """
+    Làm thao tác duyệt action trên phiếu -> phiếu đã đọc lại từ DB.
+    Không có quyền / thao tác lạ -> TransitionError; phiếu đã đổi trạng thái -> TransitionConflict.
+    """
+    workflow = WORKFLOWS[kind]
+    transition = _get_transition(workflow, action)
+    user = request.user
+    if slip.status not in transition['from']:
+        raise TransitionConflict(slip)
+    states = allowed_states(kind, action, user, slip)
+    if slip.status not in states:
+        raise TransitionError(transition.get('error', 'Bạn không có quyền thực hiện thao tác này!'))
+
+    model = workflow['model']
+    with transaction.atomic():
+        # Chỉ 1 request thắng: khóa dòng nếu trạng thái trong DB còn hợp lệ (như apply_bulk),
+        # lấy đúng trạng thái cũ của dòng để trừ bộ đếm
+        old_status = model.objects.select_for_update().filter(pk=slip.pk, status__in=states).values_list(
+            'status', flat=True
+        ).first()
+        if old_status is None:
+            slip.refresh_from_db()
+            raise TransitionConflict(slip)
+        model.objects.filter(pk=slip.pk).update(**_changes(transition, user))
+        slip.refresh_from_db()
+        transaction.on_commit(partial(_record_transition, kind, {old_status: 1}, transition['to']))
+        # .update() không phát post_save -> tự bỏ PDF đã cache (search_text không chứa trạng thái)
+        invalidate_slip_pdf(model._meta.model_name, slip.pk)
+
+        history, context = _history(workflow, transition, slip, user, note)
+        history.save()
+        recipients = _recipients(transition['notify'], slip)
+        if recipients:
+            subject = transition.get('subject', workflow.get('subject', ''))
+            workflow['send_email'](request, slip, subject.format(**context),
+                                   transition['message'].format(**context), recipients)
+    return slip
+
+
+def apply_bulk(request, kind, ids, action, note=''):
+    """
+    Làm 1 thao tác duyệt trên nhiều phiếu cùng lúc -> (các phiếu đã chuyển, id bị bỏ qua).
+    Kiểm tra quyền 1 lần, khóa + UPDATE theo tập, nhật ký bằng 1 bulk_create,
+    mỗi người nhận chỉ 1 mail tổng hợp. Phiếu sai trạng thái / không đủ quyền -> bỏ qua.
+    """
+    workflow = WORKFLOWS[kind]
+    transition = _get_transition(workflow, action)
+    if not transition.get('bulk'):
+        raise TransitionError('Thao tác này không làm hàng loạt được.')
+    user = request.user
+    states = [state for state, scope in _state_access(transition, user).items() if scope == 'all']
+    if not states:
+        raise TransitionError(transition.get('error', 'Bạn không có quyền thực hiện thao tác này!'))
+
+    model = workflow['model']
+    ids = list(dict.fromkeys(ids))[:BULK_LIMIT]
+    with transaction.atomic():
+        # Khóa các dòng còn đúng trạng thái rồi đổi cả tập bằng 1 câu UPDATE:
+        # phiếu người khác vừa xử lý không nằm trong tập -> không ghi nhật ký / mail lần 2
+        eligible = model.objects.select_for_update().filter(pk__in=ids, status__in=states)
+        locked = list(eligible.values_list('pk', 'status'))
+        done_ids = [pk for pk, _ in locked]
+        if done_ids:
+            model.objects.filter(pk__in=done_ids).update(**_changes(transition, user))
+            transaction.on_commit(partial(_record_transition, kind, Counter(status for _, status in locked),
+                                          transition['to']))
+        slips = list(model.objects.filter(pk__in=done_ids).select_related('created_by').order_by('pk'))
+        for slip in slips:
+            invalidate_slip_pdf(model._meta.model_name, slip.pk)
+
+        workflow['history_model'].objects.bulk_create(
+            [_history(workflow, transition, slip, user, note)[0] for slip in slips]
+        )
+
+        # Gom phiếu theo người nhận, người có cùng danh sách phiếu dùng chung 1 mail
+        by_recipient = {}
+        for slip in slips:
+            for email in _recipients(transition['notify'], slip):
+                by_recipient.setdefault(email, []).append(slip)
+        by_slips = {}
+        for email, recipient_slips in by_recipient.items():
+            by_slips.setdefault(tuple(slip.pk for slip in recipient_slips), (recipient_slips, []))[1].append(email)
+        if by_slips:
+            action_text = transition['history'].format(user=user, note=note, reason=note or 'Không có')
+            for recipient_slips, emails in by_slips.values():
+                send_summary_email(
+                    request, kind, recipient_slips,
+                    f"[Thông báo] {action_text}: {len(recipient_slips)} {workflow['label']}",
+                    f"{user.get_full_name() or user.username} đã thực hiện \"{action_text}\" "
+                    f"cho {len(recipient_slips)} {workflow['label']}."
+                    + (f"\nGhi chú: {note}" if note else ''),
+                    emails,
+                )
+    done = set(done_ids)
+    return slips, [pk for pk in ids if pk not in done]